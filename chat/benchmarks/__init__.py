@@ -0,0 +1,47 @@
+"""
+Benchmarks, run from the `chat` directory, e.g.:
+
+    python -m benchmarks.serialization
+
+They run against a throwaway test database.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chat.settings")
+    import django
+    from django.test.utils import override_settings
+
+    django.setup()
+    # the requests are sent in process from one address, faster than clients
+    # would, see CHAT_RATE_LIMITS
+    override_settings(CHAT_RATE_LIMITS={}).enable()
+
+
+@contextmanager
+def test_database():
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def timeit(func, repeat):
+    """Best time of `repeat` calls, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
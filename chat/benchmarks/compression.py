@@ -0,0 +1,111 @@
+"""
+Size of the `Message` table and of a poll of a conversation, with and
+without the compression of the large contents (CHAT_MESSAGE_COMPRESS_MIN_LENGTH)
+and the preview of the messages (`?preview=true`):
+
+    python -m benchmarks.compression --messages 10000 --logs 0.05
+
+The corpus is made of short chat messages, and pasted logs for a `--logs`
+share of them, a few hundred lines long. The table size is the one of the
+SQLite database after a VACUUM, the contents of the search index not
+included.
+"""
+
+import argparse
+import random
+from . import setup, test_database
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+
+def chat_message(rng):
+    words = ["order", "refund", "delivery", "parcel", "please", "thanks", "when"]
+    return " ".join(rng.choices(words, k=rng.randint(3, 20))).capitalize()
+
+
+def pasted_log(rng):
+    return "\n".join(
+        f"2024-03-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:"
+        f"{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} {rng.choice(LEVELS)} "
+        f"worker-{rng.randint(1, 8)} request {rng.randint(1000, 9999)} "
+        f"took {rng.randint(1, 900)}ms"
+        for _ in range(rng.randint(50, 400))
+    )
+
+
+def database_size():
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+        cursor.execute("PRAGMA page_count")
+        pages = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        return pages * cursor.fetchone()[0]
+
+
+def response_size(path):
+    from django.test import Client
+
+    response = Client().get(path)
+    assert response.status_code == 200, response.status_code
+    return len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--logs", type=float, default=0.05)
+    parser.add_argument("--conversations", type=int, default=100)
+    args = parser.parse_args()
+
+    setup()
+
+    from django.conf import settings
+    from django.db import connection, transaction
+    from django.test.utils import override_settings
+    from messages.models import Conversation, Message
+    from messages.search import uninstall
+
+    rng = random.Random(0)
+    corpus = [
+        pasted_log(rng) if rng.random() < args.logs else chat_message(rng)
+        for _ in range(args.messages)
+    ]
+    min_length = settings.CHAT_MESSAGE_COMPRESS_MIN_LENGTH
+
+    with test_database():
+        # the index would count the contents twice when they aren't compressed
+        with connection.schema_editor() as schema_editor:
+            uninstall(schema_editor)
+        conversations = Conversation.objects.bulk_create(
+            Conversation() for _ in range(args.conversations)
+        )
+        empty = database_size()
+
+        print(f"{'':>12} {'table':>10} {'poll':>10} {'poll preview':>13}")
+        for name, length in [("plain", None), ("compressed", min_length)]:
+            with override_settings(CHAT_MESSAGE_COMPRESS_MIN_LENGTH=length):
+                Message.objects.all().delete()
+                with transaction.atomic():
+                    Message.objects.bulk_create(
+                        Message(
+                            conversation=conversations[i % args.conversations],
+                            author=Message.AuthorChoice.CUSTOMER,
+                            content=content,
+                        )
+                        for i, content in enumerate(corpus)
+                    )
+            size = database_size() - empty
+            # a page of the messages of a conversation
+            path = f"/api/messages/{conversations[0].uuid}/?limit=100"
+            full = response_size(path)
+            preview = response_size(path + "&preview=true")
+            print(
+                f"{name:>12} {size / 1024 ** 2:>8.1f}MB {full / 1024:>8.0f}kB "
+                f"{preview / 1024:>11.0f}kB"
+            )
+
+
+if __name__ == "__main__":
+    main()
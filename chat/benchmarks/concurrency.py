@@ -0,0 +1,104 @@
+"""
+Concurrency of one worker with many idle clients.
+
+`--clients` customers long poll their conversation (`?wait=`), idle until a
+message is posted, while an active client lists the messages of another
+conversation. The worker runs the ASGI handler, where the views are async
+and an idle client only costs a task, or the WSGI handler with a pool of
+`--threads` threads, as a sync worker (e.g. `gunicorn --threads`) where each
+client holds a thread until it is answered:
+
+    python -m benchmarks.concurrency --clients 10 100 500 --threads 32
+
+Reported for each number of clients: the time to answer all the polls,
+which all time out after `--wait` seconds, and the latency of the active
+client's request, sent halfway through the wait.
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import setup, test_database
+
+
+def run_async(clients, poll_path, probe_path, settle):
+    from django.test import AsyncClient
+
+    async def request(path):
+        start = time.perf_counter()
+        response = await AsyncClient().get(path)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - start
+
+    async def main():
+        start = time.perf_counter()
+        polls = [asyncio.create_task(request(poll_path)) for _ in range(clients)]
+        # once the polls are waiting for a message
+        await asyncio.sleep(settle)
+        probe = await request(probe_path)
+        await asyncio.gather(*polls)
+        return time.perf_counter() - start, probe
+
+    return asyncio.run(main())
+
+
+def run_sync(clients, poll_path, probe_path, settle, threads):
+    from django.test import Client
+
+    def request(path, queued):
+        response = Client().get(path)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - queued
+
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        polls = [
+            executor.submit(request, poll_path, time.perf_counter())
+            for _ in range(clients)
+        ]
+        time.sleep(settle)
+        probe = executor.submit(request, probe_path, time.perf_counter())
+        probe = probe.result()
+        for poll in polls:
+            poll.result()
+        return time.perf_counter() - start, probe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--wait", type=float, default=2.0)
+    args = parser.parse_args()
+
+    setup()
+
+    from messages.models import Conversation
+
+    with test_database():
+        polled = Conversation.objects.create()
+        message = polled.messages.create(content="Hello", author="CUS")
+        active = Conversation.objects.create()
+        active.messages.create(content="Hello", author="CUS")
+        poll_path = f"/api/messages/{polled.uuid}/?since={message.id}&wait={args.wait}"
+        probe_path = f"/api/messages/{active.uuid}/"
+
+        print(
+            f"{'clients':>8} {'ASGI polls':>11} {'ASGI active':>12} "
+            f"{'WSGI polls':>11} {'WSGI active':>12}"
+        )
+        for clients in args.clients:
+            settle = args.wait / 2
+            async_total, async_probe = run_async(clients, poll_path, probe_path, settle)
+            sync_total, sync_probe = run_sync(
+                clients, poll_path, probe_path, settle, args.threads
+            )
+            print(
+                f"{clients:>8} {async_total:>10.2f}s {async_probe * 1000:>10.1f}ms "
+                f"{sync_total:>10.2f}s {sync_probe * 1000:>10.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
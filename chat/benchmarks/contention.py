@@ -0,0 +1,137 @@
+"""
+Throughput of the assignment of conversations with agents racing each other,
+each in a thread with its own database connection:
+
+    python -m benchmarks.contention --conversations 500 --agents 1 4 16
+
+- take: the agents all try to take the same conversation, one after the
+  other, exactly one of them gets it and the others a 409,
+- dispatch: the agents ask for the next waiting conversation until there is
+  none left, each conversation going to exactly one of them.
+
+Reported for each number of agents: the conversations assigned per second,
+and the conflicts of `take`.
+"""
+
+import argparse
+import logging
+import threading
+import time
+from collections import Counter
+from . import setup, test_database
+
+
+def make_agents(count, prefix="agent"):
+    from django.contrib.auth.models import Group, User
+    from django.test import Client
+
+    group, _ = Group.objects.get_or_create(name="agent")
+    clients = []
+    for i in range(count):
+        user = User.objects.create_user(f"{prefix}-{i}")
+        user.groups.add(group)
+        client = Client()
+        client.force_login(user)
+        clients.append((user, client))
+    return clients
+
+
+def race(agents, work):
+    """
+    Runs `work(user, client, results)` in a thread per agent, started at the
+    same time. Returns the counter of the results and the duration.
+    """
+    from django.db import connection
+
+    results = Counter()
+    errors = []
+    barrier = threading.Barrier(len(agents))
+
+    def run(user, client):
+        try:
+            barrier.wait()
+            work(user, client, results)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=agent) for agent in agents]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return results, duration
+
+
+def run_take(agents, ids):
+    """Every agent takes every conversation, in the same order."""
+    lock = threading.Lock()
+
+    def work(user, client, results):
+        for id in ids:
+            response = client.patch(f"/api/conversation/{id}/take")
+            with lock:
+                results[response.status_code] += 1
+                if response.status_code == 200:
+                    results[user.pk, id] += 1
+
+    return race(agents, work)
+
+
+def run_dispatch(agents):
+    """Every agent dispatches conversations to themself until there are none."""
+    lock = threading.Lock()
+
+    def work(user, client, results):
+        while True:
+            response = client.post("/api/conversation/dispatch")
+            with lock:
+                results[response.status_code] += 1
+                if response.status_code != 200:
+                    return
+                results[response.json()["id"]] += 1
+
+    return race(agents, work)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--agents", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    setup()
+    # the conflicts of `take`
+    logging.getLogger("django.request").setLevel(logging.ERROR)
+
+    from messages.models import Conversation
+
+    with test_database():
+        print(f"{'agents':>7} {'take':>10} {'conflicts':>10} {'dispatch':>10}")
+        for count in args.agents:
+            agents = make_agents(count, prefix=f"agent-{count}")
+            Conversation.objects.all().delete()
+            ids = [
+                conversation.id
+                for conversation in Conversation.objects.bulk_create(
+                    Conversation() for _ in range(args.conversations)
+                )
+            ]
+            results, take_duration = run_take(agents, ids)
+            conflicts = results[409]
+
+            Conversation.objects.update(assignee=None)
+            results, dispatch_duration = run_dispatch(agents)
+            print(
+                f"{count:>7} {len(ids) / take_duration:>8.0f}/s {conflicts:>10} "
+                f"{len(ids) / dispatch_duration:>8.0f}/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compares importing messages one at a time through `POST /api/messages/` with
+batches posted to `POST /api/messages/bulk`.
+"""
+
+import argparse
+import random
+import time
+from . import setup, test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    setup()
+
+    import uuid
+    from asgiref.sync import async_to_sync
+    from django.contrib.auth.models import User
+    from ninja.testing import TestAsyncClient
+    from messages.api_messages import router
+    from messages.models import Conversation
+
+    rng = random.Random(0)
+
+    def make_items():
+        conversations = [str(uuid.uuid4()) for _ in range(args.conversations)]
+        Conversation.objects.bulk_create(
+            Conversation(uuid=conversation) for conversation in conversations
+        )
+        return [
+            {"conversation": rng.choice(conversations), "content": f"Message {i}"}
+            for i in range(args.messages)
+        ]
+
+    with test_database():
+        client = TestAsyncClient(router)
+
+        # the views are async
+        @async_to_sync
+        async def post(path, **kwargs):
+            return await client.post(path, **kwargs)
+
+        # imports are for the staff
+        importer = User.objects.create_user("importer", is_staff=True)
+
+        items = make_items()
+        start = time.perf_counter()
+        for item in items:
+            post("/", json=item)
+        single = time.perf_counter() - start
+
+        items = make_items()
+        start = time.perf_counter()
+        for i in range(0, len(items), args.batch_size):
+            response = post(
+                "/bulk", json={"items": items[i : i + args.batch_size]}, user=importer
+            )
+            assert response.status_code == 200
+        bulk = time.perf_counter() - start
+
+    print(f"{args.messages} messages in {args.conversations} conversations")
+    print(f"one at a time: {args.messages / single:10.0f} messages/s")
+    print(
+        f"bulk ({args.batch_size}):   {args.messages / bulk:10.0f} messages/s"
+        f" ({single / bulk:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
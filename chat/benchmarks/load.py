@@ -0,0 +1,245 @@
+"""
+Load test of the chat API with a synthetic workload, see `workload`.
+
+In process, the requests go through the whole Django stack with the test
+client, against a throwaway database seeded for the run:
+
+    python -m benchmarks.load --conversations 1000 --messages 20000
+
+Against a running server, the configured database must be seeded first, and
+the server must use the same one:
+
+    python -m benchmarks.seed --conversations 1000 --messages 20000
+    ./manage.py runserver --noreload  # or an ASGI server, e.g. uvicorn chat.asgi:application
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 8
+
+Queries per request are only counted in process.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from . import setup, test_database
+
+
+class InProcessDriver:
+    """Sends the requests of the clients in turn with the Django test client."""
+
+    def __init__(self, clients):
+        from django.test import Client
+
+        self.sessions = {}
+        for client in clients:
+            session = Client()
+            if getattr(client, "user", None):
+                session.force_login(client.user)
+            self.sessions[client] = session
+
+    def send(self, client, request):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        session = self.sessions[client]
+        kwargs = {"headers": request.headers}
+        if request.data is not None:
+            kwargs["data"] = json.dumps(request.data)
+            kwargs["content_type"] = "application/json"
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = session.generic(request.method, request.path, **kwargs)
+            elapsed = time.perf_counter() - start
+        return (
+            response.status_code,
+            response.headers,
+            response.content,
+            elapsed,
+            len(queries),
+        )
+
+
+class HttpDriver:
+    """Sends the requests to a running server, the agents being logged in."""
+
+    def __init__(self, clients, url):
+        from django.middleware.csrf import _get_new_csrf_string
+        from django.test import Client
+
+        self.url = url.rstrip("/")
+        self.cookies = {}
+        for client in clients:
+            if getattr(client, "user", None):
+                session = Client()
+                session.force_login(client.user)
+                csrf_token = _get_new_csrf_string()
+                self.cookies[client] = {
+                    "Cookie": f"sessionid={session.cookies['sessionid'].value}; "
+                    f"csrftoken={csrf_token}",
+                    "X-CSRFToken": csrf_token,
+                }
+
+    def send(self, client, request):
+        body = None
+        headers = {**request.headers, **self.cookies.get(client, {})}
+        if request.data is not None:
+            body = json.dumps(request.data).encode()
+            headers["Content-Type"] = "application/json"
+        http_request = urllib.request.Request(
+            self.url + request.path, body, headers, method=request.method
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                status, content = response.status, response.read()
+                response_headers = response.headers
+        except urllib.error.HTTPError as error:
+            status, content = error.code, error.read()
+            response_headers = error.headers
+        elapsed = time.perf_counter() - start
+        return status, response_headers, content, elapsed, None
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name, status, elapsed, queries):
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if queries is not None:
+                self.queries[name].append(queries)
+            if status >= 400:
+                self.errors[name] += 1
+
+
+def run(driver, clients, requests, concurrency=1, random_seed=0):
+    """
+    Sends `requests` requests, from `concurrency` threads sharing the clients.
+
+    Each thread draws the requests of its clients from its own generator,
+    seeded with `random_seed` and its index, so that the threads don't
+    interleave their draws from a shared one.
+    """
+    concurrency = min(concurrency, len(clients))
+    results = Results()
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(index):
+        # round robin between the clients of the thread
+        mine = clients[index::concurrency]
+        rng = random.Random(random_seed + index)
+        for client in mine:
+            client.rng = rng
+        for position in itertools.count():
+            with lock:
+                if next(counter, None) is None:
+                    return
+            client = mine[position % len(mine)]
+            request = client.next_request()
+            status, headers, body, elapsed, queries = driver.send(client, request)
+            client.handle(request, status, headers, body)
+            results.add(request.name, status, elapsed, queries)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        worker(0)
+    else:
+        threads = [
+            threading.Thread(target=worker, args=(index,))
+            for index in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def report(results, duration):
+    lines = [
+        f"{'endpoint':<26}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'queries':>9}"
+    ]
+    total = 0
+    for name, latencies in sorted(results.latencies.items()):
+        latencies = sorted(latencies)
+        total += len(latencies)
+        queries = results.queries.get(name)
+        lines.append(
+            f"{name:<26}{len(latencies):>9}{results.errors[name]:>8}"
+            + "".join(
+                f"{percentile(latencies, fraction) * 1000:>9.2f}"
+                for fraction in (0.5, 0.95, 0.99)
+            )
+            + (f"{sum(queries) / len(queries):>9.2f}" if queries else f"{'-':>9}")
+        )
+    lines.append(f"{total} requests in {duration:.2f} s: {total / duration:.0f} req/s")
+    return "\n".join(lines)
+
+
+def add_seed_arguments(parser):
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--agents", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    add_seed_arguments(parser)
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--post-ratio", type=float, default=0.1)
+    parser.add_argument("--no-etag", action="store_true", help="no If-None-Match")
+    parser.add_argument("--url", help="server to test, instead of in process")
+    parser.add_argument("--concurrency", type=int, default=1, help="with --url")
+    args = parser.parse_args()
+
+    setup()
+
+    from .workload import make_clients, seed
+
+    def make():
+        return make_clients(
+            args.customers, args.post_ratio, args.skew, not args.no_etag, args.seed
+        )
+
+    if args.url:
+        clients = make()
+        results, duration = run(
+            HttpDriver(clients, args.url),
+            clients,
+            args.requests,
+            args.concurrency,
+            args.seed,
+        )
+    else:
+        with test_database():
+            seed(args.conversations, args.messages, args.skew, args.agents, args.seed)
+            clients = make()
+            results, duration = run(
+                InProcessDriver(clients), clients, args.requests, random_seed=args.seed
+            )
+    print(report(results, duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Latency of the full-text search of the messages as the history grows,
+against a `content__icontains` scan:
+
+    python -m benchmarks.search --messages 10000 100000 300000
+
+Messages are made of words drawn from a vocabulary with a Zipf-like skew, so
+that searches for common words have many matches and searches for rare ones
+a few.
+"""
+
+import argparse
+import random
+from . import setup, test_database, timeit
+
+VOCABULARY = 5000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--messages", type=int, nargs="+", default=[10000, 100000, 300000]
+    )
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+
+    from django.db import transaction
+    from messages.models import Conversation, Message
+    from messages.search import search
+
+    rng = random.Random(0)
+    words = [f"word{i}" for i in range(VOCABULARY)]
+    skew = [1 / (rank + 1) for rank in range(VOCABULARY)]
+    queries = {"common": words[0], "rare": words[-1], "two words": "word1 word2"}
+
+    with test_database():
+        conversations = Conversation.objects.bulk_create(
+            Conversation() for _ in range(args.conversations)
+        )
+        print(
+            f"{'messages':>9} "
+            + " ".join(f"{name + ' (FTS)':>17} {'(scan)':>8}" for name in queries)
+        )
+        count = 0
+        for total in args.messages:
+            with transaction.atomic():
+                while count < total:
+                    batch = min(1000, total - count)
+                    Message.objects.bulk_create(
+                        Message(
+                            conversation=rng.choice(conversations),
+                            author=Message.AuthorChoice.CUSTOMER,
+                            content=" ".join(rng.choices(words, skew, k=12)),
+                        )
+                        for _ in range(batch)
+                    )
+                    count += batch
+
+            results = []
+            for query in queries.values():
+                results.append(timeit(lambda: search(query, 20), args.repeat))
+                scan = Message.objects.all()
+                for word in query.split():
+                    scan = scan.filter(content__icontains=word)
+                scan = scan.values_list("conversation", flat=True)
+                results.append(timeit(lambda: set(scan.all()), args.repeat))
+            print(
+                f"{count:>9} "
+                + " ".join(
+                    f"{fts:>15.1f}ms {scan:>6.1f}ms"
+                    for fts, scan in zip(results[::2], results[1::2])
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+Seeds the configured database with a synthetic workload, see `workload`, to
+load test a running server with `benchmarks.load --url`.
+"""
+
+import argparse
+from . import setup
+from .load import add_seed_arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_seed_arguments(parser)
+    args = parser.parse_args()
+
+    setup()
+
+    from .workload import seed
+
+    seed(args.conversations, args.messages, args.skew, args.agents, args.seed)
+    print(f"{args.conversations} conversations, {args.messages} messages created")
+
+
+if __name__ == "__main__":
+    main()
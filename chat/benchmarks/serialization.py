@@ -0,0 +1,49 @@
+"""
+Compares rendering a page of messages through the `MessageOut` schema with
+the fast path rendering database rows directly (CHAT_FAST_SERIALIZATION).
+"""
+
+import argparse
+from . import setup, test_database, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+
+    from asgiref.sync import async_to_sync
+    from django.test import override_settings
+    from ninja.testing import TestAsyncClient
+    from messages import renderers
+    from messages.api_messages import router
+    from messages.models import Conversation, Message
+
+    with test_database():
+        conversation = Conversation.objects.create()
+        Message.objects.bulk_create(
+            Message(conversation=conversation, author="CUS", content=f"Message {i}")
+            for i in range(args.messages)
+        )
+        client = TestAsyncClient(router)
+
+        @async_to_sync
+        async def list_messages():
+            response = await client.get(f"/{conversation.uuid}/?limit={args.messages}")
+            assert response.status_code == 200
+
+        list_messages()
+
+        print(f"{args.messages} messages, orjson: {renderers.orjson is not None}")
+        with override_settings(CHAT_FAST_SERIALIZATION=False):
+            schema = timeit(list_messages, args.repeat)
+        fast = timeit(list_messages, args.repeat)
+        print(f"schema validation: {schema:8.2f} ms")
+        print(f"fast path:         {fast:8.2f} ms ({schema / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
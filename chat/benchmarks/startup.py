@@ -0,0 +1,132 @@
+"""
+Start up time of a worker process with the full settings (`chat.asgi`) and the
+API-only ones (`chat.asgi_api`): time to import the entry point, and latency
+of the first request and of the next one, and number of modules loaded:
+
+    python -m benchmarks.startup --runs 5
+
+Each run is a new process. The request is a poll of a conversation, sent to
+the ASGI application of the entry point. The import time doesn't include the
+start of the interpreter.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from . import setup, test_database
+
+ENTRY_POINTS = {"full": "chat.asgi", "api": "chat.asgi_api"}
+
+
+async def get(application, path):
+    """Status of the response of the ASGI application to a GET request."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("localhost", 80),
+    }
+    response = {}
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # the client stays connected until the response is sent
+        await asyncio.Future()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await application(scope, receive, send)
+    return response["status"]
+
+
+def child(entry_point, path):
+    """Runs in the process started, prints its times in milliseconds."""
+    from importlib import import_module
+
+    start = time.perf_counter()
+    application = import_module(entry_point).application
+    times = {"import": time.perf_counter() - start}
+    for request in ["first", "second"]:
+        start = time.perf_counter()
+        status = asyncio.run(get(application, path))
+        times[request] = time.perf_counter() - start
+        assert status == 200, status
+    times = {key: value * 1000 for key, value in times.items()}
+    print(json.dumps(dict(times, modules=len(sys.modules))))
+
+
+def run(entry_point, path, database):
+    env = dict(os.environ, CHAT_DB_NAME=str(database))
+    # chosen by the entry point
+    env.pop("DJANGO_SETTINGS_MODULE", None)
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", entry_point, path],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    setup()
+
+    from django.db import connection
+    from messages.models import Conversation, Message
+
+    with test_database():
+        conversation = Conversation.objects.create()
+        for i in range(20):
+            Message.objects.create(
+                conversation=conversation,
+                author=Message.AuthorChoice.CUSTOMER,
+                content=f"Message {i}",
+            )
+        path = f"/api/messages/{conversation.uuid}/"
+        database = connection.settings_dict["NAME"]
+
+        print(
+            f"{'':>5} {'entry point':<14} {'import':>8} {'first':>8} {'second':>8}"
+            f" {'modules':>8}"
+        )
+        for name, entry_point in ENTRY_POINTS.items():
+            runs = [run(entry_point, path, database) for _ in range(args.runs)]
+            print(
+                f"{name:>5} {entry_point:<14}"
+                + "".join(
+                    f" {statistics.median(times[key] for times in runs):>6.1f}ms"
+                    for key in ["import", "first", "second"]
+                )
+                + f" {runs[0]['modules']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
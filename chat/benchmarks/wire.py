@@ -0,0 +1,58 @@
+"""
+Size on the wire of a page of messages and of conversations, in each format
+the API negotiates (`Accept`) and each compression (`Accept-Encoding`):
+
+    python -m benchmarks.wire --limit 20 100
+
+MessagePack and brotli are only measured when `msgpack` and `brotli` are
+installed.
+"""
+
+import argparse
+from . import setup, test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--limit", type=int, nargs="+", default=[20, 100])
+    args = parser.parse_args()
+
+    setup()
+
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from messages.middleware import ENCODINGS
+    from messages.models import Conversation
+    from messages.renderers import FORMATS
+    from .workload import AGENT_PREFIX, seed
+
+    with test_database():
+        seed(conversations=200, messages=2000, agents=1)
+        conversation = Conversation.objects.order_by("-message_count").first()
+        client = Client()
+        client.force_login(User.objects.get(username__startswith=AGENT_PREFIX))
+
+        encodings = ["identity", *ENCODINGS]
+        print(f"{'':>57}" + "".join(f"{encoding:>10}" for encoding in encodings))
+        for limit in args.limit:
+            for name, path in [
+                ("messages", f"/api/messages/{conversation.uuid}/?limit={limit}"),
+                ("conversations", f"/api/conversation/?limit={limit}"),
+            ]:
+                for media_type in FORMATS:
+                    sizes = []
+                    for encoding in encodings:
+                        response = client.get(
+                            path,
+                            headers={"Accept": media_type, "Accept-Encoding": encoding},
+                        )
+                        assert response.status_code == 200, response.status_code
+                        sizes.append(len(response.content))
+                    print(
+                        f"{limit:>3} {name:<14} {media_type:<38}"
+                        + "".join(f"{size:>9}B" for size in sizes)
+                    )
+
+
+if __name__ == "__main__":
+    main()
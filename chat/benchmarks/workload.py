@@ -0,0 +1,206 @@
+"""
+Synthetic chat workload: seeded data and the clients sending requests.
+
+Conversations get messages with a Zipf-like skew, a few conversations being
+very active and most of them short, and customers poll the conversations
+with the same skew. Everything is drawn from seeded random generators, one
+per thread sending requests (see `benchmarks.load.run`), so that runs with the
+same arguments are comparable.
+"""
+
+import io
+import json
+import random
+from collections import Counter
+from typing import NamedTuple
+
+AGENT_PREFIX = "bench-agent-"
+
+
+def weights(count, skew):
+    """Weight of the conversation of each rank, 1 / rank ** skew."""
+    return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+def seed(conversations, messages, skew=1.0, agents=5, random_seed=0, batch_size=1000):
+    """
+    Creates `conversations` conversations with `messages` messages in total,
+    at least one each, and `agents` agent users.
+    """
+    from django.contrib.auth.models import Group, User
+    from django.core.management import call_command
+    from django.db import transaction
+    from messages.models import Conversation, Message
+    from messages.roles import AGENT
+
+    rng = random.Random(random_seed)
+    group, _ = Group.objects.get_or_create(name=AGENT)
+    for i in range(agents):
+        user, _ = User.objects.get_or_create(username=f"{AGENT_PREFIX}{i}")
+        user.groups.add(group)
+
+    counts = Counter(range(conversations))
+    counts.update(
+        rng.choices(
+            range(conversations),
+            weights(conversations, skew),
+            k=max(messages - conversations, 0),
+        )
+    )
+
+    with transaction.atomic():
+        created = Conversation.objects.bulk_create(
+            (
+                Conversation(
+                    customer_name=f"Customer {i}",
+                    status=(
+                        Conversation.ConversationStatus.CLOSED
+                        if rng.random() < 0.2
+                        else Conversation.ConversationStatus.OPEN
+                    ),
+                )
+                for i in range(conversations)
+            ),
+            batch_size=batch_size,
+        )
+        batch = []
+        for rank, conversation in enumerate(created):
+            author = Message.AuthorChoice.CUSTOMER
+            for i in range(counts[rank]):
+                batch.append(
+                    Message(
+                        conversation=conversation,
+                        author=author,
+                        content=f"Message {i} " + "lorem ipsum " * rng.randint(1, 20),
+                    )
+                )
+                if rng.random() < 0.5:
+                    author = (
+                        Message.AuthorChoice.AGENT
+                        if author == Message.AuthorChoice.CUSTOMER
+                        else Message.AuthorChoice.CUSTOMER
+                    )
+            if len(batch) >= batch_size:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+
+    call_command("backfill_conversations", batch_size=batch_size, stdout=io.StringIO())
+
+
+class Request(NamedTuple):
+    name: str
+    method: str
+    path: str
+    data: dict = None
+    headers: dict = {}
+
+
+class Customer:
+    """Polls a conversation with `since`, and sometimes posts a message."""
+
+    def __init__(self, conversation, rng, post_ratio, etag=True):
+        self.conversation = conversation
+        self.rng = rng
+        self.post_ratio = post_ratio
+        self.etag = etag
+        self.since = None
+        self.last = (None, None)
+
+    def next_request(self):
+        query = f"?since={self.since}" if self.since else ""
+        if self.rng.random() < self.post_ratio:
+            return Request(
+                "create_message_and_list",
+                "POST",
+                f"/api/messages/{query}",
+                {"conversation": self.conversation, "content": "Hello"},
+            )
+        path = f"/api/messages/{self.conversation}/{query}"
+        headers = {}
+        # as browsers do with the ETag of the previous response
+        if self.etag and self.last[0] == path:
+            headers["If-None-Match"] = self.last[1]
+        return Request("list_messages", "GET", path, headers=headers)
+
+    def handle(self, request, status, headers, body):
+        if status != 200:
+            return
+        if request.method == "GET" and "ETag" in headers:
+            self.last = (request.path, headers["ETag"])
+        items = json.loads(body)["items"]
+        if items:
+            self.since = items[-1]["id"]
+
+
+class Agent:
+    """Lists the conversations awaiting a reply, takes and answers them."""
+
+    def __init__(self, user, rng):
+        self.user = user
+        self.rng = rng
+        self.conversations = []
+
+    def next_request(self):
+        draw = self.rng.random()
+        # the conversations of other agents can't be taken
+        takeable = [
+            conversation
+            for conversation in self.conversations
+            if conversation["assignee"] in (None, self.user.pk)
+        ]
+        if takeable and draw < 0.1:
+            conversation = self.rng.choice(takeable)
+            return Request(
+                "take_conversation",
+                "PATCH",
+                f"/api/conversation/{conversation['id']}/take",
+            )
+        if self.conversations and draw < 0.3:
+            conversation = self.rng.choice(self.conversations)
+            return Request(
+                "create_message_and_list",
+                "POST",
+                f"/api/messages/?since={conversation['last_message']}",
+                {
+                    "conversation": conversation["uuid"],
+                    "content": "Hi, how can I help?",
+                },
+            )
+        query = self.rng.choice(
+            ["awaiting_reply=true", "assigned_to_me=true&order=recent"]
+        )
+        return Request(
+            "list_conversations", "GET", f"/api/conversation/?{query}&limit=20"
+        )
+
+    def handle(self, request, status, headers, body):
+        if status == 200 and request.name == "list_conversations":
+            self.conversations = json.loads(body)["items"]
+
+
+def make_clients(customers, post_ratio=0.1, skew=1.0, etag=True, random_seed=0):
+    """Customers of the seeded conversations, and one client per seeded agent."""
+    from django.contrib.auth.models import User
+    from messages.models import Conversation
+
+    rng = random.Random(random_seed)
+    conversations = [
+        str(uuid)
+        for uuid in Conversation.objects.filter(
+            status=Conversation.ConversationStatus.OPEN
+        )
+        .order_by("id")
+        .values_list("uuid", flat=True)
+    ]
+    if not conversations:
+        raise ValueError("No open conversation, seed the database first")
+    picked = rng.choices(conversations, weights(len(conversations), skew), k=customers)
+    clients = [Customer(uuid, rng, post_ratio, etag) for uuid in picked]
+    clients += [
+        Agent(user, rng)
+        for user in User.objects.filter(username__startswith=AGENT_PREFIX).order_by(
+            "id"
+        )
+    ]
+    return clients
@@ -1,6 +1,35 @@
-from ninja import NinjaAPI
+from functools import partial
+from ninja.errors import Throttled
+from messages.ratelimit import rate_limited
+from messages.renderers import JSONRenderer, NegotiatedAPI
 
-api = NinjaAPI()
+
+class ChatAPI(NegotiatedAPI):
+    """
+    Builds the OpenAPI schema of the docs on their first request, once per
+    process, instead of on each request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # by path prefix
+        self._schemas = {}
+
+    def get_openapi_schema(self, *, path_prefix=None, path_params=None):
+        if path_prefix is None:
+            path_prefix = self.get_root_path(path_params or {})
+        if path_prefix not in self._schemas:
+            self._schemas[path_prefix] = super().get_openapi_schema(
+                path_prefix=path_prefix
+            )
+        return self._schemas[path_prefix]
+
+
+# JSON, or the format negotiated with the client
+api = ChatAPI(renderer=JSONRenderer())
+# with a Retry-After header
+api.add_exception_handler(Throttled, partial(rate_limited, api=api))
 
 api.add_router("/messages", "messages.api_messages.router")
 api.add_router("/conversation", "messages.api_conversations.router")
+api.add_router("/metrics", "messages.api_metrics.router")
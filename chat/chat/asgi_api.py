@@ -0,0 +1,19 @@
+"""
+ASGI config of the API worker processes, see `chat.settings_api`, e.g.:
+
+    uvicorn chat.asgi_api:application --workers 4
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+from django.urls import get_resolver
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chat.settings_api")
+
+application = get_asgi_application()
+
+# imports the API while the worker starts, rather than on its first request
+get_resolver().url_patterns
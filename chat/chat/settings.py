@@ -10,7 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import copy
+import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,12 +45,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "messages.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "messages.middleware.ReadYourWritesMiddleware",
+    "messages.middleware.MetricsMiddleware",
 ]
 
 ROOT_URLCONF = "chat.urls"
@@ -74,12 +80,90 @@ WSGI_APPLICATION = "chat.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# The profile is chosen with the CHAT_DATABASE environment variable:
+# - "sqlite" (default), for a single node: in WAL mode, so that readers and the
+#   writer don't block each other,
+# - "postgresql": connections from a pool (needs psycopg[pool]), or one per
+#   request with CHAT_DB_POOL_SIZE=0, behind PgBouncer.
+CHAT_DATABASE = os.environ.get("CHAT_DATABASE", "sqlite")
+
+if CHAT_DATABASE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("CHAT_DB_NAME", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # writers take the lock when their transaction starts, waiting
+                # for each other, instead of failing when upgrading a read lock
+                "transaction_mode": "IMMEDIATE",
+                # busy timeout, in seconds
+                "timeout": float(os.environ.get("CHAT_DB_TIMEOUT", 20)),
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    # durable at checkpoints only, safe from corruption in WAL mode
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA cache_size=-32000;"
+                    "PRAGMA mmap_size=268435456;"
+                    "PRAGMA temp_store=MEMORY;"
+                ),
+            },
+            # on disk, so that the tests run in WAL mode too
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+        }
     }
-}
+elif CHAT_DATABASE == "postgresql":
+    CHAT_DB_POOL_SIZE = int(os.environ.get("CHAT_DB_POOL_SIZE", 10))
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("CHAT_DB_NAME", "chat"),
+            "USER": os.environ.get("CHAT_DB_USER", ""),
+            "PASSWORD": os.environ.get("CHAT_DB_PASSWORD", ""),
+            "HOST": os.environ.get("CHAT_DB_HOST", ""),
+            "PORT": os.environ.get("CHAT_DB_PORT", ""),
+            "OPTIONS": {},
+        }
+    }
+    if CHAT_DB_POOL_SIZE:
+        # shared by the threads of the process, the async views included
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": min(2, CHAT_DB_POOL_SIZE),
+            "max_size": CHAT_DB_POOL_SIZE,
+            "timeout": float(os.environ.get("CHAT_DB_TIMEOUT", 20)),
+        }
+    else:
+        # a connection per request, to the external pooler: persistent ones are
+        # per thread, which the async views don't keep from one request to another
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        # the pooler may serve each transaction on another server connection
+        DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+else:
+    raise ImproperlyConfigured(
+        f"Unknown CHAT_DATABASE {CHAT_DATABASE!r}, use sqlite or postgresql"
+    )
+
+# Read replicas the polls are read from, comma separated hosts (postgresql) or
+# files (sqlite, e.g. replicated by LiteFS), see messages.routers
+CHAT_DB_REPLICAS = []
+for number, location in enumerate(
+    filter(None, os.environ.get("CHAT_DB_REPLICAS", "").split(",")), 1
+):
+    alias = f"replica{number}"
+    DATABASES[alias] = copy.deepcopy(DATABASES["default"])
+    DATABASES[alias]["HOST" if CHAT_DATABASE == "postgresql" else "NAME"] = location
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    CHAT_DB_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["messages.routers.ReplicaRouter"]
+
+# operations reading from the replicas, and seconds for which a client reads
+# from the primary after a write, so that it sees it (not list_conversations,
+# tagged with a version changed on the primary, see messages.conditional)
+CHAT_REPLICA_OPERATIONS = [
+    "list_messages",
+    "search_conversations",
+]
+CHAT_READ_YOUR_WRITES_WINDOW = 5
 
 
 # Password validation
@@ -101,6 +185,30 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# the local memory cache is per process: deployments with several processes
+# need a shared cache for the invalidations to reach all of them
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # last messages of the active conversations, see messages.recent
+    "messages": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "messages",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    # version of the lists of conversations, see messages.conditional: in files
+    # shared by the processes of the host, Redis or Memcached with several hosts
+    "versions": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("CHAT_VERSION_CACHE_DIR", BASE_DIR / "versions"),
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -122,3 +230,97 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Django Ninja
+# https://django-ninja.dev/reference/settings/
+
+NINJA_PAGINATION_CLASS = "messages.pagination.KeysetPagination"
+
+
+# Chat
+
+# maximum time a long-polling request is held open, in seconds
+CHAT_LONG_POLL_MAX_WAIT = 30
+
+# backend pushing new messages to long-polling and streaming requests
+CHAT_NOTIFIER_BACKEND = "messages.notifier.InMemoryNotifier"
+
+# interval between keepalive comments on idle message streams, in seconds
+CHAT_STREAM_KEEPALIVE = 15
+
+# how long the groups of a user are cached, in seconds
+CHAT_ROLES_CACHE_TIMEOUT = 300
+
+# render message lists from database rows, without validating model instances
+CHAT_FAST_SERIALIZATION = True
+
+# where messages are stored, see messages.storage and messages.log
+CHAT_MESSAGE_STORAGE = "messages.storage.DatabaseStorage"
+
+# messages.log.LogStorage: directory and size of the segments of the log, in bytes
+CHAT_MESSAGE_LOG_DIR = BASE_DIR / "message_log"
+CHAT_MESSAGE_LOG_SEGMENT_SIZE = 1024 * 1024
+# flush the appends to the disk before acknowledging them
+CHAT_MESSAGE_LOG_FSYNC = False
+# interval between copies of the log to the database, in seconds (0: only by the
+# replicate_messages command), and number of messages copied at once
+CHAT_MESSAGE_LOG_REPLICATION_INTERVAL = 1.0
+CHAT_MESSAGE_LOG_REPLICATION_BATCH = 1000
+
+# cache of the version of the lists of conversations, which must be shared by
+# the processes
+CHAT_VERSION_CACHE_ALIAS = "versions"
+
+# cache of the last messages of each active conversation
+CHAT_MESSAGE_CACHE_ALIAS = "messages"
+CHAT_MESSAGE_CACHE_SIZE = 50
+CHAT_MESSAGE_CACHE_TIMEOUT = 3600
+
+# closed conversations without messages for this many days are archived by the
+# archive_messages command
+CHAT_ARCHIVE_AFTER_DAYS = 90
+# ids per partition of the Message table, see the partition_messages command
+CHAT_MESSAGE_PARTITION_SIZE = 10_000_000
+
+# message contents from this length on are stored compressed (None: never), see
+# messages.fields.CompressedTextField, and truncated to the preview length in
+# the lists of messages requested with ?preview=true
+CHAT_MESSAGE_COMPRESS_MIN_LENGTH = 1024
+CHAT_MESSAGE_PREVIEW_LENGTH = 500
+
+# maximum number of messages posted at once to /api/messages/bulk
+CHAT_BULK_MAX_ITEMS = 5000
+
+# token buckets limiting the requests of each operation, by conversation, user
+# (or session) and client IP, as (requests per second, burst), see
+# messages.ratelimit; behind proxies, see NINJA_NUM_PROXIES for the client IP
+CHAT_RATE_LIMITS = {
+    "list_messages": {"conversation": (5, 30), "ip": (50, 300)},
+    "get_message": {"conversation": (5, 30), "ip": (50, 300)},
+    "stream_messages": {"conversation": (1, 10), "ip": (10, 50)},
+    "create_message_and_list": {"ip": (20, 100)},
+    "create_messages": {"user": (2, 10), "ip": (2, 10)},
+    "list_conversations": {"user": (10, 50)},
+    "search_conversations": {"user": (5, 20)},
+    "unread_counts": {"user": (10, 50)},
+    "dispatch_conversation": {"user": (2, 10)},
+}
+# where the buckets are kept: InMemoryBuckets per process, or CacheBuckets in
+# the CHAT_RATE_LIMIT_CACHE_ALIAS cache, to share them between processes
+CHAT_RATE_LIMIT_BACKEND = "messages.ratelimit.InMemoryBuckets"
+CHAT_RATE_LIMIT_CACHE_ALIAS = "default"
+
+# API responses from this size on, in bytes, are compressed with brotli or gzip,
+# see messages.middleware.CompressionMiddleware
+CHAT_COMPRESS_MIN_SIZE = 1024
+
+# identical concurrent polls share their query and response, see messages.coalesce
+CHAT_COALESCE_POLLS = True
+
+# log the slowest requests so far with their SQL queries, up to this number
+CHAT_METRICS_SLOW_REQUESTS = 0
+
+# bearer token of the Prometheus servers scraping /api/metrics, also readable by
+# the staff users; unset, the metrics are for the staff only
+CHAT_METRICS_TOKEN = os.environ.get("CHAT_METRICS_TOKEN", "")
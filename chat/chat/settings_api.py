@@ -0,0 +1,51 @@
+"""
+Settings of the API worker processes, which only serve `/api/`: the settings
+of `chat.settings` without the admin, `django.contrib.messages`, the static
+files and the middleware the API doesn't use, so that the workers start faster.
+
+They are used by the `chat.asgi_api` and `chat.wsgi_api` entry points. The
+admin and the management commands keep using `chat.settings`.
+"""
+
+import os
+from .settings import *  # noqa: F401, F403
+from .settings import INSTALLED_APPS, MIDDLEWARE
+
+unused_apps = [
+    "django.contrib.admin",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+]
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in unused_apps]
+
+# Ninja checks the CSRF token of the session authenticated requests itself, and
+# the JSON responses aren't displayed in frames
+unused_middleware = [
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE if middleware not in unused_middleware
+]
+
+ROOT_URLCONF = "chat.urls_api"
+
+# for the page of the API docs only, rendered from the template of Ninja
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [],
+        "APP_DIRS": False,
+        "OPTIONS": {},
+    },
+]
+
+WSGI_APPLICATION = "chat.wsgi_api.application"
+
+# also spares the SQL queries kept by Django and the inspection of the stack by
+# Ninja on import, looking for runserver
+DEBUG = False
+
+# comma separated
+ALLOWED_HOSTS = os.environ.get("CHAT_ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
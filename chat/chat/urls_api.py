@@ -0,0 +1,11 @@
+"""
+URL configuration of the API, alone in the API worker processes (see
+`chat.settings_api`) and included by `chat.urls`.
+"""
+
+from django.urls import path
+from .api import api
+
+urlpatterns = [
+    path("api/", api.urls),
+]
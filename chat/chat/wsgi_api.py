@@ -0,0 +1,17 @@
+"""
+WSGI config of the API worker processes, see `chat.settings_api`.
+
+It exposes the WSGI callable as a module-level variable named ``application``.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chat.settings_api")
+
+application = get_wsgi_application()
+
+# imports the API while the worker starts, rather than on its first request
+get_resolver().url_patterns
@@ -1,13 +1,33 @@
-from datetime import datetime
+import uuid
 from typing import List, Optional
-from django.shortcuts import get_object_or_404
-from ninja import Schema, ModelSchema
-from ninja.pagination import RouterPaginated
-from .models import Conversation
-from ninja.security import django_auth
+from asgiref.sync import sync_to_async
+from django.db.models import Value
+from django.db.models.lookups import Exact
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from ninja import Query, Schema, ModelSchema
+from ninja.errors import HttpError
+from ninja.security import SessionAuth
+from .assignment import Conflict, dispatch, set_status, take
+from .conditional import (
+    aconversations_version,
+    is_not_modified,
+    make_etag,
+    not_modified,
+    set_etag,
+)
+from .models import ASSIGNED, Conversation, Message
+from .pagination import RouterPaginated
+from .ratelimit import rate_limits
+from .renderers import negotiate
+from .roles import aget_user, ais_agent
+from .search import search
+from .unread import unread_conversations
 
 router = RouterPaginated()
 
+PREVIEW_LENGTH = 100
+
 
 class ConversationOut(ModelSchema):
 
@@ -21,59 +41,216 @@ class ConversationOut(ModelSchema):
             "customer_email",
             "status",
             "assignee",
+            "last_message",
+            "last_message_at",
+            "last_author",
+            "message_count",
         ]
 
+    last_message_preview: Optional[str] = None
+
+    @staticmethod
+    def resolve_last_message_preview(obj):
+        if obj.last_message_id is None:
+            return None
+        return obj.last_message.content[:PREVIEW_LENGTH]
+
+
+class ConversationMatchOut(Schema):
+    conversation: ConversationOut
+    rank: float
+    # matching messages of the conversation, among the best ones of the search
+    matches: int
+    # the best matching message, and its text around the match
+    message: int
+    excerpt: str
 
-def agent_auth(request):
-    if (
-        request.user.is_authenticated
-        and request.user.groups.filter(name="agent").exists()
-    ):
-        return request.user
+
+class SearchOut(Schema):
+    items: List[ConversationMatchOut]
+
+
+async def agent_auth(request):
+    if await ais_agent(request):
+        return await aget_user(request)
     return None
 
 
-@router.get("/", response=List[ConversationOut], auth=agent_auth)
-def list_conversations(
-    request, assigned: str = None, status: str = None, assigned_to_me: bool = None
+class AsyncSessionAuth(SessionAuth):
+    """`django_auth` for async views."""
+
+    async def authenticate(self, request, key):
+        user = await aget_user(request)
+        if user.is_authenticated:
+            return user
+        return None
+
+
+async_django_auth = AsyncSessionAuth()
+
+
+@router.get(
+    "/",
+    response=List[ConversationOut],
+    auth=agent_auth,
+    throttle=rate_limits("list_conversations"),
+)
+async def list_conversations(
+    request,
+    assigned: str = None,
+    status: str = None,
+    assigned_to_me: bool = None,
+    awaiting_reply: bool = None,
+    order: str = None,
+    response: HttpResponse = None,
 ):
-    conversations = Conversation.objects.all()
+    # any change to a conversation changes the lists, see `conversations_version`
+    etag = make_etag(
+        request,
+        await aconversations_version(),
+        request.auth.pk,
+        negotiate(request).media_type,
+    )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    conversations = Conversation.objects.select_related("last_message")
     if assigned == "true":
-        conversations = conversations.filter(assignee__isnull=False)
+        # compared to a value, not a bare condition, so that the index on it,
+        # conversation_assigned_idx, is searched
+        conversations = conversations.filter(Exact(ASSIGNED, Value(True)))
     elif assigned == "false":
         conversations = conversations.filter(assignee__isnull=True)
 
     if assigned_to_me:
-        conversations = conversations.filter(assignee=request.user)
+        conversations = conversations.filter(assignee=request.auth)
 
     if status:
         conversations = conversations.filter(status=status)
 
-    return conversations.order_by("created_at")
+    # most recent activity first, conversations without messages are left out
+    if order == "recent":
+        conversations = conversations.filter(last_message_at__isnull=False)
 
+    # last message from the customer, the agent has to reply
+    if awaiting_reply:
+        conversations = conversations.filter(last_author=Message.AuthorChoice.CUSTOMER)
+        if order != "recent":
+            # the customers waiting for the longest time first
+            return conversations.order_by("last_message_at", "id")
 
-@router.patch("/{id}/close", response=ConversationOut, auth=agent_auth)
-def close_conversation(request, id: int):
-    conversation = get_object_or_404(Conversation, pk=id)
-    conversation.status = Conversation.ConversationStatus.CLOSED
-    conversation.save()
+    if order == "recent":
+        return conversations.order_by("-last_message_at", "-id")
+
+    return conversations.order_by("created_at", "id")
 
-    return conversation
+
+@router.get(
+    "/search",
+    response=SearchOut,
+    auth=agent_auth,
+    throttle=rate_limits("search_conversations"),
+)
+async def search_conversations(request, q: str, limit: int = Query(20, ge=1, le=100)):
+    """Conversations with messages matching `q`, best first."""
+    matches = await sync_to_async(search)(q, limit)
+    conversations = await Conversation.objects.select_related("last_message").ain_bulk(
+        [match.conversation for match in matches]
+    )
+    return {
+        "items": [
+            dict(vars(match), conversation=conversations[match.conversation])
+            for match in matches
+        ]
+    }
+
+
+class UnreadConversationOut(Schema):
+    id: int
+    uuid: uuid.UUID
+    unread: int
+
+
+class UnreadOut(Schema):
+    # conversations with unread messages
+    waiting: int
+    # unread messages
+    unread: int
+    conversations: List[UnreadConversationOut]
+
+
+@router.get(
+    "/unread",
+    response=UnreadOut,
+    auth=agent_auth,
+    throttle=rate_limits("unread_counts"),
+)
+async def unread_counts(request):
+    """
+    Unread messages of the customers in the agent's inbox, see
+    `unread_conversations`.
+    """
+    conversations = [row async for row in unread_conversations(request.auth)]
+    return {
+        "waiting": len(conversations),
+        "unread": sum(row["unread"] for row in conversations),
+        "conversations": conversations,
+    }
+
+
+async def get_conversation(id):
+    # the last message is loaded for the preview, it can't be lazily in async views
+    return await aget_object_or_404(
+        Conversation.objects.select_related("last_message"), pk=id
+    )
+
+
+async def change_conversation(id, change, *args):
+    """
+    Applies a change of `messages.assignment` to the conversation, and returns
+    it, a 409 if someone else changed it first.
+    """
+    try:
+        await sync_to_async(change)(id, *args)
+    except Conversation.DoesNotExist:
+        raise Http404("No Conversation matches the given query.")
+    except Conflict as conflict:
+        raise HttpError(409, str(conflict))
+    return await get_conversation(id)
+
+
+@router.patch("/{id}/close", response=ConversationOut, auth=agent_auth)
+async def close_conversation(request, id: int):
+    return await change_conversation(
+        id, set_status, Conversation.ConversationStatus.CLOSED
+    )
 
 
 @router.patch("/{id}/open", response=ConversationOut, auth=agent_auth)
-def open_conversation(request, id: int):
-    conversation = get_object_or_404(Conversation, pk=id)
-    conversation.status = Conversation.ConversationStatus.OPEN
-    conversation.save()
+async def open_conversation(request, id: int):
+    return await change_conversation(
+        id, set_status, Conversation.ConversationStatus.OPEN
+    )
 
-    return conversation
 
+@router.patch("/{id}/take", response=ConversationOut, auth=async_django_auth)
+async def take_conversation(request, id: int):
+    return await change_conversation(id, take, request.auth)
 
-@router.patch("/{id}/take", response=ConversationOut, auth=django_auth)
-def take_conversation(request, id: int):
-    conversation = get_object_or_404(Conversation, pk=id)
-    conversation.assignee = request.user
-    conversation.save()
 
-    return conversation
+@router.post(
+    "/dispatch",
+    response={200: ConversationOut, 204: None},
+    auth=agent_auth,
+    throttle=rate_limits("dispatch_conversation"),
+)
+async def dispatch_conversation(request):
+    """
+    Assigns the open and unassigned conversation waiting for the longest time
+    to the agent, a 204 if there is none.
+    """
+    id = await sync_to_async(dispatch)(request.auth)
+    if id is None:
+        return 204, None
+    return await get_conversation(id)
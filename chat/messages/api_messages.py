@@ -1,9 +1,25 @@
-from datetime import datetime
+import json
 import uuid
 from typing import List, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from ninja import Schema, ModelSchema
-from ninja.pagination import RouterPaginated
-from .models import Conversation, Message
+from ninja.decorators import decorate_view
+from ninja.errors import HttpError
+from ninja.responses import NinjaJSONEncoder
+from .coalesce import coalesce
+from .conditional import is_not_modified, make_etag, not_modified, set_etag
+from .models import Message
+from .notifier import notifier
+from .pagination import Paged, RouterPaginated
+from .ratelimit import rate_limits
+from .renderers import negotiate
+from .roles import aget_user, ais_agent
+from .routers import read_primary
+from .storage import MESSAGE_FIELDS, preview_rows, storage
+from .unread import mark_read
 
 router = RouterPaginated()
 
@@ -12,29 +28,138 @@ class MessageOut(ModelSchema):
 
     class Meta:
         model = Message
-        fields = ["id", "date", "content", "author"]
+        fields = MESSAGE_FIELDS
 
     conversation: uuid.UUID
 
     @staticmethod
     def resolve_conversation(obj):
+        # rows of the storage have the uuid, see `message_row`
+        if isinstance(obj, dict):
+            return obj["conversation"]
         return obj.conversation.uuid
 
 
-@router.get("/{conversation}/", response=List[MessageOut])
-def list_messages(
+async def read_by_agent(request, conversation, since, version, messages):
+    """
+    The messages, whose page advances the read cursor of an agent fetching
+    new messages to the last message sent.
+    """
+    if version is not None and (since or 0) >= version:
+        return messages
+    if not await ais_agent(request):
+        return messages
+
+    async def mark(items):
+        if not items:
+            return
+        last = items[-1]
+        last_id = last["id"] if isinstance(last, dict) else last.id
+        read_primary()
+        await sync_to_async(mark_read)(await aget_user(request), conversation, last_id)
+
+    return Paged(messages, mark)
+
+
+@router.get(
+    "/{conversation}/",
+    response=List[MessageOut],
+    throttle=rate_limits("list_messages"),
+)
+@decorate_view(coalesce)
+async def list_messages(
     request,
     conversation: uuid.UUID,
     since: int = None,
+    wait: float = None,
+    preview: bool = False,
+    response: HttpResponse = None,
 ):
-    messages = Message.objects.filter(conversation__uuid=conversation).select_related(
-        "conversation"
-    )
+    """
+    With `preview`, the contents longer than `CHAT_MESSAGE_PREVIEW_LENGTH` are
+    truncated, and the messages marked as `truncated`: their full content is
+    fetched with `get_message`.
+    """
+    # plain polling: the last message id tags the response, in each format, see
+    # `make_etag`
+    if not wait:
+        messages, version = await storage.aget_messages(conversation, since)
+        etag = make_etag(request, version, negotiate(request).media_type)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+        if preview:
+            messages = previews(messages, conversation)
+        return await read_by_agent(request, conversation, since, version, messages)
+
+    # long polling: hold the request until a new message is posted, then read
+    # it from the primary, where it was just committed
+    read_primary()
+    timeout = min(wait, settings.CHAT_LONG_POLL_MAX_WAIT)
+    # listen before checking so a message committed in between isn't missed
+    async with notifier.listen(conversation) as listener:
+        if not await storage.ahas_messages(conversation, since):
+            if await listener.get(timeout) is None:
+                return []
+    messages, version = await storage.aget_messages(conversation, since)
+    if preview:
+        messages = previews(messages, conversation)
+    return await read_by_agent(request, conversation, since, version, messages)
+
+
+def previews(messages, conversation):
+    return preview_rows(messages, conversation, settings.CHAT_MESSAGE_PREVIEW_LENGTH)
+
 
-    if since:
-        messages = messages.filter(id__gt=since)
+@router.get(
+    "/{conversation}/{int:id}",
+    response=MessageOut,
+    throttle=rate_limits("get_message"),
+)
+async def get_message(request, conversation: uuid.UUID, id: int):
+    """A message, with its full content, see the `preview` of `list_messages`."""
+    row = await storage.aget_row(conversation, id)
+    if row is None:
+        raise Http404("No Message matches the given query.")
+    return row
 
-    return messages.order_by("id")
+
+def format_event(message):
+    data = json.dumps(message, cls=NinjaJSONEncoder)
+    return f"id: {message['id']}\nevent: message\ndata: {data}\n\n"
+
+
+async def message_events(conversation: uuid.UUID, since: int = None):
+    async with notifier.listen(conversation) as listener:
+        # replay what was missed, then push messages as they are published,
+        # skipping the ones already replayed
+        last = since or 0
+        for message in await storage.alist_rows(conversation, since):
+            last = max(last, message["id"])
+            yield format_event(message)
+
+        while True:
+            message = await listener.get(settings.CHAT_STREAM_KEEPALIVE)
+            if message is None:
+                yield ": keepalive\n\n"
+            elif message["id"] > last:
+                last = message["id"]
+                yield format_event(message)
+
+
+@router.get("/{conversation}/stream", throttle=rate_limits("stream_messages"))
+async def stream_messages(request, conversation: uuid.UUID, since: int = None):
+    # a reconnecting EventSource sends the id of the last event it received
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    response = StreamingHttpResponse(
+        message_events(conversation, since), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 class MessageIn(Schema):
@@ -44,35 +169,94 @@ class MessageIn(Schema):
     content: str
 
 
-@router.post("/", response=List[MessageOut])
-def create_message_and_list(request, data: MessageIn, since: int = None):
-    conv = None
+async def message_author(request):
+    if await ais_agent(request):
+        return Message.AuthorChoice.AGENT
+    return Message.AuthorChoice.CUSTOMER
 
-    # retrieve requested conversation
-    if data.conversation:
-        conv = Conversation.objects.filter(uuid=data.conversation).first()
 
-    # create new conversation if not found or if first message (no uuid provided)
-    if not conv:
-        user = None
-        if request.user.is_authenticated:
-            user = request.user
-        conv = Conversation.objects.create(
-            customer_name=data.name, customer_email=data.email, customer=user
-        )
-
-    author = Message.AuthorChoice.CUSTOMER
+async def message_customer(request):
+    # if the user is logged in, they are associated to new conversations
+    user = await aget_user(request)
+    if user.is_authenticated:
+        return user
+    return None
 
-    if (
-        request.user.is_authenticated
-        and request.user.groups.filter(name="agent").exists()
-    ):
-        author = Message.AuthorChoice.AGENT
 
-    Message.objects.create(
-        conversation=conv,
-        author=author,
-        content=data.content,
+@router.post(
+    "/",
+    response=List[MessageOut],
+    throttle=rate_limits("create_message_and_list"),
+)
+async def create_message_and_list(request, data: MessageIn, since: int = None):
+    # a new conversation is created if not found or if first message (no uuid provided)
+    return await storage.aadd_message_and_list(
+        data, await message_author(request), await message_customer(request), since
     )
 
-    return list_messages(request, conv.uuid, since=since)
+
+class MessageBulkIn(Schema):
+    items: List[MessageIn]
+
+
+class MessageRef(Schema):
+    id: int
+    conversation: uuid.UUID
+
+
+class MessageBulkOut(Schema):
+    items: List[MessageRef]
+
+
+async def import_auth(request):
+    """Agents and staff users, who import the conversations."""
+    user = await aget_user(request)
+    if user.is_staff or await ais_agent(request):
+        return user
+    return None
+
+
+@router.post(
+    "/bulk",
+    response=MessageBulkOut,
+    auth=import_auth,
+    throttle=rate_limits("create_messages"),
+)
+async def create_messages(request, data: MessageBulkIn):
+    """
+    Adds many messages at once, possibly to many conversations, in one
+    transaction.
+
+    Unlike `create_message_and_list`, a conversation uuid that doesn't exist
+    creates a conversation with this uuid, so that the following items and
+    batches of an import add to it. Items without a conversation each start
+    a new one. The ids of the messages are returned in the order of the items.
+
+    Restricted to the agents and staff users, as it creates conversations
+    with the uuids chosen by the client.
+    """
+    if len(data.items) > settings.CHAT_BULK_MAX_ITEMS:
+        raise HttpError(
+            400,
+            f"At most {settings.CHAT_BULK_MAX_ITEMS} messages can be posted at once",
+        )
+
+    author = await message_author(request)
+    customer = await message_customer(request)
+    for attempt in range(2):
+        try:
+            results = await storage.aadd_messages(
+                data.items, author, customer, create_missing=True
+            )
+            break
+        except IntegrityError:
+            # a conversation of the items was created by a concurrent request
+            # between the lookup and the insert, found by the retry
+            pass
+    else:
+        raise HttpError(409, "The conversations were changed concurrently, retry")
+    return {
+        "items": [
+            {"id": row["id"], "conversation": row["conversation"]} for row, _ in results
+        ]
+    }
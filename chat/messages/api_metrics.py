@@ -0,0 +1,34 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse
+from ninja import Router
+from ninja.security import HttpBearer, SessionAuth
+from .metrics import metrics
+
+router = Router()
+
+
+class MetricsToken(HttpBearer):
+    """The token of the Prometheus servers, `CHAT_METRICS_TOKEN`."""
+
+    def authenticate(self, request, token):
+        expected = settings.CHAT_METRICS_TOKEN
+        if expected and hmac.compare_digest(token.encode(), expected.encode()):
+            return token
+        return None
+
+
+class StaffSessionAuth(SessionAuth):
+    """The staff users, logged in."""
+
+    def authenticate(self, request, key):
+        if request.user.is_staff:
+            return request.user
+        return None
+
+
+@router.get("", auth=[MetricsToken(), StaffSessionAuth()], include_in_schema=False)
+def get_metrics(request):
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
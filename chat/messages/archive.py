@@ -0,0 +1,105 @@
+import datetime
+import json
+import zlib
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Conversation, Message, MessageArchive
+
+
+def compress(messages):
+    data = [
+        [
+            message["id"],
+            message["date"].isoformat(),
+            message["author"],
+            message["content"],
+        ]
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode())
+
+
+def archived_rows(archives, conversation, since=None):
+    """`MessageOut` rows of the compressed archives, after `since`."""
+    return [
+        {
+            "id": id,
+            "date": datetime.datetime.fromisoformat(date),
+            "content": content,
+            "author": author,
+            "conversation": conversation,
+        }
+        for data in archives
+        for id, date, author, content in json.loads(zlib.decompress(data))
+        if id > (since or 0)
+    ]
+
+
+def get_archives(conversation, since=None):
+    """Data of the archives of the conversation with messages after `since`."""
+    return (
+        MessageArchive.objects.filter(
+            conversation__uuid=conversation, last_id__gt=since or 0
+        )
+        .order_by("last_id")
+        .values_list("data", flat=True)
+    )
+
+
+def archivable_conversations(older_than):
+    """
+    Closed conversations without messages since `older_than` ago, which have
+    messages to archive.
+    """
+    return Conversation.objects.filter(
+        status=Conversation.ConversationStatus.CLOSED,
+        last_message_at__lt=timezone.now() - older_than,
+    ).filter(
+        Q(archived_before__isnull=True) | Q(archived_before__lt=F("last_message_id"))
+    )
+
+
+def archive_conversation(conversation_id):
+    """
+    Moves the messages of the conversation to a `MessageArchive`, but the
+    last one, kept for the last message fields of the conversation (and so
+    that `Message` always has the last id of a conversation). Returns the
+    number of messages archived.
+    """
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().get(pk=conversation_id)
+        # reopened since it was selected, or not backfilled
+        if (
+            conversation.status != Conversation.ConversationStatus.CLOSED
+            or conversation.last_message_id is None
+        ):
+            return 0
+
+        messages = list(
+            Message.objects.filter(
+                conversation=conversation,
+                id__gte=conversation.archived_before or 0,
+                id__lt=conversation.last_message_id,
+            )
+            .order_by("id")
+            .values("id", "date", "author", "content")
+        )
+        if messages:
+            MessageArchive.objects.create(
+                conversation=conversation,
+                first_id=messages[0]["id"],
+                last_id=messages[-1]["id"],
+                count=len(messages),
+                data=compress(messages),
+            )
+            Message.objects.filter(
+                conversation=conversation,
+                id__gte=messages[0]["id"],
+                id__lte=messages[-1]["id"],
+            ).delete()
+        # not saved, the lists of conversations don't change
+        Conversation.objects.filter(pk=conversation.pk).update(
+            archived_before=conversation.last_message_id
+        )
+    return len(messages)
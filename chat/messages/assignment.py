@@ -0,0 +1,97 @@
+"""
+Changes of the assignee and status of the conversations, made with
+conditional updates (compare-and-set) rather than read, change, save: an
+update only applies if the conversation is still in the state it is changed
+from, so of agents racing each other exactly one wins, without locks.
+"""
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from .conditional import conversations_changed
+from .models import Conversation
+
+# open and unassigned, see `dispatch`
+WAITING = Q(status=Conversation.ConversationStatus.OPEN, assignee__isnull=True)
+# waiting conversations tried per query by `dispatch`, without SKIP LOCKED
+DISPATCH_CANDIDATES = 10
+
+
+class Conflict(Exception):
+    """The conversation is no longer in the state it was changed from."""
+
+
+def _changed(updated):
+    if updated:
+        # not sent by update(), see `signals.conversation_changed`
+        transaction.on_commit(conversations_changed)
+    return updated
+
+
+def _update(id, condition, **values):
+    """
+    Updates the conversation `id` if it matches `condition`, only writing the
+    `values`. Raises `Conversation.DoesNotExist` or `Conflict` otherwise.
+    """
+    conversations = Conversation.objects.filter(pk=id)
+    if not _changed(conversations.filter(condition).update(**values)):
+        if not conversations.exists():
+            raise Conversation.DoesNotExist
+        raise Conflict
+
+
+def take(id, agent):
+    """Assigns the conversation to the agent, unless someone else has it."""
+    try:
+        _update(id, Q(assignee__isnull=True) | Q(assignee=agent), assignee=agent)
+    except Conflict:
+        raise Conflict("The conversation is assigned to another agent")
+
+
+def set_status(id, status):
+    """
+    Closes or opens the conversation, left unchanged if it already is (e.g.
+    by an agent racing this one), so that the change can be retried.
+    """
+    try:
+        _update(id, ~Q(status=status), status=status)
+    except Conflict:
+        pass
+
+
+def dispatch(agent):
+    """
+    Assigns the next waiting conversation to the agent, and returns its id,
+    None if there is none.
+
+    With `SELECT ... FOR UPDATE SKIP LOCKED` (PostgreSQL), agents dispatching
+    at the same time each lock a different conversation. Otherwise (SQLite,
+    where writes are serialized anyway) the first candidates are taken with
+    compare-and-set, the agents losing one trying the next.
+    """
+    features = connections[router.db_for_write(Conversation)].features
+    if features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            id = (
+                Conversation.objects.filter(WAITING)
+                # the customers waiting for the longest time first
+                .order_by("created_at", "id")
+                .select_for_update(skip_locked=True)
+                .values_list("id", flat=True)
+                .first()
+            )
+            if id is not None:
+                _changed(Conversation.objects.filter(pk=id).update(assignee=agent))
+            return id
+
+    while True:
+        candidates = list(
+            Conversation.objects.filter(WAITING)
+            .order_by("created_at", "id")
+            .values_list("id", flat=True)[:DISPATCH_CANDIDATES]
+        )
+        if not candidates:
+            return None
+        for id in candidates:
+            conversation = Conversation.objects.filter(WAITING, pk=id)
+            if _changed(conversation.update(assignee=agent)):
+                return id
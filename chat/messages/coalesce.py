@@ -0,0 +1,56 @@
+import asyncio
+from functools import wraps
+from django.conf import settings
+from django.http import HttpResponse
+from .routers import reading_replica
+
+# running operations, by request, see `coalesce`
+_running = {}
+
+
+def copy_response(response):
+    copy = HttpResponse(
+        response.content, status=response.status_code, charset=response.charset
+    )
+    for header, value in response.items():
+        copy[header] = value
+    return copy
+
+
+def coalesce(run):
+    """
+    Decorates the `run` of an async operation, see `ninja.decorate_view`, so
+    that identical GET requests running at the same time share one run, and
+    so its queries: the first one runs the operation, and they all get a copy
+    of its response.
+
+    Requests are identical when they have the same URL, `If-None-Match` and
+    `Accept` headers, session (a request may act for its user, e.g. advance
+    the read cursor of an agent) and database (see `routers.reading_replica`),
+    so the response must not depend on anything else. The requests sharing the
+    response of another one don't count for the rate limits, see
+    `messages.ratelimit`.
+    """
+
+    @wraps(run)
+    async def coalesced_run(request, *args, **kwargs):
+        if request.method != "GET" or not settings.CHAT_COALESCE_POLLS:
+            return await run(request, *args, **kwargs)
+        key = (
+            asyncio.get_running_loop(),
+            request.get_full_path(),
+            request.headers.get("If-None-Match"),
+            request.headers.get("Accept"),
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME),
+            reading_replica(),
+        )
+        task = _running.get(key)
+        if task is None:
+            task = asyncio.ensure_future(run(request, *args, **kwargs))
+            _running[key] = task
+            task.add_done_callback(lambda task: _running.pop(key, None))
+        # not cancelled with the request that started it, e.g. on disconnect,
+        # and copied so that the middlewares of each request change their own
+        return copy_response(await asyncio.shield(task))
+
+    return coalesced_run
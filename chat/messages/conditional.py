@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+
+logger = logging.getLogger(__name__)
+
+CONVERSATIONS_VERSION_KEY = "chat:conversations:version"
+
+
+def make_etag(request, version, *extra):
+    """
+    Weak ETag of a response given the version of the data it is made of.
+
+    The query string is part of the tag, so that the pages or filters of a
+    list don't share it, and so should the negotiated format be (in `extra`),
+    see `not_modified`. None if the version is unknown.
+    """
+    if version is None:
+        return None
+    key = ":".join(
+        str(value) for value in (version, request.path, request.GET.urlencode(), *extra)
+    )
+    return "W/" + quote_etag(
+        hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+    )
+
+
+def is_not_modified(request, etag):
+    if etag is None:
+        return False
+    # weak comparison, as for GET requests
+    tags = parse_etags(request.headers.get("If-None-Match", ""))
+    return "*" in tags or etag.removeprefix("W/") in [
+        tag.removeprefix("W/") for tag in tags
+    ]
+
+
+def set_etag(response, etag):
+    if etag is not None:
+        response["ETag"] = etag
+        # always revalidated, so that polling clients can rely on the browser cache
+        response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def not_modified(etag):
+    response = set_etag(HttpResponseNotModified(), etag)
+    # as the responses it stands for, see `renderers.negotiated`
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def _cache():
+    return caches[settings.CHAT_VERSION_CACHE_ALIAS]
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+def conversations_version():
+    """
+    Version of the conversations, replaced by a new one after each change
+    made to any conversation, None if the cache fails.
+
+    Replaced after the changes are committed, so a response tagged with a
+    version is never older than it. Versions are random rather than counted,
+    so that concurrent changes can't set the version back to one already
+    served. The cache is shared by the processes (`CHAT_VERSION_CACHE_ALIAS`),
+    for the changes made by one to reach the tags of the others.
+    """
+    cache = _cache()
+    try:
+        version = cache.get(CONVERSATIONS_VERSION_KEY)
+        if version is None:
+            cache.add(CONVERSATIONS_VERSION_KEY, new_version(), None)
+            version = cache.get(CONVERSATIONS_VERSION_KEY)
+    except Exception:
+        logger.exception("The version of the conversations could not be read")
+        return None
+    return version
+
+
+async def aconversations_version():
+    cache = _cache()
+    try:
+        version = await cache.aget(CONVERSATIONS_VERSION_KEY)
+        if version is None:
+            await cache.aadd(CONVERSATIONS_VERSION_KEY, new_version(), None)
+            version = await cache.aget(CONVERSATIONS_VERSION_KEY)
+    except Exception:
+        logger.exception("The version of the conversations could not be read")
+        return None
+    return version
+
+
+def conversations_changed():
+    try:
+        _cache().set(CONVERSATIONS_VERSION_KEY, new_version(), None)
+    except Exception:
+        # called once the changes are committed, which must not fail the request
+        logger.exception("The version of the conversations could not be changed")
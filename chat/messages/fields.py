@@ -0,0 +1,75 @@
+import base64
+import zlib
+from django.conf import settings
+from django.db import models
+
+# prefix of the compressed values, see `CompressedTextField`
+MARKER = "\x1bz"
+
+
+def compress(value):
+    return MARKER + base64.b85encode(zlib.compress(value.encode())).decode()
+
+
+def decompress(value):
+    return zlib.decompress(base64.b85decode(value[len(MARKER) :])).decode()
+
+
+def plain_text(value):
+    """The value, decompressed if it is compressed."""
+    if value is not None and value.startswith(MARKER):
+        return decompress(value)
+    return value
+
+
+# SQL function of the plain text of a value, on SQLite, see `install_sql_function`
+PLAIN_TEXT_SQL_FUNCTION = "chat_plain_text"
+
+
+def install_sql_function(connection, **kwargs):
+    """
+    Registers `PLAIN_TEXT_SQL_FUNCTION` on new SQLite connections, for the
+    search index. Writes to the `Message` table outside of Django (e.g. with
+    the sqlite3 shell) fail without it.
+    """
+    if connection.vendor == "sqlite":
+        connection.connection.create_function(
+            PLAIN_TEXT_SQL_FUNCTION, 1, plain_text, deterministic=True
+        )
+
+
+class CompressedTextField(models.TextField):
+    """
+    Text compressed when saved if it is at least
+    `CHAT_MESSAGE_COMPRESS_MIN_LENGTH` characters long (None: never), and
+    decompressed when loaded, so the ORM reads and writes it as plain text.
+
+    The column is still text: compressed values are zlib data encoded in base
+    85 after `MARKER`. Values starting with the marker are always compressed,
+    so they can't be mistaken for compressed ones. Lookups (`contains`...)
+    only see the uncompressed values.
+
+    On PostgreSQL, which compresses large values itself (TOAST), they are
+    stored as is.
+    """
+
+    def get_db_prep_save(self, value, connection):
+        value = super().get_db_prep_save(value, connection)
+        # or an expression, e.g. of bulk_update(), which prepares its values
+        if not isinstance(value, str):
+            return value
+        if value.startswith(MARKER):
+            return compress(value)
+        min_length = settings.CHAT_MESSAGE_COMPRESS_MIN_LENGTH
+        if (
+            min_length is None
+            or len(value) < min_length
+            or connection.vendor == "postgresql"
+        ):
+            return value
+        compressed = compress(value)
+        # base 85 takes 5 characters for 4 bytes, random data can grow
+        return compressed if len(compressed) < len(value) else value
+
+    def from_db_value(self, value, expression, connection):
+        return plain_text(value)
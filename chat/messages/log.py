@@ -0,0 +1,505 @@
+import bisect
+import datetime
+import itertools
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .conditional import conversations_changed
+from .models import Conversation, ConversationRead, Message
+from .notifier import notifier
+from .storage import BaseStorage, DatabaseStorage, row_list, stored_rows
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationLog:
+    def __init__(self, directory, after):
+        self.directory = directory
+        # id of the last message stored in the database before the entries of
+        # the log, which moves forward as they are trimmed
+        self.after = after
+        self.ids = []
+        # (segment path, byte offset) of each entry
+        self.positions = []
+        self.segment = None
+        self.segment_size = 0
+
+    @property
+    def last_id(self):
+        return self.ids[-1] if self.ids else self.after
+
+
+class SegmentedLog:
+    """
+    Append-only log of the messages of each conversation.
+
+    A conversation has a directory with its entries, one JSON line each, in
+    segment files named after their first id and of about `segment_size`
+    bytes, and an `after` file with the id of the last message stored in the
+    database before its entries. The offsets of the entries are indexed
+    in memory, by id, so reading the messages after `since` is a seek.
+
+    Once copied to the database, the entries are trimmed: their segments are
+    deleted and `after` moves past them, see `trim`.
+
+    Appends and trims are not locked, the caller serializes them.
+    """
+
+    def __init__(self, directory, segment_size, fsync=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.conversations = {}
+        # taken by the readers to copy the index, as trims remove from it
+        self._lock = threading.Lock()
+
+    def load(self, replicated=0):
+        """
+        Indexes the entries on disk, returns the ones after `replicated` (the
+        last id copied to the database) by conversation.
+        """
+        entries = {}
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            with open(os.path.join(directory, "after")) as f:
+                log = ConversationLog(directory, int(f.read()))
+            conversation = uuid.UUID(name)
+            entries[conversation] = []
+            segments = sorted(n for n in os.listdir(directory) if n.endswith(".log"))
+            for segment in segments:
+                path = os.path.join(directory, segment)
+                indexed = len(log.ids)
+                with open(path, "rb") as f:
+                    offset = 0
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            # torn write, the entry was never acknowledged
+                            break
+                        entry = json.loads(line)
+                        # trimmed, but not deleted yet
+                        if entry["id"] > log.after:
+                            log.ids.append(entry["id"])
+                            log.positions.append((path, offset))
+                            if entry["id"] > replicated:
+                                entries[conversation].append(entry)
+                        offset += len(line)
+                if len(log.ids) == indexed:
+                    os.remove(path)
+                else:
+                    log.segment, log.segment_size = path, offset
+            self.conversations[conversation] = log
+        return entries
+
+    def __contains__(self, conversation):
+        return conversation in self.conversations
+
+    def create(self, conversation, after):
+        directory = os.path.join(self.directory, str(conversation))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "after"), "w") as f:
+            f.write(str(after))
+        self.conversations[conversation] = ConversationLog(directory, after)
+
+    def append(self, conversation, entries):
+        log = self.conversations[conversation]
+        data = [(json.dumps(entry) + "\n").encode() for entry in entries]
+        if log.segment is None or log.segment_size >= self.segment_size:
+            log.segment = os.path.join(log.directory, f"{entries[0]['id']:020}.log")
+            log.segment_size = 0
+        with open(log.segment, "ab") as f:
+            f.write(b"".join(data))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        # indexed once written, so readers only seek to complete entries
+        with self._lock:
+            for entry, line in zip(entries, data):
+                log.ids.append(entry["id"])
+                log.positions.append((log.segment, log.segment_size))
+                log.segment_size += len(line)
+
+    def trim(self, conversation, replicated):
+        """
+        Deletes the segments whose entries are all in the database, up to the
+        id `replicated`, but the one appended to until it is full.
+        """
+        log = self.conversations[conversation]
+        with self._lock:
+            ids, positions = list(log.ids), list(log.positions)
+        deleted = []
+        count = 0
+        for path, group in itertools.groupby(
+            positions, key=lambda position: position[0]
+        ):
+            end = count + len(list(group))
+            if ids[end - 1] > replicated or (
+                path == log.segment and log.segment_size < self.segment_size
+            ):
+                break
+            deleted.append(path)
+            count = end
+        if not deleted:
+            return
+
+        # the entries are read from the database once `after` is past them,
+        # so it is written before the segments are deleted
+        after = ids[count - 1]
+        path = os.path.join(log.directory, "after")
+        with open(f"{path}.tmp", "w") as f:
+            f.write(str(after))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+        self._forget(log, after)
+        if log.segment in deleted:
+            log.segment = None
+        for path in deleted:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # trimmed by another process, e.g. `replicate_messages`
+                pass
+
+    def _forget(self, log, after):
+        """Removes the entries up to `after` from the index."""
+        with self._lock:
+            if after > log.after:
+                count = bisect.bisect_right(log.ids, after)
+                del log.ids[:count]
+                del log.positions[:count]
+                log.after = after
+
+    def last_id(self, conversation):
+        return self.conversations[conversation].last_id
+
+    def read(self, conversation, since=None):
+        """
+        Entries after `since`, with the id of the last message before the log
+        (the entries up to it are in the database).
+        """
+        log = self.conversations[conversation]
+        with self._lock:
+            start = bisect.bisect_right(log.ids, since or 0)
+            ids, positions = log.ids[start:], log.positions[start:]
+            after = log.after
+        entries = []
+        segments = defaultdict(list)
+        for id, (path, offset) in zip(ids, positions):
+            segments[path].append((id, offset))
+        for path, offsets in segments.items():
+            try:
+                with open(path, "rb") as f:
+                    f.seek(offsets[0][1])
+                    entries += [json.loads(f.readline()) for _ in offsets]
+            except FileNotFoundError:
+                # trimmed since, by this process or another one: the entries up
+                # to the end of the segment are in the database
+                after = offsets[-1][0]
+                entries = []
+        if after > log.after:
+            self._forget(log, after)
+        return entries, after
+
+
+def entry_row(entry, conversation):
+    return {
+        "id": entry["id"],
+        "date": datetime.datetime.fromisoformat(entry["date"]),
+        "content": entry["content"],
+        "author": entry["author"],
+        "conversation": conversation,
+    }
+
+
+class Replicator(threading.Thread):
+    def __init__(self, storage, interval):
+        super().__init__(name="chat-message-replicator", daemon=True)
+        self.storage = storage
+        self.interval = interval
+        self.wakeup = threading.Event()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                while self.storage.replicate():
+                    pass
+            except Exception:
+                logger.exception("Replication of the messages failed, will retry")
+            finally:
+                close_old_connections()
+
+
+class LogStorage(BaseStorage):
+    """
+    Messages appended to a `SegmentedLog`, standing in for a stream server,
+    and copied in batches to the `Message` table by a background thread.
+
+    The log assigns the message ids, so it must be the only writer of
+    messages, from a single process. Polls are served from the log: `since`
+    is looked up in its index. The conversations stay in the database, their
+    last message fields being updated by the replication.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        segment_size=None,
+        fsync=None,
+        replication_interval=None,
+        replication_batch=None,
+    ):
+        self.log = SegmentedLog(
+            directory or settings.CHAT_MESSAGE_LOG_DIR,
+            segment_size or settings.CHAT_MESSAGE_LOG_SEGMENT_SIZE,
+            settings.CHAT_MESSAGE_LOG_FSYNC if fsync is None else fsync,
+        )
+        self.replication_interval = replication_interval
+        if replication_interval is None:
+            self.replication_interval = settings.CHAT_MESSAGE_LOG_REPLICATION_INTERVAL
+        self.replication_batch = (
+            replication_batch or settings.CHAT_MESSAGE_LOG_REPLICATION_BATCH
+        )
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._last_id = 0
+        # (conversation, entry) not in the database yet, by id
+        self._pending = []
+        self._replicator = None
+        # the conversations not logged are read from the database
+        self._database = DatabaseStorage()
+
+    def _load(self):
+        # lazily, as it queries the database
+        with self._lock:
+            if self._loaded:
+                return
+            replicated = Message.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+            entries = self.log.load(replicated)
+            self._pending = sorted(
+                (
+                    (conversation, entry)
+                    for conversation, conversation_entries in entries.items()
+                    for entry in conversation_entries
+                ),
+                key=lambda pending: pending[1]["id"],
+            )
+            self._last_id = max(
+                [replicated] + [log.last_id for log in self.log.conversations.values()]
+            )
+            # copied before the process stopped
+            for conversation in entries:
+                self.log.trim(conversation, replicated)
+            self._loaded = True
+
+    def _start_replicator(self):
+        if self._replicator is None and self.replication_interval:
+            self._replicator = Replicator(self, self.replication_interval)
+            self._replicator.start()
+
+    def add_messages(self, items, author, customer=None, create_missing=False):
+        self._load()
+
+        # conversations not logged yet are looked up once in the database
+        requested = {item.conversation for item in items if item.conversation}
+        afters = {}
+        unknown = [conv for conv in requested if conv not in self.log]
+        for conv in Conversation.objects.filter(uuid__in=unknown).values(
+            "uuid", "last_message_id"
+        ):
+            after = conv["last_message_id"]
+            if after is None:
+                # not backfilled
+                after = (
+                    Message.objects.filter(conversation__uuid=conv["uuid"]).aggregate(
+                        last_id=Max("id")
+                    )["last_id"]
+                    or 0
+                )
+            afters[conv["uuid"]] = after
+
+        new_conversations = []
+        item_conversations = []
+        for item in items:
+            conv = item.conversation
+            if conv is not None and (conv in self.log or conv in afters):
+                item_conversations.append(conv)
+                continue
+            new = Conversation(
+                customer_name=item.name, customer_email=item.email, customer=customer
+            )
+            if conv is not None and create_missing:
+                new.uuid = conv
+                afters[conv] = 0
+            new_conversations.append(new)
+            afters[new.uuid] = 0
+            item_conversations.append(new.uuid)
+        Conversation.objects.bulk_create(new_conversations)
+
+        date = timezone.now().isoformat()
+        entries = defaultdict(list)
+        results = []
+        with self._lock:
+            for conv, item in zip(item_conversations, items):
+                if conv not in self.log:
+                    self.log.create(conv, afters[conv])
+                previous_id = entries[conv][-1]["id"] if entries[conv] else None
+                self._last_id += 1
+                entry = {
+                    "id": self._last_id,
+                    "date": date,
+                    "author": author,
+                    "content": item.content,
+                }
+                entries[conv].append(entry)
+                results.append(
+                    (entry_row(entry, conv), previous_id or self.log.last_id(conv))
+                )
+            for conv, conv_entries in entries.items():
+                self.log.append(conv, conv_entries)
+            self._pending += sorted(
+                (
+                    (conv, entry)
+                    for conv, conv_entries in entries.items()
+                    for entry in conv_entries
+                ),
+                key=lambda pending: pending[1]["id"],
+            )
+            self._start_replicator()
+            if len(self._pending) >= self.replication_batch and self._replicator:
+                self._replicator.wakeup.set()
+
+        for row, _ in results:
+            notifier.publish(row["conversation"], row)
+        return results
+
+    def _rows(self, conversation, since):
+        """Rows from the log, and the database before it, or None if not logged."""
+        if conversation not in self.log:
+            return None
+        entries, after = self.log.read(conversation, since)
+        rows = []
+        if (since or 0) < after:
+            # archived, or trimmed from the log
+            rows = stored_rows(conversation, since, after)
+        return rows + [entry_row(entry, conversation) for entry in entries]
+
+    def get_messages(self, conversation, since=None):
+        self._load()
+        rows = self._rows(conversation, since)
+        if rows is None:
+            return self._database.get_messages(conversation, since)
+        return row_list(rows)
+
+    async def aget_messages(self, conversation, since=None):
+        await sync_to_async(self._load)()
+        if conversation not in self.log:
+            return await self._database.aget_messages(conversation, since)
+        version = self.log.last_id(conversation)
+        rows = await sync_to_async(self._rows)(conversation, since)
+        return row_list(rows), version
+
+    async def ahas_messages(self, conversation, since=None):
+        await sync_to_async(self._load)()
+        if conversation not in self.log:
+            return await self._database.ahas_messages(conversation, since)
+        return self.log.last_id(conversation) > (since or 0)
+
+    async def alist_rows(self, conversation, since=None):
+        await sync_to_async(self._load)()
+        rows = await sync_to_async(self._rows)(conversation, since)
+        if rows is None:
+            rows = await self._database.alist_rows(conversation, since)
+        return rows
+
+    def replicate(self):
+        self._load()
+        with self._lock:
+            batch = self._pending[: self.replication_batch]
+        if not batch:
+            return 0
+
+        with transaction.atomic():
+            batch_conversations = {conversation for conversation, _ in batch}
+            conversations = {
+                conv.uuid: conv
+                for conv in Conversation.objects.select_for_update()
+                .filter(uuid__in=batch_conversations)
+                .order_by("id")
+            }
+            # already copied by another replicator (e.g. the command)
+            existing = set(
+                Message.objects.filter(
+                    id__in=[entry["id"] for _, entry in batch]
+                ).values_list("id", flat=True)
+            )
+            messages = [
+                Message(
+                    id=entry["id"],
+                    conversation=conversations[conversation],
+                    date=datetime.datetime.fromisoformat(entry["date"]),
+                    author=entry["author"],
+                    content=entry["content"],
+                )
+                for conversation, entry in batch
+                if entry["id"] not in existing
+            ]
+            Message.objects.bulk_create(messages)
+            for message in messages:
+                conv = message.conversation
+                if conv.last_message_id is None or message.id > conv.last_message_id:
+                    conv.last_message = message
+                    conv.last_message_at = message.date
+                    conv.last_author = message.author
+                conv.message_count += 1
+                if message.author == Message.AuthorChoice.CUSTOMER:
+                    conv.customer_message_count += 1
+            Conversation.objects.bulk_update(
+                conversations.values(),
+                [
+                    "last_message",
+                    "last_message_at",
+                    "last_author",
+                    "message_count",
+                    "customer_message_count",
+                ],
+            )
+
+            # the read cursors already past copied messages of the customer left
+            # them out of their read_count, as they weren't in the counter yet
+            # (see unread.mark_read): they are counted now, as the counter is
+            customer_ids = defaultdict(list)
+            for message in messages:
+                if message.author == Message.AuthorChoice.CUSTOMER:
+                    customer_ids[message.conversation.id].append(message.id)
+            if customer_ids:
+                reads = list(
+                    ConversationRead.objects.filter(
+                        conversation_id__in=customer_ids,
+                        last_read_id__gte=min(ids[0] for ids in customer_ids.values()),
+                    )
+                )
+                for read in reads:
+                    read.read_count += bisect.bisect_right(
+                        customer_ids[read.conversation_id], read.last_read_id
+                    )
+                ConversationRead.objects.bulk_update(reads, ["read_count"])
+
+        with self._lock:
+            del self._pending[: len(batch)]
+            # the batch is the oldest pending, so everything up to it is copied
+            for conversation in batch_conversations:
+                self.log.trim(conversation, batch[-1][1]["id"])
+        conversations_changed()
+        return len(batch)
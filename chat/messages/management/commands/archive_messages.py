@@ -0,0 +1,52 @@
+import datetime
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from messages.archive import archivable_conversations, archive_conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the messages of the closed conversations without activity for "
+        "some days to compressed archives, the last message of each excepted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=float, default=settings.CHAT_ARCHIVE_AFTER_DAYS
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="runs again every INTERVAL seconds, as a scheduled job",
+        )
+
+    def handle(self, *args, days, batch_size, interval, **options):
+        while True:
+            self.archive(datetime.timedelta(days=days), batch_size)
+            if not interval:
+                break
+            time.sleep(interval)
+
+    def archive(self, older_than, batch_size):
+        conversations = messages = 0
+        last_id = 0
+        while True:
+            ids = list(
+                archivable_conversations(older_than)
+                .filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            # a transaction per conversation, not to hold the locks long
+            for conversation_id in ids:
+                archived = archive_conversation(conversation_id)
+                conversations += bool(archived)
+                messages += archived
+        self.stdout.write(
+            f"{messages} messages of {conversations} conversations archived"
+        )
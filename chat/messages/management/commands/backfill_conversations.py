@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from messages.conditional import conversations_changed
+from messages.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the denormalized last message fields and message counts of the "
+        "conversations."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        updated = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Conversation.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                stats = {
+                    row["conversation"]: row
+                    for row in Message.objects.filter(conversation__in=ids)
+                    .values("conversation")
+                    .annotate(
+                        last_id=Max("id"),
+                        count=Count("id"),
+                        customer_count=Count(
+                            "id", filter=Q(author=Message.AuthorChoice.CUSTOMER)
+                        ),
+                    )
+                }
+                last_messages = Message.objects.in_bulk(
+                    [row["last_id"] for row in stats.values()]
+                )
+                conversations = list(Conversation.objects.filter(id__in=ids).only("id"))
+                for conversation in conversations:
+                    row = stats.get(conversation.id)
+                    message = row and last_messages[row["last_id"]]
+                    conversation.last_message = message
+                    conversation.last_message_at = message and message.date
+                    conversation.last_author = message and message.author
+                    conversation.message_count = row["count"] if row else 0
+                    conversation.customer_message_count = (
+                        row["customer_count"] if row else 0
+                    )
+                Conversation.objects.bulk_update(
+                    conversations,
+                    [
+                        "last_message",
+                        "last_message_at",
+                        "last_author",
+                        "message_count",
+                        "customer_message_count",
+                    ],
+                )
+            updated += len(ids)
+
+        conversations_changed()
+        self.stdout.write(f"{updated} conversations updated")
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.db.models.functions import Length
+from messages.fields import MARKER
+from messages.models import Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Compresses the contents of the messages saved before they were, see "
+        "CHAT_MESSAGE_COMPRESS_MIN_LENGTH."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        min_length = settings.CHAT_MESSAGE_COMPRESS_MIN_LENGTH
+        if min_length is None:
+            raise CommandError("CHAT_MESSAGE_COMPRESS_MIN_LENGTH is None")
+        if connections[router.db_for_write(Message)].vendor == "postgresql":
+            raise CommandError("PostgreSQL compresses the large contents itself")
+        # also the ones not worth compressing, which are saved again as is
+        large = (
+            Message.objects.alias(length=Length("content"))
+            .filter(length__gte=min_length)
+            .exclude(content__startswith=MARKER)
+        )
+        rewritten = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                messages = list(
+                    large.filter(id__gt=last_id)
+                    .order_by("id")
+                    .only("content")[:batch_size]
+                )
+                if not messages:
+                    break
+                last_id = messages[-1].id
+                # saving them compresses them
+                Message.objects.bulk_update(messages, ["content"])
+            rewritten += len(messages)
+
+        self.stdout.write(f"{rewritten} messages rewritten")
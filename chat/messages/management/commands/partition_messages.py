@@ -0,0 +1,183 @@
+import re
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from messages import search
+from messages.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Partitions the Message table by ranges of ids on PostgreSQL, creates "
+        "the partitions ahead of the ids and drops the ones emptied by "
+        "archive_messages. The archived messages are not searchable anymore."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size", type=int, default=settings.CHAT_MESSAGE_PARTITION_SIZE
+        )
+        parser.add_argument(
+            "--ahead", type=int, default=2, help="partitions to create ahead"
+        )
+        parser.add_argument("--drop-empty", action="store_true")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="prints the SQL statements, then rolls them back",
+        )
+
+    def handle(self, *args, size, ahead, drop_empty, dry_run, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning is only supported with PostgreSQL")
+
+        self.table = Message._meta.db_table
+        with ExitStack() as stack:
+            if dry_run:
+                stack.enter_context(connection.execute_wrapper(self.print_sql))
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT relkind FROM pg_class WHERE oid = %s::regclass",
+                    [self.table],
+                )
+                if cursor.fetchone()[0] != "p":
+                    self.partition(cursor, size)
+                self.create_partitions(cursor, size, ahead)
+                if drop_empty:
+                    self.drop_empty_partitions(cursor)
+                if dry_run:
+                    # the DDL is transactional on PostgreSQL
+                    transaction.set_rollback(True)
+                    self.stdout.write("Dry run, rolled back")
+
+    def print_sql(self, execute, sql, params, many, context):
+        self.stdout.write(f"{sql};" + (f"  -- {params}" if params else ""))
+        return execute(sql, params, many, context)
+
+    def quote(self, name):
+        return connection.ops.quote_name(name)
+
+    def partition(self, cursor, size):
+        """
+        Replaces the table by a partitioned one, the current table becoming
+        its first partition, for the ids up to the next multiple of `size`.
+        """
+        table, quote = self.table, self.quote
+        legacy = f"{table}_legacy"
+        sequence = f"{table}_id_seq"
+        conversations = Conversation._meta.db_table
+        introspection = connection.introspection
+
+        cursor.execute(f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"SELECT coalesce(max(id), 0) FROM {quote(table)}")
+        upper = (cursor.fetchone()[0] // size + 1) * size
+
+        # the foreign keys to the messages are created again on the new table
+        references = {
+            name: constraint["columns"]
+            for name, constraint in introspection.get_constraints(
+                cursor, conversations
+            ).items()
+            if constraint["foreign_key"] == (table, "id")
+        }
+        for name in references:
+            cursor.execute(
+                f"ALTER TABLE {quote(conversations)} DROP CONSTRAINT {quote(name)}"
+            )
+
+        # the names of the indexes are free for the new table
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}")
+        indexes = introspection.get_constraints(cursor, legacy)
+        for name, constraint in indexes.items():
+            if constraint["index"] or constraint["primary_key"]:
+                cursor.execute(
+                    f"ALTER INDEX {quote(name)} RENAME TO {quote(f'{legacy}_{name}')}"
+                )
+
+        # a sequence instead of the identity, which partitioned tables don't have
+        cursor.execute(
+            f"ALTER TABLE {quote(legacy)} ALTER COLUMN id DROP IDENTITY IF EXISTS"
+        )
+        cursor.execute(f"ALTER TABLE {quote(legacy)} ALTER COLUMN id DROP DEFAULT")
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {quote(sequence)}")
+        cursor.execute("SELECT setval(%s, %s, false)", [sequence, upper])
+
+        cursor.execute(
+            f"CREATE TABLE {quote(table)} (LIKE {quote(legacy)} "
+            "INCLUDING DEFAULTS INCLUDING GENERATED) "
+            "PARTITION BY RANGE (id)"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ALTER COLUMN id "
+            f"SET DEFAULT nextval('{sequence}')"
+        )
+        cursor.execute(f"ALTER SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.id")
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY (id)")
+        for index in Message._meta.indexes:
+            columns = ", ".join(
+                quote(Message._meta.get_field(name).column) for name in index.fields
+            )
+            cursor.execute(
+                f"CREATE INDEX {quote(index.name)} ON {quote(table)} ({columns})"
+            )
+        search.create_postgres_index(cursor, quote(table))
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT "
+            f"{quote(f'{table}_conversation_id_fk')} FOREIGN KEY (conversation_id) "
+            f"REFERENCES {quote(conversations)} (id) DEFERRABLE INITIALLY DEFERRED"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} "
+            f"FOR VALUES FROM (MINVALUE) TO ({upper})"
+        )
+
+        for name, columns in references.items():
+            cursor.execute(
+                f"ALTER TABLE {quote(conversations)} ADD CONSTRAINT {quote(name)} "
+                f"FOREIGN KEY ({quote(columns[0])}) REFERENCES {quote(table)} (id) "
+                "DEFERRABLE INITIALLY DEFERRED"
+            )
+        self.stdout.write(f"{table} partitioned, ids before {upper} in {legacy}")
+
+    def partitions(self, cursor):
+        """Names and upper bounds of the partitions."""
+        cursor.execute(
+            "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+            "FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = %s::regclass",
+            [self.table],
+        )
+        return [
+            (name, int(re.search(r"TO \('?(\d+)'?\)", bound).group(1)))
+            for name, bound in cursor.fetchall()
+        ]
+
+    def create_partitions(self, cursor, size, ahead):
+        cursor.execute(f"SELECT last_value FROM {self.quote(f'{self.table}_id_seq')}")
+        last_id = cursor.fetchone()[0]
+        upper = max(bound for _, bound in self.partitions(cursor))
+        while upper <= last_id + ahead * size:
+            name = f"{self.table}_p{upper // size}"
+            cursor.execute(
+                f"CREATE TABLE {self.quote(name)} PARTITION OF {self.quote(self.table)} "
+                f"FOR VALUES FROM ({upper}) TO ({upper + size})"
+            )
+            self.stdout.write(f"{name} created")
+            upper += size
+
+    def drop_empty_partitions(self, cursor):
+        cursor.execute(f"SELECT last_value FROM {self.quote(f'{self.table}_id_seq')}")
+        last_id = cursor.fetchone()[0]
+        for name, upper in self.partitions(cursor):
+            # only the past ones, whose messages were all archived
+            if upper > last_id:
+                continue
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {self.quote(name)})")
+            if not cursor.fetchone()[0]:
+                cursor.execute(
+                    f"ALTER TABLE {self.quote(self.table)} "
+                    f"DETACH PARTITION {self.quote(name)}"
+                )
+                cursor.execute(f"DROP TABLE {self.quote(name)}")
+                self.stdout.write(f"{name} dropped")
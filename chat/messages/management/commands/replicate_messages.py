@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from messages.log import LogStorage
+
+
+class Command(BaseCommand):
+    help = "Copies the messages of the log to the database, see LogStorage."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory")
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, directory, batch_size, **options):
+        storage = LogStorage(
+            directory, replication_interval=0, replication_batch=batch_size
+        )
+        replicated = 0
+        while count := storage.replicate():
+            replicated += count
+        self.stdout.write(f"{replicated} messages replicated")
@@ -0,0 +1,182 @@
+import bisect
+import contextvars
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+# queries of the request being handled, propagated to the threads running
+# the ORM calls of async views by asgiref
+_current = contextvars.ContextVar("chat_request_queries", default=None)
+
+
+class RequestQueries:
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_sql = keep_sql
+        self.sql = []
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        if self.keep_sql:
+            self.sql.append((duration, sql))
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper, installed on every database connection."""
+    queries = _current.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.add(sql, time.perf_counter() - start)
+
+
+def install_execute_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class OperationMetrics:
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERIES_BUCKETS)
+        self.sql_duration = 0.0
+        self.size = Histogram(SIZE_BUCKETS)
+        self.statuses = defaultdict(int)
+
+
+class Metrics:
+    """
+    In-process aggregates of the requests, by operation (URL name).
+
+    Each worker process has its own, scraped separately by Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = defaultdict(OperationMetrics)
+        self.slowest = []
+
+    def record(self, operation, status, duration, queries, size):
+        with self._lock:
+            metrics = self.operations[operation]
+            metrics.duration.observe(duration)
+            metrics.queries.observe(queries.count)
+            metrics.sql_duration += queries.duration
+            if size is not None:
+                metrics.size.observe(size)
+            metrics.statuses[status] += 1
+
+    def record_slow(self, count, duration, request, queries):
+        """Logs the request if it is one of the `count` slowest ones so far."""
+        with self._lock:
+            if len(self.slowest) >= count and duration <= self.slowest[0]:
+                return
+            if len(self.slowest) >= count:
+                heapq.heapreplace(self.slowest, duration)
+            else:
+                heapq.heappush(self.slowest, duration)
+        logger.warning(
+            "Slow request %s %s: %.1f ms, %d queries in %.1f ms\n%s",
+            request.method,
+            request.get_full_path(),
+            duration * 1000,
+            queries.count,
+            queries.duration * 1000,
+            "\n".join(
+                f"{sql_duration * 1000:8.1f} ms  {sql}"
+                for sql_duration, sql in queries.sql
+            ),
+        )
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.slowest.clear()
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self._lock:
+            operations = sorted(self.operations.items())
+            lines = []
+            self._histogram(
+                lines,
+                "chat_request_duration_seconds",
+                "Time spent handling the requests.",
+                [(name, metrics.duration) for name, metrics in operations],
+            )
+            self._histogram(
+                lines,
+                "chat_request_queries",
+                "SQL queries run by the requests.",
+                [(name, metrics.queries) for name, metrics in operations],
+            )
+            lines += [
+                "# HELP chat_request_sql_duration_seconds_total Time spent in SQL queries.",
+                "# TYPE chat_request_sql_duration_seconds_total counter",
+            ]
+            lines += [
+                f'chat_request_sql_duration_seconds_total{{operation="{name}"}} '
+                f"{metrics.sql_duration}"
+                for name, metrics in operations
+            ]
+            self._histogram(
+                lines,
+                "chat_response_size_bytes",
+                "Size of the response bodies, streaming responses excluded.",
+                [(name, metrics.size) for name, metrics in operations],
+            )
+            lines += [
+                "# HELP chat_requests_total Requests handled, by status code.",
+                "# TYPE chat_requests_total counter",
+            ]
+            lines += [
+                f'chat_requests_total{{operation="{name}",status="{status}"}} {count}'
+                for name, metrics in operations
+                for status, count in sorted(metrics.statuses.items())
+            ]
+        return "\n".join(lines) + "\n"
+
+    def _histogram(self, lines, name, help, histograms):
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+        for operation, histogram in histograms:
+            labels = f'operation="{operation}"'
+            total = 0
+            for bound, count in zip([*histogram.buckets, "+Inf"], histogram.counts):
+                total += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {total}")
+
+
+metrics = Metrics()
@@ -0,0 +1,215 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+from .metrics import RequestQueries, metrics
+from .renderers import FORMATS, parse_accept
+from .routers import Reads, _reads, read_replica
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# set on the responses to writes, see `ReadYourWritesMiddleware`
+PRIMARY_COOKIE = "chat_primary"
+
+
+class MetricsMiddleware:
+    """
+    Records the time, SQL queries and response size of each request by
+    operation, exposed at `/api/metrics`.
+
+    Works for sync and async requests alike: the queries are counted by an
+    execute wrapper on the connections, see `metrics.record_query`. The time
+    of a streaming response doesn't include the streaming.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        slow_requests = settings.CHAT_METRICS_SLOW_REQUESTS
+        with RequestQueries(keep_sql=slow_requests > 0) as queries:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - start
+        self.record(request, response, duration, queries, slow_requests)
+        return response
+
+    async def __acall__(self, request):
+        slow_requests = settings.CHAT_METRICS_SLOW_REQUESTS
+        with RequestQueries(keep_sql=slow_requests > 0) as queries:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            duration = time.perf_counter() - start
+        self.record(request, response, duration, queries, slow_requests)
+        return response
+
+    def record(self, request, response, duration, queries, slow_requests):
+        match = request.resolver_match
+        if match is None:
+            # not found, the operation is unknown
+            return
+        size = None if response.streaming else len(response.content)
+        metrics.record(
+            match.url_name or match.view_name,
+            response.status_code,
+            duration,
+            queries,
+            size,
+        )
+        if slow_requests:
+            metrics.record_slow(slow_requests, duration, request, queries)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Reads the polls (`CHAT_REPLICA_OPERATIONS`) from a replica, see
+    `routers.ReplicaRouter`, unless the client wrote something in the last
+    `CHAT_READ_YOUR_WRITES_WINDOW` seconds: a cookie set on the responses to
+    its writes keeps it on the primary, where its writes are.
+
+    Views can still switch to the primary, e.g. when the replica is behind
+    what the client has already seen, see `routers.read_primary`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _reads.set(Reads())
+        try:
+            response = self.get_response(request)
+        finally:
+            _reads.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _reads.set(Reads())
+        try:
+            response = await self.get_response(request)
+        finally:
+            _reads.reset(token)
+        return self.pin(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if (
+            request.method in ("GET", "HEAD")
+            and match.url_name in settings.CHAT_REPLICA_OPERATIONS
+            and PRIMARY_COOKIE not in request.COOKIES
+        ):
+            read_replica()
+
+    def pin(self, request, response):
+        if (
+            settings.CHAT_DB_REPLICAS
+            and request.method not in ("GET", "HEAD", "OPTIONS")
+            and response.status_code < 400
+        ):
+            response.set_cookie(
+                PRIMARY_COOKIE,
+                "1",
+                max_age=settings.CHAT_READ_YOUR_WRITES_WINDOW,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+def compress_brotli(content):
+    # fast enough to compress each response, unlike the default quality of 11
+    return brotli.compress(content, quality=5)
+
+
+# by content coding, in the order of preference of the server when the client
+# accepts several with the same quality
+ENCODINGS = {"gzip": compress_string}
+if brotli is not None:
+    ENCODINGS = {"br": compress_brotli, **ENCODINGS}
+
+
+class CompressionMiddleware:
+    """
+    Compresses the API responses of at least `CHAT_COMPRESS_MIN_SIZE` bytes,
+    with brotli (when it is installed) or gzip, as accepted by the client.
+
+    Only the formats of the API are compressed (see `renderers.FORMATS`), not
+    the pages, where the compressed size could leak secrets such as the CSRF
+    token (BREACH), nor the streams, which would be held back.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def encoding(self, request):
+        """The accepted encoding with the highest quality, None if none is."""
+        qualities = {}
+        for encoding, quality in parse_accept(
+            request.headers.get("Accept-Encoding", "")
+        ):
+            qualities.setdefault(encoding, quality)
+        best, best_quality = None, 0
+        for encoding in ENCODINGS:
+            quality = qualities.get(encoding, qualities.get("*", 0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, request, response):
+        media_type = response.get("Content-Type", "").partition(";")[0].strip()
+        if (
+            response.streaming
+            or media_type not in FORMATS
+            or response.has_header("Content-Encoding")
+            or len(response.content) < settings.CHAT_COMPRESS_MIN_SIZE
+        ):
+            return response
+        # the response varies even when it isn't compressed
+        patch_vary_headers(response, ["Accept-Encoding"])
+        encoding = self.encoding(request)
+        if encoding is None:
+            return response
+        compressed = ENCODINGS[encoding](response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        # the representation changed, see django.middleware.gzip
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customer_messages", "0004_last_message"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="date",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customer_messages", "0005_message_date_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="archived_before",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="MessageArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_id", models.BigIntegerField()),
+                ("last_id", models.BigIntegerField()),
+                ("count", models.PositiveIntegerField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                ("data", models.BinaryField()),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="archives",
+                        to="customer_messages.conversation",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["conversation", "last_id"],
+                        name="archive_conversation_idx",
+                    )
+                ],
+            },
+        ),
+    ]
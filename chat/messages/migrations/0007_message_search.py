@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# the index as of this migration, not the one of messages.search, which
+# migrations don't import as it changes
+TABLE = "customer_messages_message"
+INDEX = "customer_messages_message_search"
+
+SQLITE_INSTALL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX} USING fts5("
+    f"content, content='{TABLE}', content_rowid='id', "
+    "tokenize='porter unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_insert AFTER INSERT ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} (rowid, content) "
+    "VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_delete AFTER DELETE ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} ({INDEX}, rowid, content) "
+    "VALUES ('delete', old.id, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_update "
+    f"AFTER UPDATE OF content ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} ({INDEX}, rowid, content) "
+    "VALUES ('delete', old.id, old.content); "
+    f"INSERT INTO {INDEX} (rowid, content) VALUES (new.id, new.content); END",
+    f"INSERT INTO {INDEX} ({INDEX}) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {INDEX}_insert",
+    f"DROP TRIGGER IF EXISTS {INDEX}_delete",
+    f"DROP TRIGGER IF EXISTS {INDEX}_update",
+    f"DROP TABLE IF EXISTS {INDEX}",
+]
+POSTGRES_INSTALL = [
+    f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS search tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED",
+    f"CREATE INDEX IF NOT EXISTS {INDEX}_idx ON {TABLE} USING GIN (search)",
+]
+POSTGRES_UNINSTALL = [
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search",
+]
+
+
+def execute(schema_editor, sqlite, postgresql):
+    vendor = schema_editor.connection.vendor
+    for sql in {"sqlite": sqlite, "postgresql": postgresql}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+def install(apps, schema_editor):
+    execute(schema_editor, SQLITE_INSTALL, POSTGRES_INSTALL)
+
+
+def uninstall(apps, schema_editor):
+    execute(schema_editor, SQLITE_UNINSTALL, POSTGRES_UNINSTALL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customer_messages", "0006_message_archive"),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
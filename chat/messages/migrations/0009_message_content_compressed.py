@@ -0,0 +1,89 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:01
+
+import messages.fields
+from django.db import migrations
+
+# the indexes as of this migration, not the one of messages.search, which
+# migrations don't import as it changes
+TABLE = "customer_messages_message"
+INDEX = "customer_messages_message_search"
+# registered on the SQLite connections, see messages.fields
+PLAIN_TEXT = "chat_plain_text"
+
+# of migration 0007, on the contents of the table
+PLAIN_INDEX_INSTALL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX} USING fts5("
+    f"content, content='{TABLE}', content_rowid='id', "
+    "tokenize='porter unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_insert AFTER INSERT ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} (rowid, content) "
+    "VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_delete AFTER DELETE ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} ({INDEX}, rowid, content) "
+    "VALUES ('delete', old.id, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_update "
+    f"AFTER UPDATE OF content ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} ({INDEX}, rowid, content) "
+    "VALUES ('delete', old.id, old.content); "
+    f"INSERT INTO {INDEX} (rowid, content) VALUES (new.id, new.content); END",
+    f"INSERT INTO {INDEX} ({INDEX}) VALUES ('rebuild')",
+]
+# on the plain text of the contents, compressed or not, read through a view
+INDEX_INSTALL = [
+    f"CREATE VIEW IF NOT EXISTS {INDEX}_content AS "
+    f"SELECT id, {PLAIN_TEXT}(content) AS content FROM {TABLE}",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX} USING fts5("
+    f"content, content='{INDEX}_content', content_rowid='id', "
+    "tokenize='porter unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_insert AFTER INSERT ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} (rowid, content) "
+    f"VALUES (new.id, {PLAIN_TEXT}(new.content)); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_delete AFTER DELETE ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} ({INDEX}, rowid, content) "
+    f"VALUES ('delete', old.id, {PLAIN_TEXT}(old.content)); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_update "
+    f"AFTER UPDATE OF content ON {TABLE} "
+    f"BEGIN INSERT INTO {INDEX} ({INDEX}, rowid, content) "
+    f"VALUES ('delete', old.id, {PLAIN_TEXT}(old.content)); "
+    f"INSERT INTO {INDEX} (rowid, content) "
+    f"VALUES (new.id, {PLAIN_TEXT}(new.content)); END",
+    f"INSERT INTO {INDEX} ({INDEX}) VALUES ('rebuild')",
+]
+# either index
+INDEX_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {INDEX}_insert",
+    f"DROP TRIGGER IF EXISTS {INDEX}_delete",
+    f"DROP TRIGGER IF EXISTS {INDEX}_update",
+    f"DROP TABLE IF EXISTS {INDEX}",
+    f"DROP VIEW IF EXISTS {INDEX}_content",
+]
+
+
+def sqlite(statements):
+    # the PostgreSQL index is a generated column of the plain contents, which
+    # are never compressed there
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == "sqlite":
+            for sql in statements:
+                schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customer_messages", "0008_conversation_read"),
+    ]
+
+    operations = [
+        # the Message table is remade on SQLite, which the view of the index
+        # and its triggers can't outlive
+        migrations.RunPython(sqlite(INDEX_UNINSTALL), sqlite(PLAIN_INDEX_INSTALL)),
+        migrations.AlterField(
+            model_name="message",
+            name="content",
+            field=messages.fields.CompressedTextField(),
+        ),
+        migrations.RunPython(sqlite(INDEX_INSTALL), sqlite(INDEX_UNINSTALL)),
+    ]
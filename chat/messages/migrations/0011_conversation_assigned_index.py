@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customer_messages", "0009_message_content_compressed"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="conversation",
+            index=models.Index(
+                models.ExpressionWrapper(
+                    models.Q(("assignee__isnull", False)),
+                    output_field=models.BooleanField(),
+                ),
+                models.F("created_at"),
+                models.F("id"),
+                name="conversation_assigned_idx",
+            ),
+        ),
+    ]
@@ -1,6 +1,14 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .fields import CompressedTextField
+
+# whether a conversation is assigned, indexed so that the assigned ones are
+# searched in the index, where a plain `assignee IS NOT NULL` would be scanned
+ASSIGNED = models.ExpressionWrapper(
+    models.Q(assignee__isnull=False), output_field=models.BooleanField()
+)
 
 
 class Conversation(models.Model):
@@ -25,6 +33,8 @@ class Conversation(models.Model):
         null=True,
         blank=True,
         related_name="assigned_conversations",
+        # covered by the assignee index below
+        db_index=False,
     )
 
     status = models.CharField(
@@ -33,6 +43,51 @@ class Conversation(models.Model):
         default=ConversationStatus.OPEN,
     )
 
+    # denormalized from the messages, updated when a message is posted
+    last_message = models.ForeignKey(
+        "Message",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        blank=True,
+        related_name="+",
+        db_index=False,
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Message.AuthorChoice of the last message
+    last_author = models.CharField(max_length=3, null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    # messages of the customer, unread by an agent past their ConversationRead
+    customer_message_count = models.PositiveIntegerField(default=0)
+    # the messages before this id are in MessageArchive, see messages.archive
+    archived_before = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        # conversations are listed by creation date, filtered by status or assignee,
+        # or by recent activity, filtered by the author of the last message
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="conversation_created_idx"),
+            models.Index(
+                fields=["status", "created_at", "id"], name="conversation_status_idx"
+            ),
+            models.Index(
+                fields=["assignee", "created_at", "id"],
+                name="conversation_assignee_idx",
+            ),
+            models.Index(
+                ASSIGNED,
+                models.F("created_at"),
+                models.F("id"),
+                name="conversation_assigned_idx",
+            ),
+            models.Index(
+                fields=["last_message_at", "id"], name="conversation_recent_idx"
+            ),
+            models.Index(
+                fields=["last_author", "last_message_at", "id"],
+                name="conversation_last_author_idx",
+            ),
+        ]
+
     def __str__(self):
         if self.customer:
             customer = self.customer.email
@@ -47,8 +102,78 @@ class Message(models.Model):
         AGENT = "AGE", _("Agent")
 
     conversation = models.ForeignKey(
-        Conversation, on_delete=models.DO_NOTHING, related_name="messages"
+        Conversation,
+        on_delete=models.DO_NOTHING,
+        related_name="messages",
+        # covered by the conversation index below
+        db_index=False,
     )
-    date = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add, so that replicated messages keep the date they were logged at
+    date = models.DateTimeField(default=timezone.now, editable=False)
     author = models.CharField(max_length=3, choices=AuthorChoice.choices)
-    content = models.TextField()
+    # large contents (e.g. pasted logs) are compressed
+    content = CompressedTextField()
+
+    class Meta:
+        # messages are listed per conversation, by id
+        indexes = [
+            models.Index(
+                fields=["conversation", "id"], name="message_conversation_idx"
+            ),
+        ]
+
+
+class MessageArchive(models.Model):
+    """
+    Messages of a conversation moved out of the `Message` table, as a zlib
+    compressed JSON list of `[id, date, author, content]`, see
+    `messages.archive`.
+    """
+
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.DO_NOTHING,
+        related_name="archives",
+        # covered by the conversation index below
+        db_index=False,
+    )
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    count = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["conversation", "last_id"], name="archive_conversation_idx"
+            ),
+        ]
+
+
+class ConversationRead(models.Model):
+    """
+    Read cursor of an agent in a conversation: the agent has read the
+    messages up to `last_read_id`, and `read_count` of the customer's ones,
+    so the unread ones are `customer_message_count - read_count`.
+    """
+
+    agent = models.ForeignKey(
+        "auth.User",
+        on_delete=models.CASCADE,
+        related_name="conversation_reads",
+        # covered by the unique constraint below
+        db_index=False,
+    )
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="reads"
+    )
+    last_read_id = models.BigIntegerField()
+    read_count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["agent", "conversation"], name="read_agent_conversation_uniq"
+            ),
+        ]
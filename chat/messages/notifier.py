@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseListener:
+    """
+    Receives the messages published in a conversation while it is open.
+
+    Used as an async context manager, so that listening starts before the
+    caller reads the messages already stored and nothing committed in
+    between is missed.
+    """
+
+    def __init__(self, notifier, conversation):
+        self.notifier = notifier
+        self.conversation = conversation
+
+    async def get(self, timeout):
+        """Returns the next published message, or None after the timeout."""
+        raise NotImplementedError
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class BaseNotifier:
+    """
+    Fan-out backend pushing newly committed messages to listening requests.
+
+    Messages are published as `MessageOut` shaped dicts.
+    """
+
+    listener_class = BaseListener
+
+    def listen(self, conversation):
+        return self.listener_class(self, conversation)
+
+    def publish(self, conversation, message):
+        raise NotImplementedError
+
+
+class InMemoryListener(BaseListener):
+    def __init__(self, notifier, conversation):
+        super().__init__(notifier, conversation)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self):
+        self.notifier.subscribe(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.notifier.unsubscribe(self)
+
+
+class InMemoryNotifier(BaseNotifier):
+    """
+    Fan-out within the current process.
+
+    Writers may run in any thread (sync views are run in a threadpool under
+    ASGI), so listeners are woken up through their own event loop.
+    """
+
+    listener_class = InMemoryListener
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = defaultdict(set)
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners[listener.conversation].add(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            listeners = self._listeners.get(listener.conversation)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[listener.conversation]
+
+    def publish(self, conversation, message):
+        with self._lock:
+            listeners = list(self._listeners.get(conversation, ()))
+        for listener in listeners:
+            listener.loop.call_soon_threadsafe(listener.queue.put_nowait, message)
+
+
+notifier = import_string(settings.CHAT_NOTIFIER_BACKEND)()
@@ -0,0 +1,263 @@
+import base64
+import binascii
+import datetime
+import json
+from functools import partial, wraps
+from typing import Any, List, Optional
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q, QuerySet
+from django.http import HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.module_loading import import_string
+from ninja import Field, Router, Schema
+from ninja.conf import settings
+from ninja.errors import HttpError
+from ninja.pagination import AsyncPaginationBase, make_response_paginated
+from ninja.signature.details import is_collection_type
+from ninja.utils import (
+    contribute_operation_args,
+    contribute_operation_callback,
+    is_async_callable,
+)
+from .renderers import negotiated, render
+from .serializers import Rows, Serialized
+
+
+def _cursor_value(value):
+    # unlike DjangoJSONEncoder, keep the microseconds of datetimes
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, default=_cursor_value, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (binascii.Error, ValueError):
+        raise HttpError(400, "Invalid cursor")
+    if not isinstance(values, list):
+        raise HttpError(400, "Invalid cursor")
+    return values
+
+
+class KeysetPagination(AsyncPaginationBase):
+    """
+    Cursor pagination on the ordering of the queryset.
+
+    The next page starts after the last item of the current one, e.g.
+    `id > last_id` for messages, so deep pages cost the same as the first one
+    and no `OFFSET` is needed. The ordering must be on unique columns (ending
+    with `id`).
+
+    `count` is only computed with `?count=true`. Otherwise it is known for
+    free when the whole result fits in the first page, and null if not.
+    """
+
+    class Input(Schema):
+        limit: int = Field(
+            settings.PAGINATION_PER_PAGE,
+            ge=1,
+            le=(
+                settings.PAGINATION_MAX_LIMIT
+                if settings.PAGINATION_MAX_LIMIT != float("inf")
+                else None
+            ),
+        )
+        cursor: Optional[str] = None
+        count: bool = False
+
+    class Output(Schema):
+        items: List[Any]
+        count: Optional[int] = None
+        next: Optional[str] = None
+
+    def paginate_queryset(self, queryset, pagination: Input, **params: Any) -> Any:
+        rows, queryset = self._unwrap(queryset)
+        page = self._page(queryset, rows, pagination)
+        items = list(page[: pagination.limit + 1])
+        count = None
+        if pagination.count:
+            count = self._items_count(queryset)
+        return self._result(queryset, rows, items, pagination, count)
+
+    async def apaginate_queryset(
+        self, queryset, pagination: Input, **params: Any
+    ) -> Any:
+        rows, queryset = self._unwrap(queryset)
+        page = self._page(queryset, rows, pagination)
+        if isinstance(page, QuerySet):
+            # the page has to be fetched here, async views can't evaluate it lazily
+            items = [item async for item in page[: pagination.limit + 1]]
+        else:
+            items = list(page[: pagination.limit + 1])
+        count = None
+        if pagination.count:
+            count = await self._aitems_count(queryset)
+        return self._result(queryset, rows, items, pagination, count)
+
+    def _unwrap(self, queryset):
+        if isinstance(queryset, Rows):
+            return queryset, queryset.queryset
+        return None, queryset
+
+    def _page(self, queryset, rows, pagination):
+        ordering = self._ordering(queryset, rows)
+        if pagination.cursor is None or ordering is None:
+            return queryset
+        values = decode_cursor(pagination.cursor)
+        if len(values) != len(ordering):
+            raise HttpError(400, "Invalid cursor")
+        if isinstance(queryset, QuerySet):
+            values = self._values(queryset.model, ordering, values)
+            return queryset.filter(self._after(ordering, values))
+        # compared with the values of the rows, so of the same types
+        values = self._values(rows.model, ordering, values)
+        return [row for row in queryset if [row[name] for name in ordering] > values]
+
+    def _result(self, queryset, rows, items, pagination, count):
+        has_next = len(items) > pagination.limit
+        items = items[: pagination.limit]
+        if count is None and not has_next and pagination.cursor is None:
+            count = len(items)
+        next_cursor = None
+        ordering = self._ordering(queryset, rows)
+        if has_next and ordering is not None:
+            last = items[-1]
+            next_cursor = encode_cursor(
+                [
+                    last[name] if isinstance(last, dict) else getattr(last, name)
+                    for name in [name.lstrip("-") for name in ordering]
+                ]
+            )
+        if rows is not None:
+            items = Serialized(rows.serialize(items))
+        return {"items": items, "count": count, "next": next_cursor}
+
+    def _ordering(self, queryset, rows):
+        """Ordering of a queryset, or of a list of rows (ascending only)."""
+        if not isinstance(queryset, QuerySet):
+            return rows and rows.ordering
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        if not ordering or any(not isinstance(name, str) for name in ordering):
+            raise ValueError("Keyset pagination needs a queryset ordered by fields")
+        return list(ordering)
+
+    def _values(self, model, ordering, values):
+        """Values of a cursor as the ones of the ordering fields of `model`."""
+        try:
+            values = [
+                model._meta.get_field(name.lstrip("-")).to_python(value)
+                for name, value in zip(ordering, values)
+            ]
+        except (FieldDoesNotExist, ValidationError, TypeError):
+            raise HttpError(400, "Invalid cursor")
+        # the ordering fields are never null
+        if None in values:
+            raise HttpError(400, "Invalid cursor")
+        return values
+
+    def _after(self, ordering, values):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        equal = {}
+        for name, value in zip(ordering, values):
+            field_name = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{field_name}__{lookup}": value})
+            equal[field_name] = value
+        return condition
+
+
+class Paged:
+    """
+    Items returned by a view with a callback of the items of their page, once
+    paginated, e.g. to record what was sent. It is awaited in async views.
+    """
+
+    def __init__(self, items, on_page):
+        self.items = items
+        self.on_page = on_page
+
+
+def _unwrap_paged(result):
+    if isinstance(result, Paged):
+        return result.items, result.on_page
+    return result, None
+
+
+def render_page(request, page, kwargs):
+    if isinstance(page["items"], Serialized):
+        response = negotiated(request, HttpResponse(render(request, page)[0]))
+        # keep the headers set on the `response: HttpResponse` argument of the view
+        for value in kwargs.values():
+            if isinstance(value, HttpResponse):
+                for header, header_value in value.items():
+                    response.headers.setdefault(header, header_value)
+        return response
+    return page
+
+
+def paginate(view_func, paginator):
+    """
+    Like Ninja's pagination, except that the view can return an HttpResponse
+    (returned as is) or `Paged` items, and pages of `Rows` are rendered
+    directly, without the validation of the response schema.
+    """
+    if is_async_callable(view_func):
+
+        @wraps(view_func)
+        async def view_with_pagination(request, **kwargs):
+            pagination = kwargs.pop("ninja_pagination")
+            result = await view_func(request, **kwargs)
+            if isinstance(result, HttpResponseBase):
+                return result
+            result, on_page = _unwrap_paged(result)
+            page = await paginator.apaginate_queryset(
+                result, pagination=pagination, request=request, **kwargs
+            )
+            if on_page is not None:
+                await on_page(page["items"])
+            return render_page(request, page, kwargs)
+
+    else:
+
+        @wraps(view_func)
+        def view_with_pagination(request, **kwargs):
+            pagination = kwargs.pop("ninja_pagination")
+            result = view_func(request, **kwargs)
+            if isinstance(result, HttpResponseBase):
+                return result
+            result, on_page = _unwrap_paged(result)
+            page = paginator.paginate_queryset(
+                result, pagination=pagination, request=request, **kwargs
+            )
+            if on_page is not None:
+                on_page(page["items"])
+            return render_page(request, page, kwargs)
+
+    contribute_operation_args(
+        view_with_pagination, "ninja_pagination", paginator.Input, paginator.InputSource
+    )
+    contribute_operation_callback(
+        view_with_pagination, partial(make_response_paginated, paginator)
+    )
+    return view_with_pagination
+
+
+class RouterPaginated(Router):
+    """Paginates the operations responding with a list, see `paginate`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.paginator = import_string(settings.PAGINATION_CLASS)()
+
+    def add_api_operation(self, path, methods, view_func, **kwargs):
+        if is_collection_type(kwargs["response"]):
+            view_func = paginate(view_func, self.paginator)
+        return super().add_api_operation(path, methods, view_func, **kwargs)
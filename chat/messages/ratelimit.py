@@ -0,0 +1,154 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from ninja.errors import Throttled
+from ninja.throttling import BaseThrottle
+
+# what a request is counted against, see `TokenBucketThrottle`
+KEYS = ["conversation", "user", "ip"]
+
+
+class BaseBuckets:
+    """
+    Token buckets: each holds up to `burst` tokens, refilled at `rate` tokens
+    per second, and a request takes one.
+    """
+
+    def take(self, key, rate, burst):
+        """
+        Takes a token from the bucket of `key`. Returns 0 if there was one,
+        otherwise the seconds until there is one, and nothing is taken.
+        """
+        raise NotImplementedError
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class InMemoryBuckets(BaseBuckets):
+    """Buckets of the current process."""
+
+    # full buckets are forgotten once there are this many
+    max_size = 100_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key: (tokens, time of the last update)
+        self._buckets = {}
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_size:
+                self._forget_full(now, rate, burst)
+            return 0
+
+    def _forget_full(self, now, rate, burst):
+        # with the limits of this request, the others being close enough
+        self._buckets = {
+            key: (tokens, updated)
+            for key, (tokens, updated) in self._buckets.items()
+            if refill(tokens, updated, now, rate, burst) < burst
+        }
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets(BaseBuckets):
+    """
+    Buckets in the `CHAT_RATE_LIMIT_CACHE_ALIAS` cache, shared by the
+    processes using it (e.g. Redis). Requests of a key racing each other may
+    both take the last token, so the limits are approximate.
+    """
+
+    def __init__(self):
+        self.cache = caches[settings.CHAT_RATE_LIMIT_CACHE_ALIAS]
+
+    def take(self, key, rate, burst):
+        key = f"chat:ratelimit:{key}"
+        # wall clock time, shared by the processes
+        now = time.time()
+        tokens, updated = self.cache.get(key, (burst, now))
+        tokens = refill(tokens, updated, now, rate, burst)
+        wait = 0
+        if tokens < 1:
+            wait = (1 - tokens) / rate
+        else:
+            tokens -= 1
+        # forgotten once full again
+        self.cache.set(key, (tokens, now), math.ceil((burst - tokens) / rate) + 1)
+        return wait
+
+
+buckets = import_string(settings.CHAT_RATE_LIMIT_BACKEND)()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits the requests of an operation by conversation, user or client IP,
+    with the rate and burst of `CHAT_RATE_LIMITS[operation][key]`. Requests
+    without the key (e.g. anonymous ones for `user`, or a conversation not
+    in the URL, as the body isn't parsed yet) aren't limited by it.
+    """
+
+    def __init__(self, operation, key):
+        self.operation = operation
+        self.key = key
+        # per thread, as the throttle is shared by the requests of the operation
+        self._local = threading.local()
+
+    def get_key_ident(self, request):
+        if self.key == "conversation":
+            # from the URL, the throttles are checked before the parameters
+            match = getattr(request, "resolver_match", None)
+            if match is None:
+                return None
+            return match.kwargs.get("conversation")
+        if self.key == "user":
+            if getattr(request, "auth", None) is not None:
+                return f"user:{request.auth.pk}"
+            # customers have no user, but their session tells them apart
+            session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+            if session:
+                return hashlib.sha256(session.encode()).hexdigest()
+            return None
+        return self.get_ident(request)
+
+    def allow_request(self, request):
+        limit = settings.CHAT_RATE_LIMITS.get(self.operation, {}).get(self.key)
+        ident = limit and self.get_key_ident(request)
+        if not ident:
+            return True
+        rate, burst = limit
+        self._local.wait = buckets.take(
+            f"{self.operation}:{self.key}:{ident}", rate, burst
+        )
+        return not self._local.wait
+
+    def wait(self):
+        return self._local.wait
+
+
+def rate_limits(operation):
+    """Throttles of an operation, see `TokenBucketThrottle`."""
+    return [TokenBucketThrottle(operation, key) for key in KEYS]
+
+
+def rate_limited(request, exc: Throttled, api):
+    response = api.create_response(request, {"detail": str(exc)}, status=429)
+    if exc.wait is not None:
+        response["Retry-After"] = str(math.ceil(exc.wait))
+    return response
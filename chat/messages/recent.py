@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.cache import caches
+
+
+class RecentMessages:
+    """
+    Cache of the last messages of the active conversations, as `MessageOut`
+    rows.
+
+    An entry holds all the messages of a conversation after the id `after`,
+    up to the last `CHAT_MESSAGE_CACHE_SIZE` ones, so that polls with a
+    `since` inside the buffer don't have to query the database. Eviction
+    across conversations is left to the cache backend (LRU for the local
+    memory one, sized with its MAX_ENTRIES option).
+
+    Entries are only written by `extend`, once the posting transaction is
+    committed, with the id of the message before the new ones, read while
+    the conversation was locked. An entry is only used when it ends with the
+    last message of the conversation in the database, so that entries missed
+    by the writes of other processes, or extended out of order, aren't
+    served.
+    """
+
+    def _cache(self):
+        return caches[settings.CHAT_MESSAGE_CACHE_ALIAS]
+
+    def _key(self, conversation):
+        return f"chat:recent:{conversation}"
+
+    def get(self, conversation, last_message_id, since=None):
+        """
+        Rows after `since`, or None if the cache doesn't cover it or doesn't
+        end with `last_message_id`, the last message of the conversation.
+        """
+        entry = self._cache().get(self._key(conversation))
+        return self._lookup(entry, last_message_id, since)
+
+    async def aget(self, conversation, last_message_id, since=None):
+        entry = await self._cache().aget(self._key(conversation))
+        return self._lookup(entry, last_message_id, since)
+
+    def _lookup(self, entry, last_message_id, since):
+        if entry is None or last_message_id is None or (since or 0) < entry["after"]:
+            return None
+        last_id = entry["items"][-1]["id"] if entry["items"] else entry["after"]
+        if last_id != last_message_id:
+            return None
+        return [row for row in entry["items"] if row["id"] > (since or 0)]
+
+    def append(self, conversation, previous_id, row):
+        self.extend(conversation, previous_id, [row])
+
+    def extend(self, conversation, previous_id, rows):
+        """Adds the rows of the messages following `previous_id`."""
+        cache = self._cache()
+        key = self._key(conversation)
+        if previous_id is None:
+            cache.delete(key)
+            return
+
+        entry = cache.get(key)
+        last_id = entry and (entry["items"][-1]["id"] if entry["items"] else None)
+        if entry is None or (last_id or entry["after"]) != previous_id:
+            entry = {"after": previous_id, "items": []}
+
+        entry["items"].extend(rows)
+        size = settings.CHAT_MESSAGE_CACHE_SIZE
+        if len(entry["items"]) > size:
+            entry["after"] = entry["items"][-size - 1]["id"]
+            entry["items"] = entry["items"][-size:]
+        cache.set(key, entry, settings.CHAT_MESSAGE_CACHE_TIMEOUT)
+
+    def invalidate(self, conversation):
+        self._cache().delete(self._key(conversation))
+
+
+recent_messages = RecentMessages()
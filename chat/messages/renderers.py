@@ -0,0 +1,163 @@
+import json
+from typing import Callable, NamedTuple
+from django.utils.cache import patch_vary_headers
+from ninja import NinjaAPI, renderers
+from ninja.responses import NinjaJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+_encoder = NinjaJSONEncoder()
+
+
+def _default(obj):
+    # same formats as the stdlib path, e.g. datetimes to milliseconds
+    return _encoder.default(obj)
+
+
+def dumps(data):
+    """Encodes to JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(
+            data, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return json.dumps(data, cls=NinjaJSONEncoder).encode()
+
+
+def packb(data):
+    # datetimes and uuids as strings, as in JSON
+    return msgpack.packb(data, default=_default)
+
+
+def columnar(data):
+    """
+    Lists of items as columns: `{"items": [{"id": 1, "author": "CUS"}, {"id":
+    2, "author": "CUS"}]}` becomes `{"length": 2, "columns": {"id": [1, 2]},
+    "constants": {"author": "CUS"}}`, the columns with the same value for
+    every item (e.g. the conversation of the messages) being sent once, in
+    `constants`. A key missing from some items is null in their column. Other
+    data is unchanged.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+        return data
+    items = data["items"]
+    keys = {}
+    for item in items:
+        keys.update(dict.fromkeys(item))
+    columns = {}
+    constants = {}
+    for key in keys:
+        column = [item.get(key) for item in items]
+        if all(value == column[0] for value in column):
+            constants[key] = column[0]
+        else:
+            columns[key] = column
+    data = {key: value for key, value in data.items() if key != "items"}
+    return dict(data, length=len(items), columns=columns, constants=constants)
+
+
+class Format(NamedTuple):
+    media_type: str
+    encode: Callable
+    columnar: bool = False
+    # of the text formats
+    charset: str = None
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f"{self.media_type}; charset={self.charset}"
+        return self.media_type
+
+
+JSON = Format("application/json", dumps, charset="utf-8")
+# by media type
+FORMATS = {
+    format.media_type: format
+    for format in [
+        JSON,
+        Format("application/vnd.chat.columnar+json", dumps, True, "utf-8"),
+        *(
+            [
+                Format("application/msgpack", packb),
+                Format("application/vnd.chat.columnar+msgpack", packb, True),
+            ]
+            if msgpack is not None
+            else []
+        ),
+    ]
+}
+
+
+def parse_accept(header):
+    """
+    Values of an `Accept` (or `Accept-Encoding`) header, lowercase, with
+    their quality, the best first, in the order of the header if equal.
+    """
+    accepted = []
+    for position, item in enumerate(header.split(",")):
+        value, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if value:
+            accepted.append((-quality, position, value.lower()))
+    return [(value, -quality) for quality, _, value in sorted(accepted)]
+
+
+def negotiate(request):
+    """
+    Format of the response, the first of `FORMATS` with the highest quality
+    in the `Accept` header, JSON if there is none.
+    """
+    for media_type, quality in parse_accept(request.headers.get("Accept", "")):
+        if quality > 0 and media_type in FORMATS:
+            return FORMATS[media_type]
+    return JSON
+
+
+def render(request, data):
+    """The response content in the negotiated format, and its content type."""
+    format = negotiate(request)
+    if format.columnar:
+        data = columnar(data)
+    return format.encode(data), format.content_type
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """Renders in the negotiated format, see `NegotiatedAPI`."""
+
+    def render(self, request, data, *, response_status):
+        return render(request, data)[0]
+
+
+def negotiated(request, response):
+    """Sets the content type of a response rendered with `render`."""
+    response["Content-Type"] = negotiate(request).content_type
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+class NegotiatedAPI(NinjaAPI):
+    """
+    An API responding in the format the client accepts: JSON by default,
+    columnar JSON or MessagePack (with `msgpack` installed), see `FORMATS`.
+    """
+
+    def create_response(self, request, data, *, status=None, temporal_response=None):
+        response = super().create_response(
+            request, data, status=status, temporal_response=temporal_response
+        )
+        return negotiated(request, response)
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.cache import cache
+
+AGENT = "agent"
+
+
+def _cache_key(user_id):
+    return f"chat:roles:{user_id}"
+
+
+def get_user_roles(user):
+    """
+    Returns the names of the groups of the user.
+
+    They are cached per user, the signals in `messages.signals` invalidate the
+    cache when the group membership changes.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+
+    key = _cache_key(user.pk)
+    roles = cache.get(key)
+    if roles is None:
+        roles = frozenset(user.groups.values_list("name", flat=True))
+        cache.set(key, roles, settings.CHAT_ROLES_CACHE_TIMEOUT)
+    return roles
+
+
+async def aget_user_roles(user):
+    if not user.is_authenticated:
+        return frozenset()
+
+    key = _cache_key(user.pk)
+    roles = await cache.aget(key)
+    if roles is None:
+        roles = frozenset(
+            [name async for name in user.groups.values_list("name", flat=True)]
+        )
+        await cache.aset(key, roles, settings.CHAT_ROLES_CACHE_TIMEOUT)
+    return roles
+
+
+async def aget_user(request):
+    """
+    User of the request, for async views: `request.user` would be loaded
+    with a synchronous query.
+    """
+    # set by AuthenticationMiddleware
+    auser = getattr(request, "auser", None)
+    if auser is None:
+        return request.user
+    return await auser()
+
+
+def get_roles(request):
+    """Roles of the user of the request, looked up once per request."""
+    if not hasattr(request, "_chat_roles"):
+        request._chat_roles = get_user_roles(request.user)
+    return request._chat_roles
+
+
+async def aget_roles(request):
+    if not hasattr(request, "_chat_roles"):
+        request._chat_roles = await aget_user_roles(await aget_user(request))
+    return request._chat_roles
+
+
+def is_agent(request):
+    return AGENT in get_roles(request)
+
+
+async def ais_agent(request):
+    return AGENT in await aget_roles(request)
+
+
+def invalidate_roles(user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,58 @@
+import contextvars
+import random
+from django.conf import settings
+from .apps import MessagesConfig
+
+# seen by the threads running the ORM calls of async views, as the metrics
+_reads = contextvars.ContextVar("chat_reads", default=None)
+
+
+class Reads:
+    """Database the messages and conversations are read from in a request."""
+
+    def __init__(self):
+        # None for the primary
+        self.alias = None
+
+
+def read_replica():
+    """Reads the rest of the request from a replica, if any."""
+    reads = _reads.get()
+    if reads is not None and settings.CHAT_DB_REPLICAS:
+        reads.alias = random.choice(settings.CHAT_DB_REPLICAS)
+
+
+def read_primary():
+    """Reads the rest of the request from the primary."""
+    reads = _reads.get()
+    if reads is not None:
+        reads.alias = None
+
+
+def reading_replica():
+    reads = _reads.get()
+    return reads is not None and reads.alias is not None
+
+
+class ReplicaRouter:
+    """
+    Routes the reads of the chat models to the replica chosen for the
+    request, see `ReadYourWritesMiddleware`. Everything else, writes and
+    locking reads included, goes to the primary.
+
+    Other apps (sessions, users...) always read from the primary, so a user
+    who just logged in is found.
+    """
+
+    def db_for_read(self, model, **hints):
+        reads = _reads.get()
+        if reads is None or model._meta.app_label != MessagesConfig.label:
+            return None
+        return reads.alias
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas have the same data
+        return True
@@ -0,0 +1,187 @@
+"""
+Full-text search of the messages.
+
+The index is kept up to date by the database, as the messages are written:
+
+- on SQLite, an FTS5 table with the content of `Message`, filled by triggers,
+  decompressing the contents compressed by `CompressedTextField`,
+- on PostgreSQL, a generated `tsvector` column of `Message`, with a GIN index.
+
+A search ranks the last `CANDIDATES` matching messages, recent conversations
+being the ones agents look for, and groups them by conversation, so its cost
+doesn't grow with the history or the number of matches.
+"""
+
+import re
+from dataclasses import dataclass
+from django.db import connections, router
+from .fields import PLAIN_TEXT_SQL_FUNCTION
+from .models import Message
+
+CANDIDATES = 1000
+# text search configuration of the PostgreSQL index
+POSTGRES_CONFIG = "english"
+# words of the excerpts around the best match
+EXCERPT_WORDS = 16
+
+
+@dataclass
+class Match:
+    conversation: int
+    # higher is better
+    rank: float
+    # matching messages among the candidates
+    matches: int
+    # the best matching message, and its text around the match
+    message: int
+    excerpt: str
+
+
+def _names():
+    table = Message._meta.db_table
+    return table, f"{table}_search"
+
+
+def install(schema_editor):
+    """
+    Creates the index of the messages. On SQLite, migrations remaking the
+    `Message` table (e.g. most `AlterField`) have to uninstall it before and
+    install it again after, see migration 0009.
+    """
+    table, index = _names()
+    if schema_editor.connection.vendor == "sqlite":
+        plain_text = PLAIN_TEXT_SQL_FUNCTION
+        # the plain text of the messages, which the index reads for the excerpts
+        schema_editor.execute(
+            f"CREATE VIEW IF NOT EXISTS {index}_content AS "
+            f"SELECT id, {plain_text}(content) AS content FROM {table}"
+        )
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+            f"content, content='{index}_content', content_rowid='id', "
+            "tokenize='porter unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} "
+            f"BEGIN INSERT INTO {index} (rowid, content) "
+            f"VALUES (new.id, {plain_text}(new.content)); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} "
+            f"BEGIN INSERT INTO {index} ({index}, rowid, content) "
+            f"VALUES ('delete', old.id, {plain_text}(old.content)); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {index}_update "
+            f"AFTER UPDATE OF content ON {table} "
+            f"BEGIN INSERT INTO {index} ({index}, rowid, content) "
+            f"VALUES ('delete', old.id, {plain_text}(old.content)); "
+            f"INSERT INTO {index} (rowid, content) "
+            f"VALUES (new.id, {plain_text}(new.content)); END"
+        )
+        schema_editor.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{POSTGRES_CONFIG}', content)) STORED"
+        )
+        create_postgres_index(schema_editor, table)
+
+
+def create_postgres_index(cursor, table):
+    """Also used for the partitioned table, see `partition_messages`."""
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {_names()[1]}_idx ON {table} USING GIN (search)"
+    )
+
+
+def uninstall(schema_editor):
+    table, index = _names()
+    if schema_editor.connection.vendor == "sqlite":
+        for trigger in ["insert", "delete", "update"]:
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {index}_{trigger}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {index}")
+        schema_editor.execute(f"DROP VIEW IF EXISTS {index}_content")
+    elif schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search")
+
+
+def fts_query(query):
+    # every word is required, as a string so that the FTS5 syntax isn't exposed
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+
+
+def _search_sqlite(cursor, query, limit):
+    table, index = _names()
+    query = fts_query(query)
+    if not query:
+        return []
+    # FTS5 ranks are negative, lower is better; the bare `id` column is the one
+    # of the row with the min() rank
+    cursor.execute(
+        f"SELECT message.conversation_id, min(candidate.rank) AS best, count(*), "
+        f"candidate.id FROM (SELECT rowid AS id, rank FROM {index} "
+        f"WHERE {index} MATCH %s ORDER BY rowid DESC LIMIT %s) candidate "
+        f"JOIN {table} message ON message.id = candidate.id "
+        "GROUP BY message.conversation_id ORDER BY best LIMIT %s",
+        [query, CANDIDATES, limit],
+    )
+    rows = [
+        (conversation, -rank, matches, id)
+        for conversation, rank, matches, id in cursor.fetchall()
+    ]
+    if not rows:
+        return []
+    ids = [row[3] for row in rows]
+    cursor.execute(
+        f"SELECT rowid, snippet({index}, 0, '', '', '…', {EXCERPT_WORDS}) "
+        f"FROM {index} WHERE {index} MATCH %s "
+        f"AND rowid IN ({', '.join(['%s'] * len(ids))})",
+        [query, *ids],
+    )
+    excerpts = dict(cursor.fetchall())
+    return [Match(*row, excerpt=excerpts[row[3]]) for row in rows]
+
+
+def _search_postgresql(cursor, query, limit):
+    table = Message._meta.db_table
+    cursor.execute(
+        "SELECT conversation_id, max(rank), count(*), "
+        "(array_agg(id ORDER BY rank DESC, id DESC))[1] "
+        f"FROM (SELECT id, conversation_id, ts_rank(search, query) AS rank "
+        f"FROM {table}, websearch_to_tsquery(%s, %s) query "
+        "WHERE search @@ query ORDER BY id DESC LIMIT %s) candidate "
+        "GROUP BY conversation_id ORDER BY max(rank) DESC LIMIT %s",
+        [POSTGRES_CONFIG, query, CANDIDATES, limit],
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    cursor.execute(
+        "SELECT id, ts_headline(%s, content, websearch_to_tsquery(%s, %s), %s) "
+        f"FROM {table} WHERE id = ANY(%s)",
+        [
+            POSTGRES_CONFIG,
+            POSTGRES_CONFIG,
+            query,
+            f"StartSel='', StopSel='', MaxWords={EXCERPT_WORDS}, "
+            f"MinWords={EXCERPT_WORDS // 2}",
+            [row[3] for row in rows],
+        ],
+    )
+    excerpts = dict(cursor.fetchall())
+    return [Match(*row, excerpt=excerpts[row[3]]) for row in rows]
+
+
+def search(query, limit):
+    """
+    Best matches of the query, one per conversation, best first. Read from
+    the replica of the request, if any.
+    """
+    connection = connections[router.db_for_read(Message)]
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            return _search_sqlite(cursor, query, limit)
+        if connection.vendor == "postgresql":
+            return _search_postgresql(cursor, query, limit)
+    raise NotImplementedError(f"No full-text search for {connection.vendor}")
@@ -0,0 +1,20 @@
+class Rows:
+    """
+    Items to paginate without model instances: a `values()` queryset, or a
+    list of dicts sorted on `ordering` (e.g. cached rows), the fields of
+    `model`.
+
+    `serialize` turns the rows of a page into response items. It skips the
+    validation of the response schema, so the items must be in its exact
+    shape.
+    """
+
+    def __init__(self, queryset, serialize=None, ordering=None, model=None):
+        self.queryset = queryset
+        self.serialize = serialize or list
+        self.ordering = ordering
+        self.model = model
+
+
+class Serialized(list):
+    """Response items in the shape of the response schema, rendered as is."""
@@ -0,0 +1,61 @@
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from .conditional import conversations_changed
+from .fields import install_sql_function
+from .metrics import install_execute_wrapper
+from .models import Conversation
+from .roles import invalidate_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        # user.groups.add(...)
+        invalidate_roles([instance.pk])
+    elif action == "pre_clear":
+        # group.user_set.clear(), the users are only known before
+        invalidate_roles(instance.user_set.values_list("pk", flat=True))
+    else:
+        # group.user_set.add(...)
+        invalidate_roles(pk_set)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    # the roles are the names of the groups
+    if not created:
+        invalidate_roles(instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    invalidate_roles(instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    # a new user may reuse the id of a deleted one
+    if created:
+        invalidate_roles([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_roles([instance.pk])
+
+
+@receiver(post_save, sender=Conversation)
+@receiver(post_delete, sender=Conversation)
+def conversation_changed(sender, instance, **kwargs):
+    transaction.on_commit(conversations_changed)
+
+
+# queries are counted by MetricsMiddleware
+connection_created.connect(install_execute_wrapper)
+# used by the search index, see messages.search
+connection_created.connect(install_sql_function)
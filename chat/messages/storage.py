@@ -0,0 +1,367 @@
+import uuid
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from .archive import archived_rows, get_archives
+from .conditional import conversations_changed
+from .models import Conversation, Message, MessageArchive
+from .notifier import notifier
+from .recent import recent_messages
+from .routers import read_primary, reading_replica
+from .serializers import Rows
+
+MESSAGE_FIELDS = ["id", "date", "content", "author"]
+
+
+def get_messages(conversation: uuid.UUID, since: int = None):
+    messages = Message.objects.filter(conversation__uuid=conversation).select_related(
+        "conversation"
+    )
+
+    if since:
+        messages = messages.filter(id__gt=since)
+
+    return messages.order_by("id")
+
+
+def stored_rows(conversation: uuid.UUID, since: int = None, until: int = None):
+    """
+    Rows of the messages of the conversation in the database, after `since`
+    and up to `until`, read through the archives.
+    """
+    archives = get_archives(conversation, since)
+    messages = get_messages(conversation, since)
+    if until is not None:
+        archives = archives.filter(first_id__lte=until)
+        messages = messages.filter(id__lte=until)
+    rows = archived_rows(list(archives), conversation, since)
+    if until is not None:
+        rows = [row for row in rows if row["id"] <= until]
+    return rows + [
+        dict(row, conversation=conversation) for row in messages.values(*MESSAGE_FIELDS)
+    ]
+
+
+def message_rows(messages, conversation: uuid.UUID, fast=None):
+    """`MessageOut` items without model instances, see `Rows`."""
+    if not (settings.CHAT_FAST_SERIALIZATION if fast is None else fast):
+        return messages
+
+    def serialize(rows):
+        for row in rows:
+            row["conversation"] = conversation
+        return rows
+
+    return Rows(messages.values(*MESSAGE_FIELDS), serialize)
+
+
+def preview_rows(messages, conversation: uuid.UUID, length):
+    """
+    Messages (as returned by `get_messages`) with the contents longer than
+    `length` truncated, and marked as `truncated`.
+    """
+    if not isinstance(messages, Rows):
+        messages = message_rows(messages, conversation, fast=True)
+    serialize = messages.serialize
+
+    def truncate(rows):
+        # copies, the rows may be cached ones
+        return [
+            (
+                dict(row, content=row["content"][:length], truncated=True)
+                if len(row["content"]) > length
+                else row
+            )
+            for row in serialize(rows)
+        ]
+
+    return Rows(messages.queryset, truncate, messages.ordering, messages.model)
+
+
+def message_row(message, conversation: uuid.UUID):
+    row = {field: getattr(message, field) for field in MESSAGE_FIELDS}
+    row["conversation"] = conversation
+    return row
+
+
+def row_list(rows):
+    """Rows already fetched, paginated on their ids."""
+    return Rows(rows, ordering=["id"], model=Message)
+
+
+class BaseStorage:
+    """
+    Where the messages are written to and read from.
+
+    Messages are read as `MessageOut` shaped rows, or querysets of messages,
+    which the paginator of the routers accepts alike. The conversations are
+    kept in the database either way, with the denormalized fields of their
+    last message.
+    """
+
+    def add_messages(self, items, author, customer=None, create_missing=False):
+        """
+        Adds the messages of `items` (`MessageIn`), returning the row of each
+        message with the id of the message before it in its conversation
+        (None if unknown).
+
+        Items without a conversation, or with an unknown one, start a new
+        conversation, created with the requested uuid with `create_missing`.
+        New messages are published to the notifier once stored.
+        """
+        raise NotImplementedError
+
+    async def aadd_messages(self, items, author, customer=None, create_missing=False):
+        # transactions aren't available to async code, the writes run in a thread
+        return await sync_to_async(self.add_messages)(
+            items, author, customer, create_missing
+        )
+
+    def add_message_and_list(self, item, author, customer=None, since=None):
+        """
+        Adds the message of `item`, like `add_messages`, returning the
+        messages of its conversation after `since`, the new one included.
+        """
+        [(row, previous_id)] = self.add_messages([item], author, customer)
+        # the client is up to date, the new message is the only one to return
+        if previous_id is not None and (since or 0) >= previous_id:
+            return row_list([row] if row["id"] > (since or 0) else [])
+        return self.get_messages(row["conversation"], since)
+
+    async def aadd_message_and_list(self, item, author, customer=None, since=None):
+        return await sync_to_async(self.add_message_and_list)(
+            item, author, customer, since
+        )
+
+    def get_messages(self, conversation, since=None):
+        """Messages of the conversation after `since`."""
+        raise NotImplementedError
+
+    async def aget_messages(self, conversation, since=None):
+        """
+        Like `get_messages`, with the id of the last message of the
+        conversation, never newer than the messages (None if unknown).
+        """
+        raise NotImplementedError
+
+    async def ahas_messages(self, conversation, since=None):
+        raise NotImplementedError
+
+    async def alist_rows(self, conversation, since=None):
+        """Rows of all the messages after `since`."""
+        raise NotImplementedError
+
+    async def aget_row(self, conversation, id):
+        """Row of the message `id` of the conversation, None if there is none."""
+        rows = await self.alist_rows(conversation, id - 1)
+        if rows and rows[0]["id"] == id:
+            return rows[0]
+        return None
+
+    def replicate(self):
+        """Copies pending messages to the database, returns how many."""
+        return 0
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    Messages stored in the `Message` table, the last ones of each
+    conversation being cached, see `recent_messages`.
+    """
+
+    def add_messages(self, items, author, customer=None, create_missing=False):
+        with transaction.atomic():
+            results, _ = self._add_messages(items, author, customer, create_missing)
+        return results
+
+    def add_message_and_list(self, item, author, customer=None, since=None):
+        with transaction.atomic():
+            [(row, previous_id)], [conv] = self._add_messages([item], author, customer)
+            if previous_id is not None and (since or 0) >= previous_id:
+                return row_list([row] if row["id"] > (since or 0) else [])
+
+            # read while the conversation is locked, so ending with the new message
+            rows = recent_messages.get(conv.uuid, previous_id, since)
+            if rows is not None:
+                return row_list(rows + [row])
+            archives = []
+            if conv.archived_before and (since or 0) < conv.archived_before:
+                archives = (
+                    MessageArchive.objects.filter(
+                        conversation_id=conv.id, last_id__gt=since or 0
+                    )
+                    .order_by("last_id")
+                    .values_list("data", flat=True)
+                )
+            messages = Message.objects.filter(
+                conversation_id=conv.id, id__gt=since or 0
+            ).order_by("id")
+            return row_list(
+                archived_rows(archives, conv.uuid, since)
+                + [
+                    dict(message, conversation=conv.uuid)
+                    for message in messages.values(*MESSAGE_FIELDS)
+                ]
+            )
+
+    def _add_messages(self, items, author, customer=None, create_missing=False):
+        """
+        `add_messages` in the transaction of the caller, with the conversation
+        of each item, locked.
+        """
+        # locked in the order of the ids, so concurrent writes can't deadlock
+        requested = {item.conversation for item in items if item.conversation}
+        conversations = {
+            conv.uuid: conv
+            for conv in Conversation.objects.select_for_update()
+            .filter(uuid__in=requested)
+            .order_by("id")
+        }
+        # None if unknown, for conversations not backfilled yet
+        previous_ids = {
+            conv.uuid: conv.last_message_id for conv in conversations.values()
+        }
+
+        new_conversations = []
+        item_conversations = []
+        for item in items:
+            conv = conversations.get(item.conversation)
+            if conv is None:
+                conv = Conversation(
+                    customer_name=item.name,
+                    customer_email=item.email,
+                    customer=customer,
+                )
+                if item.conversation and create_missing:
+                    conv.uuid = item.conversation
+                conversations[conv.uuid] = conv
+                previous_ids[conv.uuid] = 0
+                new_conversations.append(conv)
+            item_conversations.append(conv)
+        Conversation.objects.bulk_create(new_conversations)
+
+        messages = Message.objects.bulk_create(
+            Message(conversation=conv, author=author, content=item.content)
+            for conv, item in zip(item_conversations, items)
+        )
+
+        results = []
+        rows = defaultdict(list)
+        extended = {}
+        for message, conv in zip(messages, item_conversations):
+            row = message_row(message, conv.uuid)
+            previous_id = previous_ids[conv.uuid]
+            results.append((row, previous_id))
+            rows[conv.uuid].append(row)
+            extended.setdefault(conv.uuid, previous_id)
+            if previous_id is not None:
+                previous_ids[conv.uuid] = message.id
+            conv.last_message = message
+            conv.last_message_at = message.date
+            conv.last_author = author
+            conv.message_count += 1
+            if author == Message.AuthorChoice.CUSTOMER:
+                conv.customer_message_count += 1
+        Conversation.objects.bulk_update(
+            conversations.values(),
+            [
+                "last_message",
+                "last_message_at",
+                "last_author",
+                "message_count",
+                "customer_message_count",
+            ],
+        )
+
+        def publish():
+            # once committed, see `recent_messages`
+            for conv_uuid, conv_rows in rows.items():
+                recent_messages.extend(conv_uuid, extended[conv_uuid], conv_rows)
+            for row, _ in results:
+                notifier.publish(row["conversation"], row)
+            conversations_changed()
+
+        transaction.on_commit(publish)
+        return results, item_conversations
+
+    def get_messages(self, conversation, since=None):
+        last_message_id = (
+            Conversation.objects.filter(uuid=conversation)
+            .values_list("last_message_id", flat=True)
+            .first()
+        )
+        rows = recent_messages.get(conversation, last_message_id, since)
+        if rows is not None:
+            return row_list(rows)
+        archives = list(get_archives(conversation, since))
+        if archives:
+            return row_list(
+                archived_rows(archives, conversation, since)
+                + [
+                    dict(row, conversation=conversation)
+                    for row in get_messages(conversation, since).values(*MESSAGE_FIELDS)
+                ]
+            )
+        return message_rows(get_messages(conversation, since), conversation)
+
+    async def aget_messages(self, conversation, since=None):
+        # committed version, read before the messages so never newer than them
+        state = await self._astate(conversation)
+        if since and (state["last_message_id"] or 0) < since and reading_replica():
+            # the replica is behind the client, which has seen newer messages
+            read_primary()
+            state = await self._astate(conversation)
+        rows = await recent_messages.aget(conversation, state["last_message_id"], since)
+        if rows is not None:
+            return row_list(rows), state["last_message_id"]
+        if state["archived_before"] and (since or 0) < state["archived_before"]:
+            # read through the archives
+            return (
+                row_list(await self.alist_rows(conversation, since)),
+                state["last_message_id"],
+            )
+        messages = message_rows(get_messages(conversation, since), conversation)
+        return messages, state["last_message_id"]
+
+    async def _astate(self, conversation):
+        state = (
+            await Conversation.objects.filter(uuid=conversation)
+            .values("last_message_id", "archived_before")
+            .afirst()
+        )
+        return state or {"last_message_id": None, "archived_before": None}
+
+    async def ahas_messages(self, conversation, since=None):
+        state = await self._astate(conversation)
+        if state["last_message_id"] is not None:
+            return state["last_message_id"] > (since or 0)
+        # the last message of a conversation is never archived
+        return await get_messages(conversation, since).aexists()
+
+    async def alist_rows(self, conversation, since=None):
+        archives = [data async for data in get_archives(conversation, since)]
+        return archived_rows(archives, conversation, since) + [
+            dict(row, conversation=conversation)
+            async for row in get_messages(conversation, since).values(*MESSAGE_FIELDS)
+        ]
+
+    async def aget_row(self, conversation, id):
+        row = (
+            await get_messages(conversation)
+            .filter(id=id)
+            .values(*MESSAGE_FIELDS)
+            .afirst()
+        )
+        if row is not None:
+            return dict(row, conversation=conversation)
+        # the archive of the message, if archived
+        archives = [data async for data in get_archives(conversation, id - 1)[:1]]
+        rows = archived_rows(archives, conversation, id - 1)
+        if rows and rows[0]["id"] == id:
+            return rows[0]
+        return None
+
+
+storage = import_string(settings.CHAT_MESSAGE_STORAGE)()
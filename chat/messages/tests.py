@@ -1,19 +1,87 @@
+import asyncio
+import datetime
 import email
-from unittest.mock import ANY
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import ANY, Mock, patch
+from unittest import skipUnless
 import uuid
-from django.test import TestCase
-from ninja.testing import TestClient
-from .models import Conversation, Message
+from io import StringIO
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.http import HttpRequest
+from django.utils import timezone
+from django.db import connection, connections
+from django.db.models import QuerySet
+from django.test import (
+    AsyncClient,
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from ninja.openapi import get_schema
+from ninja.responses import NinjaJSONEncoder
+from ninja.testing import TestAsyncClient
+from .models import Conversation, ConversationRead, Message, MessageArchive
+from benchmarks import contention, startup
+from benchmarks.load import InProcessDriver, report, run
+from benchmarks.workload import make_clients, seed
+from chat import settings_api
+from chat.api import api
+from messages.api_messages import MessageOut, message_events
 from messages.api_messages import router as message_router
 from messages.api_conversations import router as conversation_router
+from messages.fields import MARKER
+from messages.log import LogStorage
+from messages.metrics import metrics
+from messages import middleware, renderers
+from messages.middleware import PRIMARY_COOKIE
+from messages.notifier import notifier
+from messages.pagination import encode_cursor
+from messages.ratelimit import buckets
+from messages.renderers import parse_accept
+from messages.recent import recent_messages
+from messages.roles import get_user_roles, is_agent
+from messages.search import search
+from messages.storage import get_messages, storage
+from messages.unread import mark_read, unread_conversations
 from django.contrib.auth.models import User, Group
 
+# the tests send their requests from one address, faster than clients would:
+# only RateLimitTest sets limits
+_no_rate_limits = override_settings(CHAT_RATE_LIMITS={})
+setUpModule = _no_rate_limits.enable
+tearDownModule = _no_rate_limits.disable
+
+
+def cached_rows(conversation, since=None):
+    """Recent messages of the conversation, if cached up to its last message."""
+    last_message_id = Conversation.objects.get(uuid=conversation).last_message_id
+    return recent_messages.get(conversation, last_message_id, since)
+
+
+class SyncTestClient(TestAsyncClient):
+    """Client of the async views for sync tests."""
+
+    def _call(self, func, request, kwargs):
+        return async_to_sync(super()._call)(func, request, kwargs)
+
 
 class MessageApiTest(TestCase):
     def setUp(self):
         self.maxDiff = None
 
-        self.client = TestClient(message_router)
+        self.client = SyncTestClient(message_router)
+        self.async_client = TestAsyncClient(message_router)
 
         self.agent_group, _ = Group.objects.get_or_create(name="agent")
 
@@ -22,23 +90,23 @@ class MessageApiTest(TestCase):
 
         self.assertEqual(response.status_code, 405)
 
-    def test_get_messages_wrong_uuid(self):
-        response = self.client.get(f"/{str(uuid.uuid4())}/")
+    async def test_get_messages_wrong_uuid(self):
+        response = await self.async_client.get(f"/{str(uuid.uuid4())}/")
 
         self.assertEqual(response.status_code, 200)
-        expected = {"items": [], "count": 0}
+        expected = {"items": [], "count": 0, "next": None}
         self.assertEqual(response.json(), expected)
 
-    def test_get_messages(self):
-        conversation = Conversation.objects.create()
-        message1 = conversation.messages.create(
+    async def test_get_messages(self):
+        conversation = await Conversation.objects.acreate()
+        message1 = await conversation.messages.acreate(
             content="Hello", author=Message.AuthorChoice.CUSTOMER
         )
-        message2 = conversation.messages.create(
+        message2 = await conversation.messages.acreate(
             content="Hi", author=Message.AuthorChoice.AGENT
         )
 
-        response = self.client.get(f"/{conversation.uuid.hex}/")
+        response = await self.async_client.get(f"/{conversation.uuid.hex}/")
 
         self.assertEqual(response.status_code, 200)
 
@@ -63,7 +131,9 @@ class MessageApiTest(TestCase):
         ]
         self.assertEqual(result["items"], expected)
 
-        response = self.client.get(f"/{conversation.uuid.hex}/?since={message1.id}")
+        response = await self.async_client.get(
+            f"/{conversation.uuid.hex}/?since={message1.id}"
+        )
 
         self.assertEqual(response.status_code, 200)
 
@@ -71,6 +141,196 @@ class MessageApiTest(TestCase):
         self.assertEqual(result["count"], 1)
         self.assertEqual(result["items"], expected[1:])
 
+    async def test_get_messages_pages(self):
+        conversation = await Conversation.objects.acreate()
+        messages = [
+            await conversation.messages.acreate(
+                content=f"Hello {i}", author=Message.AuthorChoice.CUSTOMER
+            )
+            for i in range(5)
+        ]
+
+        response = await self.async_client.get(
+            f"/{conversation.uuid.hex}/?since={messages[0].id}&limit=3"
+        )
+
+        result = response.json()
+        self.assertEqual(
+            [item["id"] for item in result["items"]],
+            [message.id for message in messages[1:4]],
+        )
+        self.assertEqual(result["count"], None)
+        self.assertIsNotNone(result["next"])
+
+        response = await self.async_client.get(
+            f"/{conversation.uuid.hex}/?since={messages[0].id}&limit=3"
+            f"&cursor={result['next']}&count=true"
+        )
+
+        result = response.json()
+        self.assertEqual([item["id"] for item in result["items"]], [messages[4].id])
+        self.assertEqual(result["count"], 4)
+        self.assertEqual(result["next"], None)
+
+    async def test_get_messages_invalid_cursor(self):
+        conversation = await Conversation.objects.acreate()
+
+        response = await self.async_client.get(
+            f"/{conversation.uuid.hex}/?cursor=notacursor"
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"detail": "Invalid cursor"})
+
+    async def test_get_messages_fast_serialization(self):
+        conversation = await Conversation.objects.acreate()
+        for content in ["Hello", "Hi", "Bye"]:
+            await conversation.messages.acreate(
+                content=content, author=Message.AuthorChoice.CUSTOMER
+            )
+
+        response = await self.async_client.get(f"/{conversation.uuid}/?limit=2")
+        with self.settings(CHAT_FAST_SERIALIZATION=False):
+            expected = await self.async_client.get(f"/{conversation.uuid}/?limit=2")
+
+        self.assertEqual(response["Content-Type"], "application/json; charset=utf-8")
+        self.assertEqual(response.json(), expected.json())
+
+    async def test_get_messages_wait_returns_existing_messages(self):
+        conversation = await Conversation.objects.acreate()
+        message = await conversation.messages.acreate(
+            content="Hello", author=Message.AuthorChoice.CUSTOMER
+        )
+
+        response = await self.async_client.get(f"/{conversation.uuid.hex}/?wait=5")
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual([item["id"] for item in result["items"]], [message.id])
+
+    async def test_get_messages_wait_timeout(self):
+        conversation = await Conversation.objects.acreate()
+        message = await conversation.messages.acreate(
+            content="Hello", author=Message.AuthorChoice.CUSTOMER
+        )
+
+        response = await self.async_client.get(
+            f"/{conversation.uuid.hex}/?since={message.id}&wait=0.01"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"items": [], "count": 0, "next": None})
+
+    async def test_get_messages_wait_woken_up_by_new_message(self):
+        conversation = await Conversation.objects.acreate()
+        message1 = await conversation.messages.acreate(
+            content="Hello", author=Message.AuthorChoice.CUSTOMER
+        )
+
+        poll = asyncio.create_task(
+            self.async_client.get(
+                f"/{conversation.uuid.hex}/?since={message1.id}&wait=5"
+            )
+        )
+        while not notifier._listeners.get(conversation.uuid):
+            await asyncio.sleep(0)
+
+        message2 = await conversation.messages.acreate(
+            content="Hi", author=Message.AuthorChoice.AGENT
+        )
+        notifier.publish(conversation.uuid, {"id": message2.id})
+
+        response = await asyncio.wait_for(poll, 1)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual([item["id"] for item in result["items"]], [message2.id])
+        self.assertEqual(notifier._listeners.get(conversation.uuid), None)
+
+    def test_create_message_publishes_message(self):
+        with patch.object(notifier, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post("/", json={"content": "Hello"})
+
+        self.assertEqual(response.status_code, 200)
+        message = Message.objects.get()
+        publish.assert_called_once_with(
+            message.conversation.uuid,
+            {
+                "author": "CUS",
+                "content": "Hello",
+                "conversation": message.conversation.uuid,
+                "date": message.date,
+                "id": message.id,
+            },
+        )
+
+    async def test_message_events(self):
+        conversation = await Conversation.objects.acreate()
+        message1 = await conversation.messages.acreate(
+            content="Hello", author=Message.AuthorChoice.CUSTOMER
+        )
+        message2 = await conversation.messages.acreate(
+            content="Hi", author=Message.AuthorChoice.AGENT
+        )
+
+        events = message_events(conversation.uuid, since=message1.id)
+        event = await anext(events)
+        self.assertTrue(event.startswith(f"id: {message2.id}\nevent: message\n"))
+
+        # published messages are pushed, already sent ones are skipped
+        message3 = await conversation.messages.acreate(
+            content="Bye", author=Message.AuthorChoice.CUSTOMER
+        )
+        notifier.publish(conversation.uuid, {"id": message2.id})
+        notifier.publish(conversation.uuid, MessageOut.from_orm(message3).model_dump())
+        event = await anext(events)
+        header, data = event.split("data: ")
+        self.assertEqual(header, f"id: {message3.id}\nevent: message\n")
+        self.assertEqual(
+            json.loads(data),
+            {
+                "author": "CUS",
+                "content": "Bye",
+                "conversation": str(conversation.uuid),
+                "date": ANY,
+                "id": message3.id,
+            },
+        )
+
+        await events.aclose()
+        self.assertEqual(notifier._listeners.get(conversation.uuid), None)
+
+    async def test_message_events_keepalive(self):
+        conversation = await Conversation.objects.acreate()
+
+        with self.settings(CHAT_STREAM_KEEPALIVE=0.01):
+            events = message_events(conversation.uuid)
+            self.assertEqual(await anext(events), ": keepalive\n\n")
+            await events.aclose()
+
+    async def test_stream_messages_resumes_from_last_event_id(self):
+        conversation = await Conversation.objects.acreate()
+        message1 = await conversation.messages.acreate(
+            content="Hello", author=Message.AuthorChoice.CUSTOMER
+        )
+        message2 = await conversation.messages.acreate(
+            content="Hi", author=Message.AuthorChoice.AGENT
+        )
+
+        func, request, kwargs = self.async_client._resolve(
+            "GET",
+            f"/{conversation.uuid}/stream",
+            {},
+            {"headers": {"Last-Event-ID": str(message1.id)}},
+        )
+        response = await func(request, **kwargs)
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+        event = await anext(events)
+        self.assertTrue(event.startswith(f"id: {message2.id}\n".encode()))
+        await events.aclose()
+
     def test_create_first_message_as_anonymous(self):
         response = self.client.post("/", json={"content": "Hello"})
 
@@ -184,12 +444,120 @@ class MessageApiTest(TestCase):
         ]
         self.assertEqual(result["items"], expected)
 
+    def test_create_message_updates_conversation(self):
+        user = User.objects.create_user("Agent", email="agent@test.com")
+        user.groups.add(self.agent_group)
+
+        response = self.client.post("/", json={"content": "Hello"})
+        conversation = Conversation.objects.get()
+        self.client.post(
+            "/",
+            json={"conversation": str(conversation.uuid), "content": "Hi"},
+            user=user,
+        )
+
+        message = Message.objects.get(content="Hi")
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message, message)
+        self.assertEqual(conversation.last_message_at, message.date)
+        self.assertEqual(conversation.last_author, "AGE")
+        self.assertEqual(conversation.message_count, 2)
+
+    # in tests, the transaction of the view is a savepoint: SAVEPOINT and RELEASE
+    # are counted, and so are the callbacks run on commit
+
+    def test_create_first_message_queries(self):
+        # conversation and message inserts, conversation update
+        with self.assertNumQueries(5), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/", json={"content": "Hello"})
+
+        self.assertEqual(len(response.json()["items"]), 1)
+
+    def test_create_message_up_to_date_queries(self):
+        response = self.client.post("/", json={"content": "Hello"})
+        (message,) = response.json()["items"]
+
+        # conversation lookup, message insert, conversation update, no select
+        with self.assertNumQueries(5), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/?since={message['id']}",
+                json={"conversation": message["conversation"], "content": "Hi"},
+            )
+
+        result = response.json()
+        self.assertEqual(result["count"], 1)
+        self.assertEqual(result["items"][0]["content"], "Hi")
+
+    def test_create_message_as_agent_queries(self):
+        user = User.objects.create_user("Agent", email="agent@test.com")
+        user.groups.add(self.agent_group)
+        response = self.client.post("/", json={"content": "Hello"})
+        (message,) = response.json()["items"]
+
+        # and agent check
+        with self.assertNumQueries(6), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/?since={message['id']}",
+                json={"conversation": message["conversation"], "content": "Hi"},
+                user=user,
+            )
+
+        (message,) = response.json()["items"]
+        self.assertEqual(message["author"], "AGE")
+
+        # the roles of the agent are cached
+        with self.assertNumQueries(5), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/?since={message['id']}",
+                json={"conversation": message["conversation"], "content": "Bye"},
+                user=user,
+            )
+
+        self.assertEqual(response.json()["items"][0]["author"], "AGE")
+
+    def test_create_message_missed_messages_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/", json={"content": "Hello"})
+        (message,) = response.json()["items"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                "/", json={"conversation": message["conversation"], "content": "Hi"}
+            )
+
+        # the messages after since are the last ones, cached, read while the
+        # conversation is locked
+        with self.assertNumQueries(5), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/?since={message['id']}",
+                json={"conversation": message["conversation"], "content": "Bye"},
+            )
+
+        result = response.json()
+        self.assertEqual([item["content"] for item in result["items"]], ["Hi", "Bye"])
+        self.assertEqual(
+            {item["conversation"] for item in result["items"]},
+            {message["conversation"]},
+        )
+
+        # and queried in the transaction when not cached anymore, on the id of
+        # the conversation
+        caches["messages"].clear()
+        with self.assertNumQueries(6), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/?since={message['id']}",
+                json={"conversation": message["conversation"], "content": "Again"},
+            )
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]],
+            ["Hi", "Bye", "Again"],
+        )
+
 
 class ConversationApiTest(TestCase):
     def setUp(self):
         self.maxDiff = None
 
-        self.client = TestClient(conversation_router)
+        self.client = SyncTestClient(conversation_router)
 
         self.agent_group, _ = Group.objects.get_or_create(name="agent")
         self.user = User.objects.create_user("Agent", email="agent@test.com")
@@ -226,10 +594,98 @@ class ConversationApiTest(TestCase):
             "customer_email": None,
             "status": "OPEN",
             "assignee": self.user.id,
+            "last_message": None,
+            "last_message_at": None,
+            "last_author": None,
+            "last_message_preview": None,
+            "message_count": 0,
         }
 
         self.assertEqual(result["items"][1], expected)
 
+    def test_list_conversations_pages(self):
+        # same creation date, the id breaks the tie
+        Conversation.objects.update(created_at=self.conv1.created_at)
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/?limit=2", user=self.user)
+
+        result = response.json()
+        self.assertEqual(result["count"], None)
+        self.assertEqual(
+            [item["id"] for item in result["items"]], [self.conv1.id, self.conv2.id]
+        )
+
+        response = self.client.get(f"/?limit=2&cursor={result['next']}", user=self.user)
+
+        result = response.json()
+        self.assertEqual([item["id"] for item in result["items"]], [self.conv3.id])
+        self.assertEqual(result["next"], None)
+
+    def test_list_conversations_no_count_query(self):
+        # agent check and page, no COUNT(*)
+        with self.assertNumQueries(2):
+            response = self.client.get("/", user=self.user)
+
+        self.assertEqual(response.json()["count"], 3)
+
+    def post_message(self, conversation, author, content="Hello"):
+        message = conversation.messages.create(content=content, author=author)
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message=message, last_message_at=message.date, last_author=author
+        )
+        return message
+
+    def test_list_conversations_last_message(self):
+        message = self.post_message(
+            self.conv1, Message.AuthorChoice.CUSTOMER, "x" * 200
+        )
+
+        response = self.client.get("/", user=self.user)
+
+        result = response.json()
+        item = result["items"][0]
+        self.assertEqual(item["last_message"], message.id)
+        self.assertEqual(item["last_author"], "CUS")
+        self.assertEqual(item["last_message_preview"], "x" * 100)
+
+    def test_list_conversations_recent(self):
+        self.post_message(self.conv2, Message.AuthorChoice.CUSTOMER)
+        self.post_message(self.conv1, Message.AuthorChoice.AGENT)
+
+        response = self.client.get("/?order=recent", user=self.user)
+
+        result = response.json()
+        self.assertEqual(
+            [item["id"] for item in result["items"]], [self.conv1.id, self.conv2.id]
+        )
+
+    def test_list_conversations_awaiting_reply(self):
+        self.post_message(self.conv1, Message.AuthorChoice.CUSTOMER)
+        self.post_message(self.conv2, Message.AuthorChoice.CUSTOMER)
+        self.post_message(self.conv2, Message.AuthorChoice.AGENT)
+
+        response = self.client.get("/?awaiting_reply=true", user=self.user)
+
+        result = response.json()
+        self.assertEqual([item["id"] for item in result["items"]], [self.conv1.id])
+
+    def test_backfill_conversations(self):
+        self.conv1.messages.create(content="Hello", author="CUS")
+        message = self.conv1.messages.create(content="Hi", author="AGE")
+
+        call_command("backfill_conversations", batch_size=2, stdout=StringIO())
+
+        self.conv1.refresh_from_db()
+        self.assertEqual(self.conv1.last_message, message)
+        self.assertEqual(self.conv1.last_message_at, message.date)
+        self.assertEqual(self.conv1.last_author, "AGE")
+        self.assertEqual(self.conv1.message_count, 2)
+        self.assertEqual(self.conv1.customer_message_count, 1)
+        self.conv3.refresh_from_db()
+        self.assertEqual(self.conv3.last_message, None)
+        self.assertEqual(self.conv3.message_count, 0)
+
     def test_list_conversations_not_agent(self):
         response = self.client.get("/", user=self.customer)
 
@@ -291,3 +747,2121 @@ class ConversationApiTest(TestCase):
 
         conv = Conversation.objects.get(id=self.conv1.id)
         self.assertEqual(conv.assignee, self.user)
+
+    def test_take_conversation_of_another_agent(self):
+        response = self.client.patch(f"/{self.conv2.id}/take", user=self.user2)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            response.json(),
+            {"detail": "The conversation is assigned to another agent"},
+        )
+        conv = Conversation.objects.get(id=self.conv2.id)
+        self.assertEqual(conv.assignee, self.user)
+
+        # again by its agent
+        response = self.client.patch(f"/{self.conv2.id}/take", user=self.user)
+        self.assertEqual(response.status_code, 200)
+
+    def test_change_conflicts(self):
+        response = self.client.patch("/0/take", user=self.user)
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.patch("/0/close", user=self.user)
+        self.assertEqual(response.status_code, 404)
+
+    def test_status_change_is_idempotent(self):
+        response = self.client.patch(f"/{self.conv3.id}/close", user=self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "CLOSED")
+
+        response = self.client.patch(f"/{self.conv1.id}/open", user=self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "OPEN")
+
+    def test_change_only_updates_its_column(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f"/{self.conv1.id}/close", user=self.user)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "CLOSED")
+        (update,) = [query["sql"] for query in queries if "UPDATE" in query["sql"]]
+        self.assertIn('SET "status"', update)
+        self.assertNotIn("assignee", update.split("WHERE")[0])
+
+    def test_change_bumps_the_version(self):
+        etag = self.client.get("/", user=self.user)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f"/{self.conv1.id}/take", user=self.user)
+
+        response = self.client.get("/", user=self.user, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_dispatch_conversation(self):
+        conv4 = Conversation.objects.create()
+        Conversation.objects.create(status=Conversation.ConversationStatus.CLOSED)
+
+        response = self.client.post("/dispatch", user=self.user2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], self.conv1.id)
+        self.assertEqual(response.json()["assignee"], self.user2.id)
+
+        response = self.client.post("/dispatch", user=self.user)
+        self.assertEqual(response.json()["id"], conv4.id)
+
+        response = self.client.post("/dispatch", user=self.user)
+        self.assertEqual(response.status_code, 204)
+
+        response = self.client.post("/dispatch", user=self.customer)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_session_auth(self):
+        # through the ASGI handler, the user of the session is loaded without blocking
+        client = AsyncClient()
+        await client.aforce_login(self.customer)
+
+        response = await client.get("/api/conversation/")
+        self.assertEqual(response.status_code, 401)
+
+        response = await client.patch(f"/api/conversation/{self.conv1.id}/take")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["assignee"], self.customer.id)
+
+        await client.aforce_login(self.user)
+        response = await client.get("/api/conversation/")
+        self.assertEqual(response.json()["count"], 3)
+
+    def test_close_conversation_preview(self):
+        message = self.conv1.messages.create(content="Hello", author="CUS")
+        Conversation.objects.filter(id=self.conv1.id).update(last_message=message)
+
+        response = self.client.patch(f"/{self.conv1.id}/close", user=self.user)
+
+        self.assertEqual(response.json()["last_message_preview"], "Hello")
+
+
+class UnreadTest(TestCase):
+    def setUp(self):
+        self.client = SyncTestClient(conversation_router)
+        self.message_client = SyncTestClient(message_router)
+
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.agent = User.objects.create_user("Agent", email="agent@test.com")
+        self.agent.groups.add(agent_group)
+        self.agent2 = User.objects.create_user("Agent2", email="agent2@test.com")
+        self.agent2.groups.add(agent_group)
+
+        self.conversation = self.post(None, "Hello")["conversation"]
+        self.post(self.conversation, "Anyone?")
+
+    def post(self, conversation, content, user=None):
+        kwargs = {"user": user} if user else {}
+        response = self.message_client.post(
+            "/", json={"conversation": conversation, "content": content}, **kwargs
+        )
+        return response.json()["items"][-1]
+
+    def read(self, agent, since=None):
+        query = f"?since={since}" if since else ""
+        kwargs = {"user": agent} if agent else {}
+        response = self.message_client.get(f"/{self.conversation}/{query}", **kwargs)
+        self.assertEqual(response.status_code, 200)
+
+    def unread(self, agent):
+        response = self.client.get("/unread", user=agent)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_unread_counts(self):
+        conversation = Conversation.objects.get(uuid=self.conversation)
+        self.assertEqual(
+            self.unread(self.agent),
+            {
+                "waiting": 1,
+                "unread": 2,
+                "conversations": [
+                    {"id": conversation.id, "uuid": self.conversation, "unread": 2}
+                ],
+            },
+        )
+
+        # the replies of the agents aren't unread
+        self.post(self.conversation, "Hi", user=self.agent)
+        self.assertEqual(self.unread(self.agent)["unread"], 2)
+        self.post(None, "Hello")
+        self.assertEqual(self.unread(self.agent)["unread"], 3)
+        self.assertEqual(self.unread(self.agent)["waiting"], 2)
+
+    def test_read_when_fetched(self):
+        self.read(self.agent)
+        self.assertEqual(self.unread(self.agent)["unread"], 0)
+        self.assertEqual(self.unread(self.agent)["conversations"], [])
+
+        message = self.post(self.conversation, "Still there?")
+        self.assertEqual(self.unread(self.agent)["unread"], 1)
+        self.assertEqual(self.unread(self.agent2)["unread"], 3)
+
+        self.read(self.agent, since=message["id"])
+        self.assertEqual(self.unread(self.agent)["unread"], 1)
+        self.read(self.agent, since=message["id"] - 1)
+        self.assertEqual(self.unread(self.agent)["unread"], 0)
+
+    def test_read_page_by_page(self):
+        for i in range(3):
+            self.post(self.conversation, f"Message {i}")
+
+        response = self.message_client.get(
+            f"/{self.conversation}/?limit=2", user=self.agent
+        )
+        self.assertEqual(len(response.json()["items"]), 2)
+        # the messages of the next pages weren't sent
+        self.assertEqual(self.unread(self.agent)["unread"], 3)
+
+        response = self.message_client.get(
+            f"/{self.conversation}/?limit=2&cursor={response.json()['next']}",
+            user=self.agent,
+        )
+        self.assertEqual(self.unread(self.agent)["unread"], 1)
+
+    def test_read_by_customer(self):
+        self.read(None)
+
+        self.assertEqual(ConversationRead.objects.count(), 0)
+        self.assertEqual(self.unread(self.agent)["unread"], 2)
+
+    def test_read_before_new_messages(self):
+        first = Message.objects.order_by("id").first()
+        self.post(self.conversation, "Still there?")
+
+        mark_read(self.agent, uuid.UUID(self.conversation), first.id)
+
+        self.assertEqual(self.unread(self.agent)["unread"], 2)
+        # not backwards
+        self.read(self.agent)
+        mark_read(self.agent, uuid.UUID(self.conversation), first.id)
+        self.assertEqual(self.unread(self.agent)["unread"], 0)
+
+    def test_inbox(self):
+        Conversation.objects.filter(uuid=self.conversation).update(assignee=self.agent2)
+        self.assertEqual(self.unread(self.agent)["unread"], 0)
+        self.assertEqual(self.unread(self.agent2)["unread"], 2)
+
+        Conversation.objects.filter(uuid=self.conversation).update(
+            status=Conversation.ConversationStatus.CLOSED
+        )
+        self.assertEqual(self.unread(self.agent2)["unread"], 0)
+
+    def test_unread_counts_query(self):
+        with CaptureQueriesContext(connection) as context:
+            self.unread(self.agent)
+
+        conversations = Conversation._meta.db_table
+        self.assertEqual(
+            len([q for q in context.captured_queries if conversations in q["sql"]]),
+            1,
+        )
+
+    def test_not_agent(self):
+        response = self.client.get("/unread")
+
+        self.assertEqual(response.status_code, 401)
+
+
+class RecentMessagesTest(TestCase):
+    def setUp(self):
+        self.client = SyncTestClient(message_router)
+        self.async_client = TestAsyncClient(message_router)
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.agent = User.objects.create_user("Agent", email="agent@test.com")
+        self.agent.groups.add(agent_group)
+
+    def post(self, conversation=None, user=None):
+        data = {"content": "Hello"}
+        if conversation:
+            data["conversation"] = conversation
+        kwargs = {"user": user} if user else {}
+        # the cache is written once the message is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/", json=data, **kwargs)
+        return response.json()["items"][-1]
+
+    def assertSameAsDatabase(self, conversation):
+        ids = list(
+            Message.objects.filter(conversation__uuid=conversation)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        covered = 0
+        for since in [None, 0, *ids]:
+            rows = cached_rows(conversation, since)
+            if rows is not None:
+                covered += 1
+                expected = [
+                    {
+                        "id": message.id,
+                        "date": message.date,
+                        "content": message.content,
+                        "author": message.author,
+                        "conversation": conversation,
+                    }
+                    for message in get_messages(conversation, since)
+                ]
+                self.assertEqual(rows, expected)
+        return covered
+
+    def check_conversations(self):
+        first = self.post()
+        conversation = first["conversation"]
+        other = self.post()["conversation"]
+        for i in range(6):
+            self.post(conversation, user=self.agent if i % 2 else None)
+            self.post(other)
+
+        conversation = uuid.UUID(conversation)
+        # the last 3 messages are buffered
+        self.assertEqual(self.assertSameAsDatabase(conversation), 4)
+        self.assertEqual(cached_rows(conversation, first["id"]), None)
+
+    @override_settings(CHAT_MESSAGE_CACHE_SIZE=3)
+    def test_same_as_database(self):
+        self.check_conversations()
+
+    @override_settings(
+        CHAT_MESSAGE_CACHE_SIZE=3,
+        CACHES={
+            **settings.CACHES,
+            "messages": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": tempfile.mkdtemp(),
+            },
+        },
+    )
+    def test_same_as_database_shared_cache(self):
+        self.check_conversations()
+        caches["messages"].clear()
+
+    def test_new_conversation_is_cached(self):
+        message = self.post()
+        conversation = uuid.UUID(message["conversation"])
+
+        self.assertEqual(
+            [row["id"] for row in cached_rows(conversation)], [message["id"]]
+        )
+
+    def test_cached_invalid_cursor(self):
+        message = self.post()
+        self.assertIsNotNone(cached_rows(uuid.UUID(message["conversation"])))
+
+        for values in [["x"], [None], [{}]]:
+            response = self.client.get(
+                f"/{message['conversation']}/?cursor={encode_cursor(values)}"
+            )
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"detail": "Invalid cursor"})
+
+        # as the ids of the rows
+        response = self.client.get(
+            f"/{message['conversation']}/?cursor={encode_cursor([str(message['id'] - 1)])}"
+        )
+        self.assertEqual(
+            [item["id"] for item in response.json()["items"]], [message["id"]]
+        )
+
+    def test_not_backfilled_conversation_is_not_cached(self):
+        conversation = Conversation.objects.create()
+        conversation.messages.create(content="Hello", author="CUS")
+
+        self.post(str(conversation.uuid))
+
+        self.assertEqual(cached_rows(conversation.uuid), None)
+
+    def test_gap_resets_the_buffer(self):
+        message = self.post()
+        conversation = uuid.UUID(message["conversation"])
+
+        recent_messages.append(conversation, message["id"] + 1, {"id": 100})
+
+        self.assertEqual(recent_messages.get(conversation, 100, message["id"]), None)
+        self.assertEqual(
+            recent_messages.get(conversation, 100, message["id"] + 1), [{"id": 100}]
+        )
+
+    def test_stale_entry_not_served(self):
+        message = self.post()
+        conversation = message["conversation"]
+        # written by another process, whose cache this one doesn't see
+        with patch.object(recent_messages, "extend"):
+            with self.captureOnCommitCallbacks(execute=True):
+                other = self.client.post(
+                    "/", json={"conversation": conversation, "content": "Hi"}
+                ).json()["items"][-1]
+
+        self.assertEqual(cached_rows(uuid.UUID(conversation)), None)
+        response = self.client.get(f"/{conversation}/?since={message['id']}")
+        self.assertEqual(response.json()["items"], [other])
+
+    def test_not_cached_before_commit(self):
+        message = self.post()
+        conversation = uuid.UUID(message["conversation"])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(
+                "/", json={"conversation": str(conversation), "content": "Hi"}
+            )
+
+        self.assertEqual(cached_rows(conversation), None)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(cached_rows(conversation)), 2)
+
+    def test_list_messages_from_cache(self):
+        message = self.post()
+        new_message = self.post(message["conversation"], user=self.agent)
+
+        @async_to_sync
+        async def get(path):
+            return await self.async_client.get(path)
+
+        # the last message of the conversation only
+        with self.assertNumQueries(1):
+            response = get(f"/{message['conversation']}/?since={message['id']}")
+
+        self.assertEqual(response.json()["items"], [new_message])
+
+
+class BulkMessagesTest(TestCase):
+    def setUp(self):
+        self.client = SyncTestClient(message_router)
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.agent = User.objects.create_user("Agent", email="agent@test.com")
+        self.agent.groups.add(agent_group)
+        self.importer = User.objects.create_user("Importer", is_staff=True)
+
+    def post(self, items, user=None):
+        return self.client.post(
+            "/bulk", json={"items": items}, user=user or self.importer
+        )
+
+    def test_create_messages(self):
+        imported = str(uuid.uuid4())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/", json={"content": "Hello"})
+            existing = response.json()["items"][0]
+            response = self.post(
+                [
+                    {"conversation": imported, "content": "1", "name": "Bob"},
+                    {"conversation": existing["conversation"], "content": "2"},
+                    {"content": "3"},
+                    {"conversation": imported, "content": "4"},
+                    {"content": "5"},
+                ]
+            )
+
+        self.assertEqual(response.status_code, 200)
+        items = response.json()["items"]
+        messages = Message.objects.in_bulk([item["id"] for item in items])
+        self.assertEqual(
+            [messages[item["id"]].content for item in items], ["1", "2", "3", "4", "5"]
+        )
+        self.assertEqual(
+            [str(messages[item["id"]].conversation.uuid) for item in items],
+            [item["conversation"] for item in items],
+        )
+        self.assertEqual(items[0]["conversation"], imported)
+        self.assertEqual(items[1]["conversation"], existing["conversation"])
+        self.assertEqual(len({item["conversation"] for item in items}), 4)
+
+        conversation = Conversation.objects.get(uuid=imported)
+        self.assertEqual(conversation.customer_name, "Bob")
+        self.assertEqual(conversation.message_count, 2)
+        self.assertEqual(conversation.last_message_id, items[3]["id"])
+        self.assertEqual(conversation.last_author, "CUS")
+
+        conversation = Conversation.objects.get(uuid=existing["conversation"])
+        self.assertEqual(conversation.message_count, 2)
+        self.assertEqual(conversation.last_message_id, items[1]["id"])
+
+        # the recent messages follow
+        self.assertEqual(
+            [row["id"] for row in cached_rows(conversation.uuid)],
+            [existing["id"], items[1]["id"]],
+        )
+        self.assertEqual(
+            [row["id"] for row in cached_rows(uuid.UUID(imported))],
+            [items[0]["id"], items[3]["id"]],
+        )
+
+    def test_create_messages_unauthorized(self):
+        customer = User.objects.create_user("Alice", email="alice@test.com")
+        for user in (AnonymousUser(), customer):
+            response = self.client.post(
+                "/bulk", json={"items": [{"content": "Hello"}]}, user=user
+            )
+            self.assertEqual(response.status_code, 401)
+        self.assertFalse(Message.objects.exists())
+
+    def racing_add_messages(self, conversation, races):
+        """
+        `storage.add_messages` missing a conversation created concurrently,
+        between its lookup and its insert, on its first `races` calls.
+        """
+        add_messages = storage.add_messages
+        calls = []
+
+        def racing(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > races:
+                return add_messages(*args, **kwargs)
+            Conversation.objects.get_or_create(uuid=conversation)
+            with patch.object(
+                QuerySet, "select_for_update", lambda queryset: queryset.none()
+            ):
+                return add_messages(*args, **kwargs)
+
+        return patch.object(storage, "add_messages", racing), calls
+
+    def test_create_messages_conversation_created_concurrently(self):
+        imported = uuid.uuid4()
+        racing, calls = self.racing_add_messages(imported, races=1)
+        with racing:
+            response = self.post([{"conversation": str(imported), "content": "1"}])
+
+        # retried, finding the conversation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+        [item] = response.json()["items"]
+        self.assertEqual(Message.objects.get(pk=item["id"]).conversation.uuid, imported)
+
+        racing, calls = self.racing_add_messages(imported, races=2)
+        with racing:
+            response = self.post([{"conversation": str(imported), "content": "2"}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_create_messages_as_agent(self):
+        response = self.post([{"content": "Hello"}], user=self.agent)
+
+        message = Message.objects.get(pk=response.json()["items"][0]["id"])
+        self.assertEqual(message.author, "AGE")
+
+    def test_create_messages_queries(self):
+        conversations = [str(uuid.uuid4()) for _ in range(3)]
+        self.post(
+            [{"conversation": uuid, "content": "Hello"} for uuid in conversations]
+        )
+
+        # lock, conversations, messages, conversations update (and savepoints)
+        for count in (3, 30):
+            with self.assertNumQueries(6), self.captureOnCommitCallbacks(execute=True):
+                self.post(
+                    [
+                        {"conversation": conversations[i % 3], "content": "Hello"}
+                        for i in range(count)
+                    ]
+                    + [{"content": "New"}]
+                )
+
+    def test_create_messages_publishes_messages(self):
+        with patch("messages.storage.notifier") as notifier:
+            with self.captureOnCommitCallbacks(execute=True):
+                items = self.post([{"content": "1"}, {"content": "2"}]).json()["items"]
+
+        self.assertEqual(
+            [call.args[1]["id"] for call in notifier.publish.call_args_list],
+            [item["id"] for item in items],
+        )
+
+    @override_settings(CHAT_BULK_MAX_ITEMS=2)
+    def test_create_too_many_messages(self):
+        response = self.post([{"content": "Hello"}] * 3)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+class LogStorageTest(TestCase):
+    def setUp(self):
+        self.client = SyncTestClient(message_router)
+        self.async_client = TestAsyncClient(message_router)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.storage = self.log_storage()
+        patcher = patch("messages.api_messages.storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        @async_to_sync
+        async def get(path, **kwargs):
+            return await self.async_client.get(path, **kwargs)
+
+        self.get = get
+
+    def log_storage(self):
+        # replicated by the tests
+        return LogStorage(
+            self.directory,
+            segment_size=200,
+            replication_interval=0,
+            replication_batch=3,
+        )
+
+    def post(self, content, conversation=None, since=None):
+        """The message posted."""
+        data = {"content": content}
+        if conversation:
+            data["conversation"] = conversation
+        path = f"/?since={since}" if since else "/"
+        return self.client.post(path, json=data).json()["items"][-1]
+
+    def test_messages_served_from_log(self):
+        first = self.post("Hello")
+        conversation = first["conversation"]
+        second = self.post("Again", conversation, since=first["id"])
+
+        with self.assertNumQueries(0):
+            response = self.get(f"/{conversation}/")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]], ["Hello", "Again"]
+        )
+        self.assertEqual(
+            response.json()["items"][1],
+            {
+                "id": second["id"],
+                "date": second["date"],
+                "content": "Again",
+                "author": "CUS",
+                "conversation": conversation,
+            },
+        )
+
+        # the log is the version
+        response = self.get(
+            f"/{conversation}/", headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.get(f"/{conversation}/?since={second['id']}&wait=0.01")
+        self.assertEqual(response.json()["items"], [])
+        self.assertFalse(Message.objects.exists())
+
+    def test_segments(self):
+        first = self.post("Hello")
+        conversation = first["conversation"]
+        for i in range(10):
+            self.post(f"Message {i}", conversation)
+
+        segments = os.listdir(os.path.join(self.directory, conversation))
+        self.assertGreater(len(segments), 3)
+        self.assertIn(f"{first['id']:020}.log", segments)
+
+        response = self.get(f"/{conversation}/?since={first['id'] + 4}")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]],
+            [f"Message {i}" for i in range(4, 10)],
+        )
+
+    def test_replicate(self):
+        items = [self.post("Hello")]
+        conversation = items[0]["conversation"]
+        items += [self.post(f"Message {i}", conversation) for i in range(3)]
+
+        self.assertEqual(self.storage.replicate(), 3)
+        self.assertEqual(self.storage.replicate(), 1)
+        self.assertEqual(self.storage.replicate(), 0)
+
+        messages = list(Message.objects.order_by("id"))
+        # with the ids and dates of the log
+        self.assertEqual(
+            [
+                json.loads(
+                    json.dumps(
+                        MessageOut.from_orm(message).dict(), cls=NinjaJSONEncoder
+                    )
+                )
+                for message in messages
+            ],
+            items,
+        )
+        conv = Conversation.objects.get(uuid=conversation)
+        self.assertEqual(conv.last_message_id, items[-1]["id"])
+        self.assertEqual(conv.last_message_at, messages[-1].date)
+        self.assertEqual(conv.last_author, "CUS")
+        self.assertEqual(conv.message_count, 4)
+
+    def test_trim(self):
+        first = self.post("Hello")
+        conversation = first["conversation"]
+        for i in range(10):
+            self.post(f"Message {i}", conversation)
+        directory = os.path.join(self.directory, conversation)
+        segments = sorted(os.listdir(directory))
+
+        while self.storage.replicate():
+            pass
+
+        # the segments copied to the database are deleted, but the last one
+        remaining = sorted(os.listdir(directory))
+        self.assertEqual(remaining, [segments[-2], "after"])
+        with open(os.path.join(directory, "after")) as f:
+            after = int(f.read())
+        self.assertGreater(after, first["id"])
+        expected = ["Hello"] + [f"Message {i}" for i in range(10)]
+        response = self.get(f"/{conversation}/")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]], expected
+        )
+
+        # only the entries after the database are indexed
+        storage = self.log_storage()
+        self.assertEqual(storage.replicate(), 0)
+        self.assertLess(len(storage.log.conversations[uuid.UUID(conversation)].ids), 11)
+        with patch("messages.api_messages.storage", storage):
+            self.post("Again", conversation)
+            response = self.get(f"/{conversation}/?since={first['id']}")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]],
+            expected[1:] + ["Again"],
+        )
+
+    def test_trimmed_by_another_process(self):
+        first = self.post("Hello")
+        conversation = first["conversation"]
+        for i in range(10):
+            self.post(f"Message {i}", conversation)
+
+        call_command("replicate_messages", directory=self.directory, stdout=StringIO())
+
+        # the segments indexed by this storage are gone, their entries are read
+        # from the database
+        response = self.get(f"/{conversation}/?since={first['id']}")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]],
+            [f"Message {i}" for i in range(10)],
+        )
+
+    def test_replicate_command(self):
+        conversation = self.post("Hello")["conversation"]
+        self.post("Again", conversation)
+        out = StringIO()
+
+        call_command("replicate_messages", directory=self.directory, stdout=out)
+        # already copied, skipped
+        self.storage.replicate()
+
+        self.assertEqual(out.getvalue(), "2 messages replicated\n")
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(Conversation.objects.get(uuid=conversation).message_count, 2)
+
+    def test_read_before_replication(self):
+        agent = User.objects.create_user("Agent", email="agent@test.com")
+        first = self.post("Hello")
+        conversation = first["conversation"]
+        self.storage.replicate()
+        second = self.post("Again", conversation)
+        self.post("Third", conversation)
+
+        # up to a message in the log only
+        mark_read(agent, uuid.UUID(conversation), second["id"])
+        self.assertEqual([item["unread"] for item in unread_conversations(agent)], [])
+
+        self.assertEqual(self.storage.replicate(), 2)
+        self.assertEqual([item["unread"] for item in unread_conversations(agent)], [1])
+
+    def test_reload(self):
+        first = self.post("Hello")
+        conversation = first["conversation"]
+        self.storage.replicate()
+        self.post("Again", conversation)
+
+        storage = self.log_storage()
+        self.assertEqual(storage.replicate(), 1)
+        with patch("messages.api_messages.storage", storage):
+            third = self.post("Third", conversation)
+            response = self.get(f"/{conversation}/")
+
+        self.assertEqual(third["id"], first["id"] + 2)
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]],
+            ["Hello", "Again", "Third"],
+        )
+
+    def test_conversation_in_database(self):
+        conversation = Conversation.objects.create()
+        message = conversation.messages.create(content="Before", author="CUS")
+
+        item = self.post("After", str(conversation.uuid), since=message.id)
+        self.assertGreater(item["id"], message.id)
+
+        response = self.get(f"/{conversation.uuid}/")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]],
+            ["Before", "After"],
+        )
+        response = self.get(f"/{conversation.uuid}/?since={message.id}")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]], ["After"]
+        )
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.client = SyncTestClient(message_router)
+        self.conversation = Conversation.objects.create()
+        self.messages = [self.post(f"Message {i}") for i in range(5)]
+        self.close(days=100)
+        caches["messages"].clear()
+
+    def post(self, content):
+        return self.client.post(
+            "/", json={"conversation": str(self.conversation.uuid), "content": content}
+        ).json()["items"][-1]
+
+    def close(self, days):
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            status=Conversation.ConversationStatus.CLOSED,
+            last_message_at=timezone.now() - datetime.timedelta(days=days),
+        )
+
+    def archive(self, days=90):
+        out = StringIO()
+        call_command("archive_messages", days=days, stdout=out)
+        return out.getvalue()
+
+    def list(self, query=""):
+        response = self.client.get(f"/{self.conversation.uuid}/{query}")
+        return response.json()
+
+    def test_archive(self):
+        self.assertEqual(self.archive(), "4 messages of 1 conversations archived\n")
+
+        self.assertEqual(
+            list(self.conversation.messages.values_list("id", flat=True)),
+            [self.messages[-1]["id"]],
+        )
+        [archive] = MessageArchive.objects.all()
+        self.assertEqual(archive.count, 4)
+        self.assertEqual(archive.first_id, self.messages[0]["id"])
+        self.assertEqual(archive.last_id, self.messages[3]["id"])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.archived_before, self.messages[-1]["id"])
+        self.assertEqual(self.conversation.message_count, 5)
+
+        # nothing left to archive
+        self.assertEqual(self.archive(), "0 messages of 0 conversations archived\n")
+
+    def test_not_archived(self):
+        self.close(days=10)
+        self.assertEqual(self.archive(), "0 messages of 0 conversations archived\n")
+
+        self.close(days=100)
+        Conversation.objects.update(status=Conversation.ConversationStatus.OPEN)
+        self.assertEqual(self.archive(), "0 messages of 0 conversations archived\n")
+        self.assertEqual(self.conversation.messages.count(), 5)
+
+    def test_read_through(self):
+        before = self.list()
+        self.archive()
+
+        self.assertEqual(self.list(), before)
+        self.assertEqual(
+            self.list(f"?since={self.messages[1]['id']}")["items"], before["items"][2:]
+        )
+
+        # paginated across the archive and the table
+        page = self.list("?limit=3")
+        self.assertEqual(page["items"], before["items"][:3])
+        page = self.list(f"?limit=3&cursor={page['next']}")
+        self.assertEqual(page["items"], before["items"][3:])
+
+    def test_post_missed_messages(self):
+        self.archive()
+
+        response = self.client.post(
+            f"/?since={self.messages[1]['id']}",
+            json={"conversation": str(self.conversation.uuid), "content": "Reopened"},
+        )
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]],
+            [f"Message {i}" for i in range(2, 5)] + ["Reopened"],
+        )
+
+    def test_reopened(self):
+        self.archive()
+        self.post("Reopened")
+        self.close(days=100)
+        self.archive()
+
+        self.assertEqual(MessageArchive.objects.count(), 2)
+        self.assertEqual(
+            [item["content"] for item in self.list()["items"]],
+            [f"Message {i}" for i in range(5)] + ["Reopened"],
+        )
+        self.assertEqual(self.conversation.messages.count(), 1)
+
+    def test_partition_needs_postgresql(self):
+        if connection.vendor == "postgresql":
+            self.skipTest("partitioning is supported")
+        with self.assertRaises(CommandError):
+            call_command("partition_messages")
+
+    def test_stream_replay(self):
+        self.archive()
+
+        @async_to_sync
+        async def replay():
+            events = message_events(self.conversation.uuid)
+            return [await anext(events) for _ in range(5)]
+
+        self.assertEqual(
+            [json.loads(event.split("data: ")[1])["content"] for event in replay()],
+            [f"Message {i}" for i in range(5)],
+        )
+
+
+class LogStorageArchiveTest(ArchiveTest):
+    """The archives read through with `LogStorage`, its segments trimmed."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # a segment per message, all trimmed once replicated
+        self.storage = LogStorage(
+            directory.name,
+            segment_size=1,
+            replication_interval=0,
+            replication_batch=100,
+        )
+        patcher = patch("messages.api_messages.storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def close(self, days):
+        # copied to the database first, the replication sets last_message_at
+        while self.storage.replicate():
+            pass
+        super().close(days)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.client = SyncTestClient(conversation_router)
+        self.message_client = SyncTestClient(message_router)
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.user = User.objects.create_user("Agent", email="agent@test.com")
+        self.user.groups.add(agent_group)
+
+        self.refund = self.post(None, "I would like a refund for my order")
+        self.refund = self.post(self.refund["conversation"], "Refunds take a week")
+        self.delivery = self.post(None, "Where is my delivery?")
+        self.refunded = self.post(None, "The refund for the delivery")
+
+    def post(self, conversation, content):
+        response = self.message_client.post(
+            "/", json={"conversation": conversation, "content": content}
+        )
+        return response.json()["items"][-1]
+
+    def search(self, query):
+        response = self.client.get(f"/search?q={query}", user=self.user)
+        self.assertEqual(response.status_code, 200, response.json())
+        return response.json()["items"]
+
+    def test_search(self):
+        items = self.search("refund")
+
+        self.assertEqual(
+            [item["conversation"]["uuid"] for item in items],
+            [self.refund["conversation"], self.refunded["conversation"]],
+        )
+        self.assertEqual(items[0]["matches"], 2)
+        self.assertEqual(items[0]["conversation"]["message_count"], 2)
+        self.assertEqual(items[1]["matches"], 1)
+        self.assertEqual(items[1]["message"], self.refunded["id"])
+        self.assertEqual(items[1]["excerpt"], "The refund for the delivery")
+        self.assertGreater(items[1]["rank"], 0)
+
+    def test_all_words(self):
+        items = self.search("delivery refund")
+
+        self.assertEqual(
+            [item["conversation"]["uuid"] for item in items],
+            [self.refunded["conversation"]],
+        )
+
+    def test_index_updated(self):
+        self.assertEqual(self.search("parcel"), [])
+        message = self.post(self.delivery["conversation"], "The parcel is lost")
+
+        [item] = self.search("parcels")
+        self.assertEqual(item["message"], message["id"])
+
+        Message.objects.filter(pk=message["id"]).update(content="It arrived")
+        self.assertEqual(self.search("parcel"), [])
+        self.assertEqual(len(self.search("arrived")), 1)
+
+        Message.objects.filter(pk=self.delivery["id"]).delete()
+        self.assertEqual(
+            [item["conversation"]["uuid"] for item in self.search("delivery")],
+            [self.refunded["conversation"]],
+        )
+
+    def test_query_syntax_not_exposed(self):
+        for query in ['"refund', "refund OR", "NEAR(refund", "*", ""]:
+            self.search(query)
+        self.assertEqual(self.search("*"), [])
+
+    def test_limit(self):
+        response = self.client.get("/search?q=refund&limit=1", user=self.user)
+
+        self.assertEqual(len(response.json()["items"]), 1)
+
+    def test_not_agent(self):
+        response = self.client.get("/search?q=refund")
+
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(CHAT_MESSAGE_COMPRESS_MIN_LENGTH=100, CHAT_MESSAGE_PREVIEW_LENGTH=20)
+class CompressionTest(TestCase):
+    def setUp(self):
+        self.client = SyncTestClient(message_router)
+        self.conversation = Conversation.objects.create()
+        self.log = "\n".join(f"ERROR line {i}: disk full" for i in range(50))
+
+    def stored(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT content FROM {Message._meta.db_table} WHERE id = %s",
+                [message.id],
+            )
+            return cursor.fetchone()[0]
+
+    def create(self, content):
+        return self.conversation.messages.create(content=content, author="CUS")
+
+    @skipUnless(connection.vendor == "sqlite", "TOAST compresses on PostgreSQL")
+    def test_compressed(self):
+        message = self.create(self.log)
+
+        self.assertTrue(self.stored(message).startswith(MARKER))
+        self.assertLess(len(self.stored(message)), len(self.log) / 4)
+        message.refresh_from_db()
+        self.assertEqual(message.content, self.log)
+        self.assertEqual(
+            list(Message.objects.values_list("content", flat=True)), [self.log]
+        )
+
+    def test_not_compressed(self):
+        short = self.create("Hello")
+        # looks like compressed data
+        marked = self.create(MARKER + "Hello")
+        with self.settings(CHAT_MESSAGE_COMPRESS_MIN_LENGTH=None):
+            log = self.create(self.log)
+
+        self.assertEqual(self.stored(short), "Hello")
+        self.assertEqual(self.stored(log), self.log)
+        self.assertEqual(
+            list(Message.objects.order_by("id").values_list("content", flat=True)),
+            ["Hello", MARKER + "Hello", self.log],
+        )
+        self.assertEqual(Message.objects.get(content__contains="disk"), log)
+        self.assertNotEqual(self.stored(marked), MARKER + "Hello")
+
+    @skipUnless(connection.vendor == "sqlite", "TOAST compresses on PostgreSQL")
+    def test_compress_messages(self):
+        with self.settings(CHAT_MESSAGE_COMPRESS_MIN_LENGTH=None):
+            log = self.create(self.log)
+        short = self.create("Hello")
+
+        out = StringIO()
+        call_command("compress_messages", stdout=out)
+
+        self.assertEqual(out.getvalue(), "1 messages rewritten\n")
+        self.assertTrue(self.stored(log).startswith(MARKER))
+        self.assertEqual(self.stored(short), "Hello")
+        log.refresh_from_db()
+        self.assertEqual(log.content, self.log)
+
+    @skipUnless(connection.vendor == "sqlite", "TOAST compresses on PostgreSQL")
+    def test_compressed_indexed(self):
+        log = self.create(self.log)
+        self.assertTrue(self.stored(log).startswith(MARKER))
+
+        [match] = search("disk", 10)
+        self.assertEqual(match.message, log.id)
+        self.assertIn("disk full", match.excerpt)
+
+        with self.settings(CHAT_MESSAGE_COMPRESS_MIN_LENGTH=None):
+            plain = self.create(self.log.replace("disk", "drive"))
+        self.assertEqual(search("drive", 10)[0].matches, 1)
+        call_command("compress_messages", stdout=StringIO())
+        self.assertTrue(self.stored(plain).startswith(MARKER))
+        self.assertEqual(search("drive", 10)[0].matches, 1)
+
+        # the index stays consistent
+        log.delete()
+        self.assertEqual(search("disk", 10), [])
+        Message.objects.update(content="The disk is empty")
+        self.assertEqual(search("empty", 10)[0].matches, 1)
+        self.assertEqual(search("drive", 10), [])
+
+    def test_preview(self):
+        log = self.create(self.log)
+        short = self.create("Hello")
+        conversation = self.conversation.uuid
+
+        for fast in [True, False]:
+            with self.settings(CHAT_FAST_SERIALIZATION=fast):
+                response = self.client.get(f"/{conversation}/?preview=true")
+            self.assertEqual(
+                response.json()["items"],
+                [
+                    {
+                        "id": log.id,
+                        "date": ANY,
+                        "content": self.log[:20],
+                        "author": "CUS",
+                        "conversation": str(conversation),
+                        "truncated": True,
+                    },
+                    {
+                        "id": short.id,
+                        "date": ANY,
+                        "content": "Hello",
+                        "author": "CUS",
+                        "conversation": str(conversation),
+                    },
+                ],
+            )
+
+        # full content
+        response = self.client.get(f"/{conversation}/{log.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["content"], self.log)
+
+        # cached rows aren't truncated
+        self.client.post("/", json={"conversation": str(conversation), "content": "Hi"})
+        response = self.client.get(f"/{conversation}/?preview=true")
+        self.assertEqual(response.json()["items"][0].get("truncated"), True)
+        response = self.client.get(f"/{conversation}/")
+        self.assertEqual(response.json()["items"][0]["content"], self.log)
+
+    def test_get_message(self):
+        message = self.create("Hello")
+
+        response = self.client.get(f"/{self.conversation.uuid}/{message.id}")
+        self.assertEqual(response.json()["content"], "Hello")
+        self.assertEqual(response.json()["conversation"], str(self.conversation.uuid))
+
+        response = self.client.get(f"/{uuid.uuid4()}/{message.id}")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f"/{self.conversation.uuid}/{message.id + 1}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_archived_message(self):
+        for content in [self.log, "Hello"]:
+            self.client.post(
+                "/",
+                json={"conversation": str(self.conversation.uuid), "content": content},
+            )
+        first = Message.objects.earliest("id")
+        Conversation.objects.filter(id=self.conversation.id).update(
+            status=Conversation.ConversationStatus.CLOSED,
+            last_message_at=timezone.now() - datetime.timedelta(days=100),
+        )
+        call_command("archive_messages", stdout=StringIO())
+        self.assertFalse(Message.objects.filter(id=first.id).exists())
+
+        response = self.client.get(f"/{self.conversation.uuid}/{first.id}")
+        self.assertEqual(response.json()["content"], self.log)
+
+
+@skipUnless(connection.vendor == "postgresql", "partitioning needs PostgreSQL")
+class PartitionTest(TransactionTestCase):
+    def test_partition_messages(self):
+        conversation = Conversation.objects.create()
+        old = conversation.messages.create(content="Old", author="CUS")
+        table = Message._meta.db_table
+
+        out = StringIO()
+        call_command("partition_messages", size=100, dry_run=True, stdout=out)
+        self.assertIn("PARTITION BY RANGE (id)", out.getvalue())
+        self.assertIn(f"{table}_p1 created", out.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relkind FROM pg_class WHERE oid = %s::regclass", [table]
+            )
+            self.assertEqual(cursor.fetchone()[0], "r")
+
+        call_command("partition_messages", size=100, ahead=1, stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname FROM pg_class WHERE relkind = 'r' "
+                "AND relname LIKE %s ORDER BY relname",
+                [f"{table}_%"],
+            )
+            self.assertEqual(
+                [name for name, in cursor.fetchall()],
+                [f"{table}_legacy", f"{table}_p1", f"{table}_p2"],
+            )
+
+        response = Client().post(
+            "/api/messages/",
+            {"conversation": str(conversation.uuid), "content": "New"},
+            content_type="application/json",
+        )
+        new = response.json()["items"][-1]
+        self.assertEqual(new["id"], 100)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_id, 100)
+
+        # emptied by the archival
+        Message.objects.filter(pk=old.pk).delete()
+        out = StringIO()
+        call_command("partition_messages", size=100, drop_empty=True, stdout=out)
+        self.assertIn(f"{table}_legacy dropped", out.getvalue())
+
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        self.message_client = SyncTestClient(message_router)
+        self.async_client = TestAsyncClient(message_router)
+        self.conversation_client = SyncTestClient(conversation_router)
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.agent = User.objects.create_user("Agent", email="agent@test.com")
+        self.agent.groups.add(agent_group)
+        self.agent2 = User.objects.create_user("Agent2", email="agent2@test.com")
+        self.agent2.groups.add(agent_group)
+
+    def post(self, conversation=None):
+        data = {"content": "Hello"}
+        if conversation:
+            data["conversation"] = conversation
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.message_client.post("/", json=data).json()["items"][-1]
+
+    def get_messages(self, path, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+
+        @async_to_sync
+        async def get():
+            return await self.async_client.get(path, headers=headers)
+
+        return get()
+
+    def test_list_messages_not_modified(self):
+        message = self.post()
+        path = f"/{message['conversation']}/?since=0"
+        response = self.get_messages(path)
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+        # the last message of the conversation only
+        with self.assertNumQueries(1):
+            response = self.get_messages(path, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response["Vary"], "Accept")
+
+        # other since
+        path2 = f"/{message['conversation']}/?since={message['id']}"
+        response = self.get_messages(path2, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        self.post(message["conversation"])
+        response = self.get_messages(path, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["items"]), 2)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_list_messages_not_modified_without_cache(self):
+        message = self.post()
+        path = f"/{message['conversation']}/"
+        etag = self.get_messages(path)["ETag"]
+        caches["messages"].clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_messages(path, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("messages_message", queries[0]["sql"])
+
+        response = self.get_messages(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_list_messages_unknown_version(self):
+        response = self.get_messages(f"/{uuid.uuid4()}/", "*")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_list_conversations_not_modified(self):
+        conversation = Conversation.objects.create()
+        response = self.conversation_client.get("/?status=OPEN", user=self.agent)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.conversation_client.get(
+                "/?status=OPEN", user=self.agent, headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, 304)
+
+        # per filter and per user, as assigned_to_me depends on it
+        response = self.conversation_client.get(
+            "/", user=self.agent, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.conversation_client.get(
+            "/?status=OPEN", user=self.agent2, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            conversation.status = Conversation.ConversationStatus.CLOSED
+            conversation.save()
+        response = self.conversation_client.get(
+            "/?status=OPEN", user=self.agent, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"], [])
+
+    def test_list_conversations_changed_by_new_message(self):
+        message = self.post()
+        etag = self.conversation_client.get("/", user=self.agent)["ETag"]
+
+        self.post(message["conversation"])
+
+        response = self.conversation_client.get(
+            "/", user=self.agent, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"][0]["message_count"], 2)
+
+    def test_version_cache_down(self):
+        cache = Mock()
+        cache.set.side_effect = cache.get.side_effect = OSError
+        cache.aget.side_effect = OSError
+        with patch("messages.conditional._cache", return_value=cache):
+            with self.assertLogs("messages.conditional", "ERROR"):
+                # stored, so not failed by the version
+                message = self.post()
+            self.assertTrue(Message.objects.filter(pk=message["id"]).exists())
+
+            with self.assertLogs("messages.conditional", "ERROR"):
+                response = self.conversation_client.get("/", user=self.agent)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+
+class RolesTest(TestCase):
+    def setUp(self):
+        self.agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.user = User.objects.create_user("Bob", email="bob@test.com")
+
+    def test_roles_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_roles(self.user), frozenset())
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_roles(self.user), frozenset())
+
+    def test_roles_are_looked_up_once_per_request(self):
+        request = HttpRequest()
+        request.user = self.user
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertFalse(is_agent(request))
+            cache.clear()
+            self.assertFalse(is_agent(request))
+
+    def test_anonymous_has_no_roles(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_roles(AnonymousUser()), frozenset())
+
+    def test_invalidated_on_user_groups_change(self):
+        self.assertEqual(get_user_roles(self.user), frozenset())
+
+        self.user.groups.add(self.agent_group)
+        self.assertEqual(get_user_roles(self.user), {"agent"})
+
+        self.user.groups.remove(self.agent_group)
+        self.assertEqual(get_user_roles(self.user), frozenset())
+
+        self.user.groups.add(self.agent_group)
+        get_user_roles(self.user)
+        self.user.groups.clear()
+        self.assertEqual(get_user_roles(self.user), frozenset())
+
+    def test_invalidated_on_group_users_change(self):
+        self.assertEqual(get_user_roles(self.user), frozenset())
+
+        self.agent_group.user_set.add(self.user)
+        self.assertEqual(get_user_roles(self.user), {"agent"})
+
+        self.agent_group.user_set.clear()
+        self.assertEqual(get_user_roles(self.user), frozenset())
+
+    def test_invalidated_on_group_rename_and_delete(self):
+        group = Group.objects.create(name="support")
+        self.user.groups.add(group)
+        self.assertEqual(get_user_roles(self.user), {"support"})
+
+        group.name = "supervisor"
+        group.save()
+        self.assertEqual(get_user_roles(self.user), {"supervisor"})
+
+        group.delete()
+        self.assertEqual(get_user_roles(self.user), frozenset())
+
+
+class NegotiationTest(TestCase):
+    def setUp(self):
+        # attached to the API of the test clients by the other tests, which
+        # only renders JSON
+        for router in [message_router, conversation_router]:
+            router.set_api_instance(api)
+        self.conversation = Conversation.objects.create()
+        self.messages = [
+            self.conversation.messages.create(content=content, author=author)
+            for content, author in [("Hello", "CUS"), ("Hi", "AGE"), ("Bye", "CUS")]
+        ]
+        # the version of the ETag
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            last_message=self.messages[-1]
+        )
+        self.path = f"/api/messages/{self.conversation.uuid}/"
+
+    def get(self, path, **headers):
+        return Client().get(path, headers=headers)
+
+    def test_json_by_default(self):
+        for accept in [None, "*/*", "text/html, application/json;q=0.9"]:
+            response = self.get(self.path, **({"Accept": accept} if accept else {}))
+
+            self.assertEqual(
+                response["Content-Type"], "application/json; charset=utf-8"
+            )
+            self.assertIn("Accept", response["Vary"].split(", "))
+            self.assertEqual(len(response.json()["items"]), 3)
+
+    def test_columnar(self):
+        expected = {
+            "count": 3,
+            "next": None,
+            "length": 3,
+            "columns": {
+                "id": [message.id for message in self.messages],
+                "date": ANY,
+                "content": ["Hello", "Hi", "Bye"],
+                "author": ["CUS", "AGE", "CUS"],
+            },
+            "constants": {"conversation": str(self.conversation.uuid)},
+        }
+        accept = "application/vnd.chat.columnar+json"
+
+        for fast in [True, False]:
+            with self.settings(CHAT_FAST_SERIALIZATION=fast):
+                response = self.get(self.path, Accept=accept)
+
+            self.assertEqual(response["Content-Type"], f"{accept}; charset=utf-8")
+            self.assertEqual(json.loads(response.content), expected)
+
+        # the JSON cached by the client is not columnar
+        etag = self.get(self.path)["ETag"]
+        response = self.get(self.path, Accept=accept, If_None_Match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        response = self.get(self.path, Accept=accept, If_None_Match=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Vary"], "Accept")
+
+    def test_columnar_conversations(self):
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        agent = User.objects.create_user("Agent", email="agent@test.com")
+        agent.groups.add(agent_group)
+        Conversation.objects.create(assignee=agent)
+        client = Client()
+        client.force_login(agent)
+
+        response = client.get(
+            "/api/conversation/",
+            headers={"Accept": "application/vnd.chat.columnar+json"},
+        )
+
+        result = json.loads(response.content)
+        self.assertEqual(result["length"], 2)
+        self.assertEqual(result["columns"]["assignee"], [None, agent.id])
+        self.assertEqual(result["constants"]["status"], "OPEN")
+
+    def test_errors(self):
+        response = self.get(
+            f"/api/messages/{self.conversation.uuid}/?limit=0",
+            Accept="application/vnd.chat.columnar+json",
+        )
+
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("detail", json.loads(response.content))
+
+    def test_quality(self):
+        accept = "application/vnd.chat.columnar+json;q=0.5, application/json"
+        self.assertEqual(
+            self.get(self.path, Accept=accept)["Content-Type"],
+            "application/json; charset=utf-8",
+        )
+        self.assertEqual(
+            parse_accept("a;q=0.5, b, c;q=0, d;q=x, E"),
+            [("b", 1.0), ("e", 1.0), ("a", 0.5), ("c", 0.0), ("d", 0.0)],
+        )
+
+    @skipUnless(renderers.msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        response = self.get(self.path, Accept="application/msgpack")
+
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        result = renderers.msgpack.unpackb(response.content)
+        self.assertEqual(result["items"][0]["content"], "Hello")
+        self.assertEqual(
+            result["items"][0]["conversation"], str(self.conversation.uuid)
+        )
+
+    def test_msgpack_not_installed(self):
+        with patch.dict(renderers.FORMATS):
+            renderers.FORMATS.pop("application/msgpack", None)
+            response = self.get(self.path, Accept="application/msgpack")
+
+        self.assertEqual(response["Content-Type"], "application/json; charset=utf-8")
+
+    @override_settings(CHAT_COMPRESS_MIN_SIZE=100)
+    def test_gzip(self):
+        response = self.get(self.path, Accept_Encoding="gzip, deflate")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        self.assertIn("Accept-Encoding", response["Vary"].split(", "))
+        self.assertTrue(response["ETag"].startswith("W/"))
+        self.assertEqual(json.loads(gzip.decompress(response.content))["count"], 3)
+
+        for encoding in ["", "gzip;q=0", "identity"]:
+            response = self.get(self.path, Accept_Encoding=encoding)
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertEqual(response.json()["count"], 3)
+
+    def test_not_compressed(self):
+        # smaller than CHAT_COMPRESS_MIN_SIZE
+        response = self.get(self.path, Accept_Encoding="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+        # pages
+        with self.settings(CHAT_COMPRESS_MIN_SIZE=1):
+            response = self.get("/api/docs", Accept_Encoding="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @skipUnless(middleware.brotli, "brotli is not installed")
+    @override_settings(CHAT_COMPRESS_MIN_SIZE=100)
+    def test_brotli(self):
+        response = self.get(self.path, Accept_Encoding="gzip, br")
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(
+            json.loads(middleware.brotli.decompress(response.content))["count"], 3
+        )
+
+
+@override_settings(
+    ROOT_URLCONF=settings_api.ROOT_URLCONF, MIDDLEWARE=settings_api.MIDDLEWARE
+)
+class ApiSettingsTest(TestCase):
+    def setUp(self):
+        for router in [message_router, conversation_router]:
+            router.set_api_instance(api)
+
+    def test_serves_api_only(self):
+        self.assertNotIn("django.contrib.admin", settings_api.INSTALLED_APPS)
+        customer = Client()
+        response = customer.post(
+            "/api/messages/", {"content": "Hello"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        conversation = response.json()["items"][0]["conversation"]
+
+        response = customer.get(f"/api/messages/{conversation}/")
+        self.assertEqual(
+            [item["content"] for item in response.json()["items"]], ["Hello"]
+        )
+        self.assertEqual(customer.get("/admin/").status_code, 404)
+
+    def test_csrf_checked_without_middleware(self):
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        user = User.objects.create_user("Agent", email="agent@test.com")
+        user.groups.add(agent_group)
+        conversation = Conversation.objects.create()
+        agent = Client(enforce_csrf_checks=True)
+        agent.force_login(user)
+        path = f"/api/conversation/{conversation.id}/take"
+
+        self.assertEqual(agent.patch(path).status_code, 403)
+
+        token = "a" * 32
+        agent.cookies[settings.CSRF_COOKIE_NAME] = token
+        response = agent.patch(path, headers={"X-CSRFToken": token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_docs_schema_built_once(self):
+        api._schemas.clear()
+        with patch("ninja.main.get_schema", side_effect=get_schema) as built:
+            for _ in range(2):
+                response = Client().get("/api/openapi.json")
+                self.assertEqual(response.status_code, 200)
+                self.assertIn("/api/messages/", response.json()["paths"])
+        self.assertEqual(built.call_count, 1)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.reset()
+        caches["messages"].clear()
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.agent = User.objects.create_user("Agent", email="agent@test.com")
+        self.agent.groups.add(agent_group)
+        self.conversation = Conversation.objects.create()
+        self.conversation.messages.create(content="Hello", author="CUS")
+
+    def sample(self, name, operation, **labels):
+        labels = "".join(f',{key}="{value}"' for key, value in labels.items())
+        line = f'{name}{{operation="{operation}"{labels}}} '
+        for row in metrics.render().splitlines():
+            if row.startswith(line):
+                return float(row[len(line) :])
+        return None
+
+    def test_sync_request(self):
+        client = Client()
+        client.force_login(self.agent)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/api/conversation/")
+
+        self.assertEqual(
+            self.sample("chat_requests_total", "list_conversations", status=200), 1
+        )
+        self.assertEqual(
+            self.sample("chat_request_queries_sum", "list_conversations"),
+            len(queries),
+        )
+        self.assertEqual(
+            self.sample("chat_response_size_bytes_sum", "list_conversations"),
+            len(response.content),
+        )
+        self.assertEqual(
+            self.sample(
+                "chat_request_duration_seconds_bucket",
+                "list_conversations",
+                le="+Inf",
+            ),
+            1,
+        )
+        self.assertGreater(
+            self.sample(
+                "chat_request_sql_duration_seconds_total", "list_conversations"
+            ),
+            0,
+        )
+
+    def test_async_request(self):
+        client = AsyncClient()
+
+        @async_to_sync
+        async def get(path):
+            return await client.get(path)
+
+        with CaptureQueriesContext(connection) as queries:
+            get(f"/api/messages/{self.conversation.uuid}/")
+            get(f"/api/messages/{uuid.uuid4()}/")
+
+        self.assertEqual(
+            self.sample("chat_requests_total", "list_messages", status=200), 2
+        )
+        self.assertEqual(
+            self.sample("chat_request_queries_sum", "list_messages"), len(queries)
+        )
+
+    def test_not_found_not_recorded(self):
+        Client().get("/api/unknown")
+
+        self.assertNotIn("operation=", metrics.render())
+
+    def test_metrics_endpoint(self):
+        Client().post(
+            "/api/messages/", {"content": "Hello"}, content_type="application/json"
+        )
+
+        with self.settings(CHAT_METRICS_TOKEN="secret"):
+            response = Client().get(
+                "/api/metrics", headers={"Authorization": "Bearer secret"}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        content = response.content.decode()
+        self.assertIn("# TYPE chat_request_duration_seconds histogram", content)
+        self.assertIn(
+            'chat_requests_total{operation="create_message_and_list",status="200"} 1',
+            content,
+        )
+
+    def test_metrics_endpoint_restricted(self):
+        client = Client()
+        self.assertEqual(client.get("/api/metrics").status_code, 401)
+        # an agent
+        client.force_login(self.agent)
+        self.assertEqual(client.get("/api/metrics").status_code, 401)
+        # without a token set, none is valid
+        response = Client().get("/api/metrics", headers={"Authorization": "Bearer "})
+        self.assertEqual(response.status_code, 401)
+        with self.settings(CHAT_METRICS_TOKEN="secret"):
+            response = Client().get(
+                "/api/metrics", headers={"Authorization": "Bearer wrong"}
+            )
+        self.assertEqual(response.status_code, 401)
+
+        self.agent.is_staff = True
+        self.agent.save()
+        self.assertEqual(client.get("/api/metrics").status_code, 200)
+
+    @override_settings(CHAT_METRICS_SLOW_REQUESTS=1)
+    def test_slow_requests_logged(self):
+        client = Client()
+        client.force_login(self.agent)
+
+        with self.assertLogs("messages.metrics", "WARNING") as logs:
+            client.get("/api/conversation/?status=OPEN")
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("GET /api/conversation/?status=OPEN", logs.output[0])
+        self.assertIn('FROM "customer_messages_conversation"', logs.output[0])
+
+
+class RateLimitTest(TestCase):
+    def setUp(self):
+        # attached to the API of the test clients by the other tests, without
+        # its Retry-After handler
+        for router in [message_router, conversation_router]:
+            router.set_api_instance(api)
+        buckets.clear()
+        self.conversation = Conversation.objects.create()
+        self.message = self.conversation.messages.create(content="Hi", author="CUS")
+        self.other = Conversation.objects.create()
+
+    def get(self, conversation, **kwargs):
+        return Client(**kwargs).get(f"/api/messages/{conversation.uuid}/")
+
+    @override_settings(CHAT_RATE_LIMITS={"list_messages": {"conversation": (1, 2)}})
+    def test_conversation(self):
+        for _ in range(2):
+            self.assertEqual(self.get(self.conversation).status_code, 200)
+
+        response = self.get(self.conversation)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertEqual(response.json(), {"detail": "Too many requests."})
+
+        self.assertEqual(self.get(self.other).status_code, 200)
+
+    @override_settings(CHAT_RATE_LIMITS={"list_messages": {"ip": (0.1, 1)}})
+    def test_ip(self):
+        self.assertEqual(self.get(self.conversation).status_code, 200)
+
+        response = self.get(self.other)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "10")
+
+        other_ip = self.get(self.other, REMOTE_ADDR="127.0.0.2")
+        self.assertEqual(other_ip.status_code, 200)
+
+    @override_settings(CHAT_RATE_LIMITS={"list_conversations": {"user": (1, 1)}})
+    def test_user(self):
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        clients = []
+        for name in ["Agent", "Agent2"]:
+            user = User.objects.create_user(name)
+            user.groups.add(agent_group)
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+
+        self.assertEqual(clients[0].get("/api/conversation/").status_code, 200)
+        self.assertEqual(clients[0].get("/api/conversation/").status_code, 429)
+        self.assertEqual(clients[1].get("/api/conversation/").status_code, 200)
+
+    def test_refill(self):
+        self.assertEqual(buckets.take("key", 1000, 1), 0)
+        self.assertGreater(buckets.take("key", 1000, 1), 0)
+        time.sleep(0.002)
+        self.assertEqual(buckets.take("key", 1000, 1), 0)
+
+
+class CoalescingTest(TestCase):
+    def setUp(self):
+        caches["messages"].clear()
+        self.conversation = Conversation.objects.create()
+        self.message = self.conversation.messages.create(content="Hi", author="CUS")
+
+    async def gather(self, *paths):
+        return await asyncio.gather(*(AsyncClient().get(path) for path in paths))
+
+    async def test_identical_polls_share_a_query(self):
+        path = f"/api/messages/{self.conversation.uuid}/"
+        with patch.object(
+            storage, "aget_messages", wraps=storage.aget_messages
+        ) as aget_messages:
+            responses = await self.gather(path, path, path)
+
+        self.assertEqual(aget_messages.call_count, 1)
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["items"][0]["id"], self.message.id)
+        self.assertIsNot(responses[0], responses[1])
+
+    async def test_different_polls(self):
+        path = f"/api/messages/{self.conversation.uuid}/"
+        with patch.object(
+            storage, "aget_messages", wraps=storage.aget_messages
+        ) as aget_messages:
+            await self.gather(path, f"{path}?since={self.message.id}")
+
+        self.assertEqual(aget_messages.call_count, 2)
+
+    @override_settings(CHAT_COALESCE_POLLS=False)
+    async def test_disabled(self):
+        path = f"/api/messages/{self.conversation.uuid}/"
+        with patch.object(
+            storage, "aget_messages", wraps=storage.aget_messages
+        ) as aget_messages:
+            await self.gather(path, path)
+
+        self.assertEqual(aget_messages.call_count, 2)
+
+
+class DatabaseConcurrencyTest(TransactionTestCase):
+    def post(self, conversation, content):
+        response = Client().post(
+            "/api/messages/",
+            {"conversation": str(conversation), "content": content},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def in_thread(self, func, *args):
+        errors = []
+
+        def run():
+            try:
+                func(*args)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, errors
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite journal mode")
+    def test_wal_mode(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+
+    def test_writer_not_blocked_by_reader(self):
+        conversation = Conversation.objects.create()
+        Message.objects.bulk_create(
+            Message(conversation=conversation, content="Hello", author="CUS")
+            for _ in range(500)
+        )
+
+        with connection.cursor() as cursor:
+            # a read in progress
+            cursor.execute(f"SELECT id FROM {Message._meta.db_table}")
+            cursor.fetchone()
+
+            thread, errors = self.in_thread(self.post, conversation.uuid, "Hi")
+            thread.join(5)
+
+            self.assertFalse(thread.is_alive(), "the writer is blocked")
+            self.assertEqual(errors, [])
+            cursor.fetchall()
+
+        self.assertEqual(Message.objects.count(), 501)
+
+    def test_concurrent_writers_and_pollers(self):
+        conversation = Conversation.objects.create()
+
+        def write(writer):
+            for i in range(20):
+                self.post(conversation.uuid, f"{writer}-{i}")
+
+        def poll():
+            for _ in range(40):
+                response = Client().get(f"/api/messages/{conversation.uuid}/")
+                self.assertEqual(response.status_code, 200)
+
+        threads = [self.in_thread(write, writer) for writer in range(4)]
+        threads += [self.in_thread(poll) for _ in range(4)]
+        for thread, errors in threads:
+            thread.join()
+            self.assertEqual(errors, [])
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.messages.count(), 80)
+        self.assertEqual(conversation.message_count, 80)
+        self.assertEqual(
+            conversation.last_message_id, conversation.messages.latest("id").id
+        )
+
+    def test_assignment_contention(self):
+        ids = [
+            conversation.id
+            for conversation in Conversation.objects.bulk_create(
+                Conversation() for _ in range(20)
+            )
+        ]
+        agents = contention.make_agents(4)
+
+        with self.assertLogs("django.request", "WARNING"):
+            results, duration = contention.run_take(agents, ids)
+        # each conversation to one agent, the others conflicting
+        self.assertEqual(results[200], 20)
+        self.assertEqual(results[409], 60)
+        self.assertGreater(20 / duration, 0)
+        for conversation in Conversation.objects.all():
+            self.assertEqual(results[conversation.assignee_id, conversation.id], 1)
+
+        Conversation.objects.update(assignee=None)
+        results, duration = contention.run_dispatch(agents)
+        self.assertEqual(results[200], 20)
+        self.assertEqual(results[204], 4)
+        self.assertEqual([results[id] for id in ids], [1] * 20)
+        self.assertFalse(Conversation.objects.filter(assignee=None).exists())
+
+
+@skipUnless(connection.vendor == "sqlite", "replicated with the SQLite backup API")
+@override_settings(CHAT_DB_REPLICAS=["replica"])
+class ReplicaRouterTest(TransactionTestCase):
+    # the replica below, added once the test databases are set up
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        # a replica lagging behind the primary until `replicate` is called
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings["replica"] = {
+            **connections.settings["default"],
+            "NAME": os.path.join(cls.directory.name, "replica.sqlite3"),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.replicate()
+        caches["messages"].clear()
+
+    def replicate(self):
+        for alias in ("default", "replica"):
+            connections[alias].ensure_connection()
+        connections["default"].connection.backup(connections["replica"].connection)
+
+    def post(self, client, content, conversation=None):
+        data = {"content": content}
+        if conversation:
+            data["conversation"] = conversation
+        response = client.post("/api/messages/", data, content_type="application/json")
+        return response.json()["items"][-1]
+
+    def contents(self, response):
+        return [item["content"] for item in response.json()["items"]]
+
+    def test_polls_read_from_replica(self):
+        writer = Client()
+        conversation = self.post(writer, "Hello")["conversation"]
+        self.replicate()
+        self.post(writer, "Again", conversation)
+        # not served by the cache
+        caches["messages"].clear()
+
+        response = Client().get(f"/api/messages/{conversation}/")
+        self.assertEqual(self.contents(response), ["Hello"])
+
+        # the writer sees its own message
+        self.assertEqual(writer.cookies[PRIMARY_COOKIE]["max-age"], 5)
+        response = writer.get(f"/api/messages/{conversation}/")
+        self.assertEqual(self.contents(response), ["Hello", "Again"])
+
+    def test_since_newer_than_replica(self):
+        writer = Client()
+        first = self.post(writer, "Hello")
+        conversation = first["conversation"]
+        self.replicate()
+        second = self.post(writer, "Again", conversation)
+        self.post(writer, "Third", conversation)
+        caches["messages"].clear()
+
+        # the replica is as new as the client
+        response = Client().get(f"/api/messages/{conversation}/?since={first['id']}")
+        self.assertEqual(self.contents(response), [])
+
+        # the replica doesn't have the messages the client has seen
+        response = Client().get(f"/api/messages/{conversation}/?since={second['id']}")
+        self.assertEqual(self.contents(response), ["Third"])
+
+    def test_long_poll_reads_primary(self):
+        writer = Client()
+        first = self.post(writer, "Hello")
+        self.replicate()
+        self.post(writer, "Again", first["conversation"])
+        caches["messages"].clear()
+
+        response = Client().get(
+            f"/api/messages/{first['conversation']}/?since={first['id']}&wait=1"
+        )
+        self.assertEqual(self.contents(response), ["Again"])
+
+    def test_conversations_read_from_primary(self):
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        user = User.objects.create_user("Agent", email="agent@test.com")
+        user.groups.add(agent_group)
+        agent = Client()
+        agent.force_login(user)
+        Conversation.objects.create()
+        self.replicate()
+        Conversation.objects.create()
+
+        # tagged with the version of the primary, so not read from the replica
+        response = agent.get("/api/conversation/")
+        self.assertEqual(response.json()["count"], 2)
+
+
+class BenchmarkTest(TestCase):
+    def test_load(self):
+        seed(conversations=20, messages=200, agents=2)
+        self.assertEqual(Conversation.objects.count(), 20)
+        self.assertEqual(Message.objects.count(), 200)
+
+        clients = make_clients(customers=10)
+        results, duration = run(InProcessDriver(clients), clients, requests=200)
+
+        self.assertEqual(sum(map(len, results.latencies.values())), 200)
+        self.assertEqual(sum(results.errors.values()), 0)
+        self.assertIn("list_messages", report(results, duration))
+
+    def test_startup(self):
+        # a new process, started with the API entry point
+        times = startup.run(
+            "chat.asgi_api", "/api/openapi.json", connection.settings_dict["NAME"]
+        )
+        self.assertEqual(set(times), {"import", "first", "second", "modules"})
+
+
+@skipUnless(connection.vendor == "sqlite", "query plans are checked on SQLite")
+class QueryPlanTest(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on the queries of each endpoint, failing on scans
+    (searches in an index are expected) and on sorts that don't use an index.
+    """
+
+    def setUp(self):
+        self.message_client = SyncTestClient(message_router)
+        self.async_message_client = TestAsyncClient(message_router)
+        self.conversation_client = SyncTestClient(conversation_router)
+
+        agent_group, _ = Group.objects.get_or_create(name="agent")
+        self.user = User.objects.create_user("Agent", email="agent@test.com")
+        self.user.groups.add(agent_group)
+
+        self.conversation = Conversation.objects.create(assignee=self.user)
+        self.message = self.conversation.messages.create(
+            content="Hello", author=Message.AuthorChoice.CUSTOMER
+        )
+
+    def assertIndexedQueries(self, queries, scan=False):
+        """With `scan`, an index may be scanned, for an unfiltered list."""
+        selects = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        self.assertTrue(selects)
+        for sql in selects:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                if step.startswith("SCAN"):
+                    self.assertTrue(
+                        scan and "USING" in step, f"scan in {plan} for {sql}"
+                    )
+                self.assertNotIn("TEMP B-TREE", step, f"sort in {plan} for {sql}")
+
+    def test_list_messages(self):
+        @async_to_sync
+        async def get(path):
+            return await self.async_message_client.get(path)
+
+        for query in ["", f"?since={self.message.id}", "?count=true"]:
+            with CaptureQueriesContext(connection) as context:
+                response = get(f"/{self.conversation.uuid}/{query}")
+            self.assertEqual(response.status_code, 200)
+            self.assertIndexedQueries(context.captured_queries)
+
+    def test_create_message_and_list(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.message_client.post(
+                f"/?since={self.message.id}",
+                json={"conversation": str(self.conversation.uuid), "content": "Hi"},
+                user=self.user,
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIndexedQueries(context.captured_queries)
+
+    def test_list_conversations(self):
+        queries = [
+            "",
+            "?status=OPEN",
+            "?assigned=true",
+            "?assigned=false",
+            "?assigned_to_me=true",
+            "?status=OPEN&assigned=false",
+            "?status=OPEN&assigned_to_me=true",
+            "?order=recent",
+            "?awaiting_reply=true",
+            "?awaiting_reply=true&order=recent",
+            "?status=OPEN&awaiting_reply=true&order=recent",
+        ]
+        for query in queries:
+            with CaptureQueriesContext(connection) as context:
+                response = self.conversation_client.get(f"/{query}", user=self.user)
+            self.assertEqual(response.status_code, 200)
+            # all of them in the order of conversation_created_idx
+            self.assertIndexedQueries(context.captured_queries, scan=query == "")
+
+    def test_unread_counts(self):
+        ConversationRead.objects.create(
+            agent=self.user,
+            conversation=self.conversation,
+            last_read_id=self.message.id,
+            read_count=0,
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.conversation_client.get("/unread", user=self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertIndexedQueries(context.captured_queries)
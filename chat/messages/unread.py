@@ -0,0 +1,67 @@
+from django.db import transaction
+from django.db.models import F, FilteredRelation, Q
+from django.db.models.functions import Coalesce
+from .models import Conversation, ConversationRead, Message
+
+
+def mark_read(agent, conversation, last_id):
+    """
+    Advances the read cursor of the agent in the conversation (uuid) to the
+    message `last_id`. The counters of the conversation are read from the
+    primary, see `routers.read_primary`.
+    """
+    # the conversation is locked so that no message is added between the reads
+    # of its counter and of the messages after `last_id`, see `add_messages`
+    with transaction.atomic():
+        conv = (
+            Conversation.objects.select_for_update()
+            .filter(uuid=conversation)
+            .values("id", "last_message_id", "customer_message_count")
+            .first()
+        )
+        if conv is None:
+            return
+        read_count = conv["customer_message_count"]
+        if conv["last_message_id"] is not None and conv["last_message_id"] > last_id:
+            # posted since the messages were read
+            read_count -= Message.objects.filter(
+                conversation_id=conv["id"],
+                author=Message.AuthorChoice.CUSTOMER,
+                id__gt=last_id,
+            ).count()
+
+        # only forward, e.g. with an older page read in another tab
+        updated = ConversationRead.objects.filter(
+            agent=agent, conversation_id=conv["id"], last_read_id__lt=last_id
+        ).update(last_read_id=last_id, read_count=read_count)
+        if not updated:
+            ConversationRead.objects.bulk_create(
+                [
+                    ConversationRead(
+                        agent=agent,
+                        conversation_id=conv["id"],
+                        last_read_id=last_id,
+                        read_count=read_count,
+                    )
+                ],
+                ignore_conflicts=True,
+            )
+
+
+def unread_conversations(agent):
+    """
+    The open conversations of the agent's inbox, assigned to them or to
+    nobody, with unread messages of the customer, and their number.
+    """
+    return (
+        Conversation.objects.filter(status=Conversation.ConversationStatus.OPEN)
+        .filter(Q(assignee=agent) | Q(assignee__isnull=True))
+        .annotate(
+            agent_read=FilteredRelation("reads", condition=Q(reads__agent=agent)),
+            unread=F("customer_message_count")
+            - Coalesce(F("agent_read__read_count"), 0),
+        )
+        .filter(unread__gt=0)
+        .order_by("created_at", "id")
+        .values("id", "uuid", "unread")
+    )